@@ -1,11 +1,21 @@
 import os
-from celery import Celery
+from celery import Celery, Task
 
 # Установка переменной окружения для настроек Django
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
+class BroadcastBatchTask(Task):
+    """Задача, уведомления которой отправляются одним сообщением по завершении."""
+    
+    def __call__(self, *args, **kwargs):
+        from core.broadcast import batch
+        
+        with batch():
+            return super().__call__(*args, **kwargs)
+
+
 # Создание экземпляра приложения Celery
-app = Celery('office_desk_booking')
+app = Celery('office_desk_booking', task_cls=BroadcastBatchTask)
 
 # Использование настроек Django для Celery
 app.config_from_object('django.conf:settings', namespace='CELERY')
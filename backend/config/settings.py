@@ -27,6 +27,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     
     # Сторонние приложения
     'rest_framework',
@@ -51,6 +52,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.broadcast.BroadcastBatchMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -84,6 +86,33 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Отправлять уведомления WebSocket из фонового потока, не задерживая ответ
+BROADCAST_IN_BACKGROUND = True
+
+# Сообщения клиентов по WebSocket: лимит на соединение (в секунду и подряд),
+# максимальный размер и время, в течение которого повтор статуса стола отсекается
+WS_RATE_LIMIT_PER_SECOND = float(os.getenv('WS_RATE_LIMIT_PER_SECOND', 5))
+WS_RATE_LIMIT_BURST = int(os.getenv('WS_RATE_LIMIT_BURST', 20))
+WS_MAX_MESSAGE_BYTES = int(os.getenv('WS_MAX_MESSAGE_BYTES', 4096))
+WS_STATUS_DEDUP_SECONDS = int(os.getenv('WS_STATUS_DEDUP_SECONDS', 60))
+
+# Через сколько отброшенных сообщений соединение добавляет свои счетчики к
+# общим в Redis (остаток добавляется при отключении)
+WS_DROPS_FLUSH_EVERY = int(os.getenv('WS_DROPS_FLUSH_EVERY', 100))
+
+# Сообщения сервера меньше этого размера не сжимаются, даже если клиент
+# запросил сжатие (?compress=1)
+WS_COMPRESS_MIN_BYTES = int(os.getenv('WS_COMPRESS_MIN_BYTES', 1024))
+
+# Сколько секунд пользователь считается присутствующим на этаже после
+# последнего ping (клиент шлет его раз в 30 секунд) или отметки о прибытии
+PRESENCE_TTL = int(os.getenv('PRESENCE_TTL', 90))
+
+# Журнал событий групп WebSocket для возобновления потока: сколько событий
+# хранить на группу и сколько секунд хранить журнал без новых событий
+BROADCAST_STREAM_LENGTH = int(os.getenv('BROADCAST_STREAM_LENGTH', 1000))
+BROADCAST_STREAM_TTL = int(os.getenv('BROADCAST_STREAM_TTL', 24 * 60 * 60))
+
 # Настройка базы данных
 DATABASES = {
     'default': {
@@ -102,7 +131,7 @@ AUTH_USER_MODEL = 'users.User'
 # Настройка REST Framework
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'core.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
@@ -144,6 +173,30 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 MEDIA_URL = 'media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Redis для кешей и индексов приложения (отдельная база от брокера Celery)
+REDIS_URL = f"redis://{os.getenv('REDIS_HOST', 'redis')}:{os.getenv('REDIS_PORT', 6379)}/1"
+
+# База Redis для тестов (core.testing): очищается перед каждым тестом
+REDIS_TEST_URL = (
+    f"redis://{os.getenv('REDIS_HOST', 'redis')}:{os.getenv('REDIS_PORT', 6379)}"
+    f"/{int(os.getenv('REDIS_TEST_DB', 15))}"
+)
+
+# Кеш аутентификации по токену: срок жизни в Redis и в памяти процесса
+# (секунды) и число пользователей в памяти процесса. AUTH_CACHE_TTL — также
+# наибольшее время, в течение которого пользователь, деактивированный через
+# QuerySet.update() (без сигналов), остается аутентифицированным
+AUTH_CACHE_TTL = int(os.getenv('AUTH_CACHE_TTL', 60))
+AUTH_CACHE_LOCAL_TTL = int(os.getenv('AUTH_CACHE_LOCAL_TTL', 5))
+AUTH_CACHE_SIZE = int(os.getenv('AUTH_CACHE_SIZE', 1024))
+
+# Сколько секунд хранить готовый пакет схемы офиса в Redis (при изменении
+# схемы он строится заново раньше)
+LAYOUT_BUNDLE_TTL = int(os.getenv('LAYOUT_BUNDLE_TTL', 7 * 24 * 60 * 60))
+
+# Индекс доступности столов: сколько дней вперед прогревает rebuild_availability
+AVAILABILITY_CACHE_DAYS = int(os.getenv('AVAILABILITY_CACHE_DAYS', 30))
+
 # Настройки для Celery
 CELERY_BROKER_URL = f"redis://{os.getenv('REDIS_HOST', 'redis')}:{os.getenv('REDIS_PORT', 6379)}/0"
 CELERY_RESULT_BACKEND = f"redis://{os.getenv('REDIS_HOST', 'redis')}:{os.getenv('REDIS_PORT', 6379)}/0"
@@ -8,6 +8,7 @@ urlpatterns = [
     path('api/users/', include('users.urls')),
     path('api/desks/', include('desks.urls')),
     path('api/reservations/', include('reservations.urls')),
+    path('api/office/', include('core.urls')),
     path('api/office/', include('office_layout.urls')),
 ]
 
@@ -0,0 +1,172 @@
+"""
+Аутентификация по токену с кешированием пользователя.
+
+Пользователь по ключу токена ищется сначала в локальном LRU процесса, затем
+в Redis и только потом в БД, поэтому обычный запрос не выполняет запросов
+аутентификации. Записи сбрасываются сигналами (core.signals) при удалении
+или пересоздании токена и при любом сохранении пользователя, в том числе
+при его деактивации. Локальный кеш других процессов при этом не очищается,
+поэтому его срок жизни (AUTH_CACHE_LOCAL_TTL) выбран коротким.
+
+Массовые изменения через QuerySet.update() (например,
+``User.objects.filter(...).update(is_active=False)``) сигналов не вызывают:
+после них пользователь остается аутентифицированным до истечения
+AUTH_CACHE_TTL. Такой код должен сам вызвать invalidate_tokens().
+
+Оба кеша хранят поля пользователя в JSON (все поля модели, кроме пароля), а
+не объект: данные из общего Redis не исполняются при чтении, каждый запрос
+получает свой экземпляр User, и изменения его атрибутов в одном запросе или
+потоке не видны другим. Пароль у такого экземпляра отложен и читается из БД
+только при обращении к нему.
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import redis
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from core.redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+class LocalCache:
+    """Потокобезопасный LRU-кеш процесса с ограниченным сроком жизни записей."""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+_local_cache = LocalCache(settings.AUTH_CACHE_SIZE, settings.AUTH_CACHE_LOCAL_TTL)
+
+
+def _redis_key(token_key):
+    return f'auth:user:{token_key}'
+
+
+def _cached_fields():
+    """Поля пользователя, хранимые в кеше: все, кроме пароля."""
+    return [field for field in get_user_model()._meta.concrete_fields if field.name != 'password']
+
+
+def _dump_user(user):
+    """Поля пользователя в JSON для кеша."""
+    values = {}
+    for field in _cached_fields():
+        value = field.value_from_object(user)
+        # Даты с микросекундами: при сохранении экземпляра из кеша значения не меняются
+        values[field.attname] = value.isoformat() if isinstance(value, datetime) else value
+    return json.dumps(values).encode()
+
+
+def _load_user(cached):
+    """Новый экземпляр пользователя из полей кеша или None, если запись не читается."""
+    try:
+        values = json.loads(cached)
+        fields = _cached_fields()
+        return get_user_model().from_db(
+            'default',
+            [field.attname for field in fields],
+            [None if values[field.attname] is None else field.to_python(values[field.attname]) for field in fields]
+        )
+    except (ValueError, KeyError, TypeError, ValidationError):
+        logger.warning('Некорректная запись кеша аутентификации')
+        return None
+
+
+def get_user_for_token(token_key):
+    """Активный пользователь по ключу токена или None (новый экземпляр на каждый вызов)."""
+    cached = _local_cache.get(token_key)
+    if cached is not None:
+        return _load_user(cached)
+
+    try:
+        cached = get_redis().get(_redis_key(token_key))
+    except redis.RedisError:
+        logger.exception('Кеш аутентификации недоступен, используется БД')
+        cached = None
+    if cached is not None:
+        user = _load_user(cached)
+        if user is not None:
+            _local_cache.set(token_key, cached)
+            return user
+
+    try:
+        token = Token.objects.select_related('user').get(key=token_key)
+    except Token.DoesNotExist:
+        return None
+    user = token.user
+    if not user.is_active:
+        return None
+
+    cached = _dump_user(user)
+    try:
+        get_redis().set(_redis_key(token_key), cached, ex=settings.AUTH_CACHE_TTL)
+    except redis.RedisError:
+        logger.exception('Не удалось сохранить пользователя в кеш аутентификации')
+    _local_cache.set(token_key, cached)
+    return user
+
+
+def invalidate_tokens(token_keys):
+    """Сбросить кеш аутентификации для токенов."""
+    token_keys = list(token_keys)
+    if not token_keys:
+        return
+    for token_key in token_keys:
+        _local_cache.delete(token_key)
+    try:
+        get_redis().delete(*[_redis_key(token_key) for token_key in token_keys])
+    except redis.RedisError:
+        logger.exception('Не удалось сбросить кеш аутентификации')
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication, который берет пользователя из кеша."""
+
+    def authenticate_credentials(self, key):
+        user = get_user_for_token(key)
+        if user is None:
+            raise exceptions.AuthenticationFailed(_('Invalid token.'))
+        # Объект токена без запроса к БД: достаточно ключа и пользователя
+        return (user, Token(key=key, user=user))
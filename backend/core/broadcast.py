@@ -0,0 +1,142 @@
+"""
+Отправка уведомлений об изменениях в группы WebSocket.
+
+Изменения столов уходят в группу этажа (floor_group), бронирования — в
+группу их владельца (user_group), поэтому клиент получает только то, что
+относится к просматриваемым этажам и к нему самому.
+
+Уведомления ставятся в очередь через transaction.on_commit, поэтому
+откаченные изменения клиентам не отправляются. Внутри пакета (запрос,
+задача Celery, блок ``with batch()``) повторные уведомления об одном и том же
+столе или бронировании схлопываются, и в конце пакета в каждую группу уходит
+одно сообщение со всеми ее изменениями. Сама отправка выполняется в фоновом
+потоке, чтобы время ответа не зависело от задержки слоя каналов.
+
+Перед отправкой событие записывается в журнал группы (core.event_log) и
+получает номер seq, по которому клиент может возобновить поток. Кодируется
+событие уже соединениями, один раз на процесс и кодировку
+(core.protocol.event_frame), поэтому через слой каналов идет только само
+событие.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+
+from asgiref.local import Local
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+
+from core import event_log, protocol
+
+logger = logging.getLogger(__name__)
+
+_state = Local()
+_executor = None
+
+
+def floor_group(floor):
+    """Группа клиентов, просматривающих этаж."""
+    return f'floor_{floor}'
+
+
+def user_group(user_id):
+    """Группа соединений пользователя."""
+    return f'user_{user_id}'
+
+
+def send(group, message, key=None):
+    """
+    Поставить сообщение для группы в очередь на отправку после фиксации транзакции.
+
+    key — (тип объекта, id): сообщения группы с одинаковым ключом в пределах
+    пакета схлопываются в последнее.
+    """
+    transaction.on_commit(partial(_enqueue, group, message, key))
+
+
+def _enqueue(group, message, key):
+    pending = getattr(_state, 'pending', None)
+    if pending is None:
+        # Вне пакета отправляем сразу
+        _flush(group, [message])
+        return
+
+    key = (group, key if key is not None else ('message', len(pending)))
+    if key in pending:
+        message = _merge(pending[key], message)
+    pending[key] = message
+
+
+def _merge(previous, message):
+    """Объединить два уведомления об одном объекте, оставив последнее состояние."""
+    # Созданный и затем измененный объект для клиентов остается созданным
+    if previous.get('action') == 'created' and message.get('action') == 'updated':
+        message = {**message, 'action': 'created'}
+    return message
+
+
+@contextmanager
+def batch():
+    """Собрать уведомления блока и отправить их в конце, по одному сообщению на группу."""
+    if getattr(_state, 'pending', None) is not None:
+        # Вложенный пакет отправляется вместе с внешним
+        yield
+        return
+
+    _state.pending = {}
+    try:
+        yield
+    finally:
+        pending, _state.pending = _state.pending, None
+        by_group = {}
+        for (group, _key), message in pending.items():
+            by_group.setdefault(group, []).append(message)
+        for group, messages in by_group.items():
+            _flush(group, messages)
+
+
+def _flush(group, messages):
+    """Отправить сообщения в группу: одно как есть, несколько — пакетом."""
+    if len(messages) == 1:
+        event = messages[0]
+    else:
+        event = {'type': 'batch_message', 'messages': messages}
+
+    if settings.BROADCAST_IN_BACKGROUND:
+        _get_executor().submit(_group_send, group, event)
+    else:
+        _group_send(group, event)
+
+
+def _get_executor():
+    global _executor
+    if _executor is None:
+        # Один поток сохраняет порядок сообщений
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='broadcast')
+    return _executor
+
+
+def stamp(group, event):
+    """Записать событие в журнал группы и добавить к нему группу и номер."""
+    return {**event, 'stream': group, 'seq': event_log.append(group, event)}
+
+
+def _group_send(group, event):
+    try:
+        async_to_sync(get_channel_layer().group_send)(group, stamp(group, event))
+    except Exception:
+        logger.exception('Не удалось отправить уведомление в группу %s', group)
+
+
+class BroadcastBatchMiddleware:
+    """Объединяет уведомления, порожденные одним запросом, в одно сообщение."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with batch():
+            return self.get_response(request)
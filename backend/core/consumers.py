@@ -1,19 +1,79 @@
 import json
+import logging
+from collections import Counter
+from urllib.parse import parse_qs
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from rest_framework.authtoken.models import Token
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.utils import timezone
+from core import broadcast, event_log, presence, protocol, throttling
+from core.authentication import get_user_for_token
+from desks.models import Desk, DeskStatus
+from reservations.models import Reservation, ReservationStatus
+
+logger = logging.getLogger(__name__)
 
 User = get_user_model()
 
+# Сколько этажей одновременно может просматривать одно соединение
+MAX_SUBSCRIBED_FLOORS = 20
+
+# Сколько событий групп держать, пока клиент, обещавший resume, его не прислал
+MAX_HELD_EVENTS = 1000
+
+# Обязательные поля и их типы для сообщений клиента
+MESSAGE_SCHEMAS = {
+    'ping': {},
+    'subscribe': {'floors': list},
+    'unsubscribe': {'floors': list},
+    'resume': {'positions': dict},
+    'desk_status_update': {'desk_id': int, 'status': str},
+    'reservation_update': {'reservation_id': int, 'action': str},
+}
+
+# Допустимые значения строковых полей
+MESSAGE_CHOICES = {
+    'status': set(DeskStatus.values),
+    'action': {'created', 'updated', 'deleted'},
+}
+
 
 class OfficeConsumer(AsyncWebsocketConsumer):
-    """WebSocket потребитель для обновлений офиса в реальном времени."""
+    """
+    WebSocket потребитель для обновлений офиса в реальном времени.
+    
+    Соединение состоит в группе своего пользователя (бронирования) и в группах
+    этажей, на которые клиент подписан сообщением subscribe (столы).
+    
+    Кодировка сообщений сервера выбирается при подключении (?encoding=json,
+    compact или msgpack), сжатие снимков — ?compress=1 (см. core.protocol).
+    Клиент всегда присылает сообщения в JSON.
+    
+    Клиент, который после переподключения пришлет resume, указывает
+    ?resume=1: до окончания досылки события групп придерживаются, иначе
+    живое событие с большим seq пришло бы раньше пропущенных.
+    """
     
     async def connect(self):
         """Подключение к WebSocket."""
-        self.office_group_name = 'office_updates'
         self.user = None
+        self.user_group_name = None
+        self.subscribed_floors = set()
+        self.rate_limiter = throttling.TokenBucket(
+            settings.WS_RATE_LIMIT_PER_SECOND, settings.WS_RATE_LIMIT_BURST
+        )
+        self.dropped = Counter()
+        
+        query = parse_qs(self.scope.get('query_string', b'').decode())
+        self.encoding = query.get('encoding', [protocol.DEFAULT_ENCODING])[-1]
+        if self.encoding not in protocol.ENCODINGS:
+            self.encoding = protocol.DEFAULT_ENCODING
+        self.compress = query.get('compress', ['0'])[-1] in ('1', 'true')
+        # События групп, придержанные до resume, и номера, уже досланные им
+        self.held_events = [] if query.get('resume', ['0'])[-1] in ('1', 'true') else None
+        self.replayed = {}
         
         # Авторизация по токену
         token_key = self.scope['url_route']['kwargs'].get('token')
@@ -25,102 +85,334 @@ class OfficeConsumer(AsyncWebsocketConsumer):
             await self.close()
             return
         
-        # Добавляем пользователя в группу
+        # Добавляем соединение в группу пользователя
+        self.user_group_name = broadcast.user_group(self.user.id)
         await self.channel_layer.group_add(
-            self.office_group_name,
+            self.user_group_name,
             self.channel_name
         )
         
         await self.accept()
         
         # Отправляем приветственное сообщение
-        await self.send(text_data=json.dumps({
+        await self.send_message({
             'type': 'connection_established',
-            'message': 'Подключение установлено'
-        }))
+            'message': 'Подключение установлено',
+            'encoding': self.encoding
+        })
+        
+        # Этажи можно указать сразу при подключении: ?floors=1,2
+        floors = [floor for value in query.get('floors', []) for floor in value.split(',')]
+        if floors:
+            await self.subscribe_floors(floors)
     
     async def disconnect(self, close_code):
         """Отключение от WebSocket."""
-        # Удаляем пользователя из группы
-        await self.channel_layer.group_discard(
-            self.office_group_name,
-            self.channel_name
-        )
+        await self.flush_drops()
+        
+        # Удаляем соединение из всех групп
+        groups = {broadcast.floor_group(floor) for floor in self.subscribed_floors}
+        if self.user_group_name:
+            groups.add(self.user_group_name)
+        for group in groups:
+            await self.channel_layer.group_discard(group, self.channel_name)
+    
+    async def drop(self, reason):
+        """Учесть отброшенное сообщение клиента."""
+        self.dropped[reason] += 1
+        if self.dropped.total() >= settings.WS_DROPS_FLUSH_EVERY:
+            await self.flush_drops()
+    
+    async def flush_drops(self):
+        """Добавить накопленные счетчики отброшенных сообщений к общим в Redis."""
+        if not self.dropped:
+            return
+        logger.info('Соединение %s: отброшено сообщений %s', self.channel_name, dict(self.dropped))
+        dropped, self.dropped = self.dropped, Counter()
+        await sync_to_async(throttling.record_drops)(dropped)
     
-    async def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
         """Получение сообщения от клиента."""
-        data = json.loads(text_data)
-        message_type = data.get('type', '')
+        # Лимит проверяется до разбора сообщения, чтобы поток отсекался дешево
+        if not self.rate_limiter.consume():
+            await self.drop('rate_limited')
+            return
+        if text_data is None or len(text_data) > settings.WS_MAX_MESSAGE_BYTES:
+            await self.drop('too_large' if text_data else 'invalid')
+            return
+        
+        try:
+            data = json.loads(text_data)
+        except ValueError:
+            data = None
+        error = validate_message(data)
+        if error:
+            await self.drop('invalid')
+            await self.send_message({'type': 'error', 'error': error})
+            return
+        message_type = data['type']
         
         # Обработка различных типов сообщений
-        if message_type == 'desk_status_update':
+        if message_type == 'subscribe':
+            # Подписка на этажи
+            await self.subscribe_floors(data.get('floors', []))
+        elif message_type == 'unsubscribe':
+            # Отписка от этажей
+            await self.unsubscribe_floors(data.get('floors', []))
+        elif message_type == 'resume':
+            # Досылка событий, пропущенных за время разрыва соединения
+            await self.resume(data.get('positions'))
+        elif message_type == 'desk_status_update':
             # Обновление статуса стола
             await self.handle_desk_status_update(data)
         elif message_type == 'reservation_update':
             # Обновление бронирования
             await self.handle_reservation_update(data)
         elif message_type == 'ping':
-            # Пинг для проверки соединения
-            await self.send(text_data=json.dumps({
+            # Пинг для проверки соединения, он же сигнал присутствия на этажах
+            await sync_to_async(presence.heartbeat)(self.user.id, self.subscribed_floors)
+            await self.send_message({
                 'type': 'pong',
                 'timestamp': data.get('timestamp')
-            }))
+            })
+    
+    async def subscribe_floors(self, floors):
+        """Подписать соединение на обновления этажей."""
+        for floor in parse_floors(floors):
+            if floor in self.subscribed_floors:
+                continue
+            if len(self.subscribed_floors) >= MAX_SUBSCRIBED_FLOORS:
+                break
+            await self.channel_layer.group_add(broadcast.floor_group(floor), self.channel_name)
+            self.subscribed_floors.add(floor)
+        
+        await self.send_subscriptions()
+    
+    async def send_subscriptions(self):
+        """Сообщить клиенту текущий список этажей, на которые он подписан."""
+        await self.send_message({
+            'type': 'subscribed',
+            'floors': sorted(self.subscribed_floors)
+        })
+    
+    async def unsubscribe_floors(self, floors):
+        """Отписать соединение от обновлений этажей."""
+        for floor in parse_floors(floors):
+            if floor in self.subscribed_floors:
+                await self.channel_layer.group_discard(broadcast.floor_group(floor), self.channel_name)
+                self.subscribed_floors.discard(floor)
+        
+        await self.send_subscriptions()
+    
+    async def resume(self, positions):
+        """
+        Дослать события, пропущенные после последних полученных клиентом номеров.
+        
+        positions — {группа: последний seq}. Если пропущенные события уже
+        вытеснены из журнала группы, вместо них отправляется полный снимок.
+        Придержанные до resume события отправляются после досылки, кроме уже
+        досланных. Пока resume выполняется, новые события групп ждут в очереди
+        соединения: сообщения потребителю обрабатываются по одному.
+        """
+        if not isinstance(positions, dict):
+            await self.release_held_events()
+            return
+        
+        groups = {self.user_group_name} | {
+            broadcast.floor_group(floor) for floor in self.subscribed_floors
+        }
+        current = {}
+        for group, last_seq in positions.items():
+            if group not in groups:
+                continue
+            try:
+                last_seq = int(last_seq)
+            except (TypeError, ValueError):
+                continue
+            
+            missed = await sync_to_async(event_log.read_since)(group, last_seq)
+            if missed is None:
+                current[group] = await self.send_snapshot(group)
+                continue
+            
+            current[group], events = missed
+            for seq, event in events:
+                await self.send_message(
+                    protocol.client_message({**event, 'stream': group, 'seq': seq})
+                )
+        
+        await self.send_message({
+            'type': 'resumed',
+            'positions': current
+        })
+        
+        for group, seq in current.items():
+            self.replayed[group] = max(self.replayed.get(group, 0), seq)
+        await self.release_held_events()
+    
+    async def send_snapshot(self, group):
+        """Отправить полное текущее состояние группы. Возвращает его seq."""
+        seq, snapshot = await self.get_snapshot(group)
+        await self.send_message({
+            'type': 'snapshot',
+            'stream': group,
+            'seq': seq,
+            **snapshot
+        }, compress=True)
+        return seq
+    
+    async def send_message(self, message, compress=False):
+        """Отправить сообщение в кодировке соединения."""
+        await self.send_frame(protocol.encode(message, self.encoding, compress and self.compress))
+    
+    async def send_frame(self, frame):
+        """Отправить готовый кадр: строка — текстовый, байты — бинарный."""
+        if isinstance(frame, bytes):
+            await self.send(bytes_data=frame)
+        else:
+            await self.send(text_data=frame)
+    
+    async def send_event(self, event):
+        """Отправить событие группы готовым кадром, общим для соединений процесса."""
+        if self.held_events is not None:
+            self.held_events.append(event)
+            if len(self.held_events) <= MAX_HELD_EVENTS:
+                return
+            # resume так и не пришел: отдаем накопленное, пропуски клиент запросит сам
+            await self.release_held_events()
+            return
+        
+        seq = event.get('seq')
+        if seq is not None and seq <= self.replayed.get(event.get('stream'), 0):
+            # Событие уже дослано при возобновлении
+            return
+        
+        await self.send_frame(protocol.event_frame(event, self.encoding))
+    
+    async def release_held_events(self):
+        """Перестать придерживать события групп и отправить накопленные."""
+        held, self.held_events = self.held_events, None
+        for event in held or []:
+            await self.send_event(event)
     
     async def handle_desk_status_update(self, data):
         """Обработка обновления статуса стола."""
         # Если есть необходимость в бизнес-логике при обновлении статуса,
         # она может быть реализована здесь
+        floor = await self.get_desk_floor(data['desk_id'])
+        if floor is None:
+            await self.drop('invalid')
+            return
         
-        # Отправляем обновление всем пользователям в группе
-        await self.channel_layer.group_send(
-            self.office_group_name,
-            {
-                'type': 'desk_status_update_message',
-                'desk_id': data.get('desk_id'),
-                'status': data.get('status'),
-                'updated_by': self.user.username
-            }
-        )
+        # Тот же статус уже разослан — повторно не отправляем
+        if await sync_to_async(throttling.is_duplicate_desk_status)(data['desk_id'], data['status']):
+            await self.drop('duplicate')
+            return
+        
+        # Отправляем обновление клиентам, просматривающим этаж стола
+        group = broadcast.floor_group(floor)
+        await self.channel_layer.group_send(group, await sync_to_async(broadcast.stamp)(group, {
+            'type': 'desk_status_update_message',
+            'desk_id': data.get('desk_id'),
+            'status': data.get('status'),
+            'updated_by': self.user.username
+        }))
     
     async def handle_reservation_update(self, data):
         """Обработка обновления бронирования."""
         # Если есть необходимость в бизнес-логике при обновлении бронирования,
         # она может быть реализована здесь
         
-        # Отправляем обновление всем пользователям в группе
-        await self.channel_layer.group_send(
-            self.office_group_name,
-            {
-                'type': 'reservation_update_message',
-                'reservation_id': data.get('reservation_id'),
-                'action': data.get('action'),
-                'updated_by': self.user.username
-            }
-        )
+        # Отправляем обновление другим соединениям пользователя
+        group = self.user_group_name
+        await self.channel_layer.group_send(group, await sync_to_async(broadcast.stamp)(group, {
+            'type': 'reservation_update_message',
+            'reservation_id': data.get('reservation_id'),
+            'action': data.get('action'),
+            'updated_by': self.user.username
+        }))
     
     async def desk_status_update_message(self, event):
         """Отправка сообщения об обновлении статуса стола клиентам."""
-        await self.send(text_data=json.dumps({
-            'type': 'desk_status_update',
-            'desk_id': event.get('desk_id'),
-            'status': event.get('status'),
-            'updated_by': event.get('updated_by')
-        }))
+        await self.send_event(event)
     
     async def reservation_update_message(self, event):
         """Отправка сообщения об обновлении бронирования клиентам."""
-        await self.send(text_data=json.dumps({
-            'type': 'reservation_update',
-            'reservation_id': event.get('reservation_id'),
-            'action': event.get('action'),
-            'updated_by': event.get('updated_by')
-        }))
+        await self.send_event(event)
+    
+    async def desks_reset_message(self, event):
+        """Отправка клиентам одного сообщения о сбросе статусов столов."""
+        await self.send_event(event)
+    
+    async def desks_positions_message(self, event):
+        """Отправка клиентам одного сообщения о перемещении столов."""
+        await self.send_event(event)
+    
+    async def reservations_batch_message(self, event):
+        """Отправка клиентам одного сообщения о смене статуса группы бронирований."""
+        await self.send_event(event)
+    
+    async def batch_message(self, event):
+        """Отправка клиентам пачки изменений одним кадром."""
+        await self.send_event(event)
+    
+    @database_sync_to_async
+    def get_snapshot(self, group):
+        """Номер последнего события группы и ее состояние: столы этажа или бронирования пользователя."""
+        # Номер берем до чтения состояния: события после него клиент получит
+        # повторно и отбросит по seq, но ничего не пропустит
+        seq = event_log.current_seq(group)
+        if group == self.user_group_name:
+            reservations = Reservation.objects.filter(
+                user=self.user,
+                status=ReservationStatus.ACTIVE,
+                end_time__gte=timezone.now()
+            ).order_by('start_time').values('id', 'desk_id', 'status', 'start_time', 'end_time')
+            return seq, {'reservations': list(reservations)}
+        
+        floor = int(group.split('_')[1])
+        desks = Desk.objects.filter(area__floor=floor).order_by('id').values('id', 'status')
+        return seq, {'desks': list(desks)}
+    
+    @database_sync_to_async
+    def get_desk_floor(self, desk_id):
+        """Этаж стола или None, если стол не найден."""
+        try:
+            return Desk.objects.values_list('area__floor', flat=True).get(id=desk_id)
+        except (Desk.DoesNotExist, ValueError, TypeError):
+            return None
     
     @database_sync_to_async
     def get_user_from_token(self, token_key):
-        """Получение пользователя по токену."""
+        """Получение пользователя по токену (через кеш аутентификации)."""
+        return get_user_for_token(token_key)
+
+
+def validate_message(data):
+    """Ошибка в сообщении клиента или None, если сообщение корректно."""
+    if not isinstance(data, dict) or data.get('type') not in MESSAGE_SCHEMAS:
+        return 'Неизвестный тип сообщения.'
+    
+    for field, field_type in MESSAGE_SCHEMAS[data['type']].items():
+        value = data.get(field)
+        # bool — подкласс int, но идентификатором быть не может
+        if not isinstance(value, field_type) or isinstance(value, bool):
+            return f'Поле {field} отсутствует или имеет неверный тип.'
+        if field in MESSAGE_CHOICES and value not in MESSAGE_CHOICES[field]:
+            return f'Недопустимое значение поля {field}.'
+        if field == 'floors' and len(value) > MAX_SUBSCRIBED_FLOORS:
+            return f'Не больше {MAX_SUBSCRIBED_FLOORS} этажей.'
+    return None
+
+
+def parse_floors(floors):
+    """Номера этажей из списка клиента; некорректные значения пропускаются."""
+    if not isinstance(floors, list):
+        floors = [floors]
+    parsed = []
+    for floor in floors:
         try:
-            token = Token.objects.get(key=token_key)
-            return token.user
-        except Token.DoesNotExist:
-            return None
\ No newline at end of file
+            parsed.append(int(floor))
+        except (TypeError, ValueError):
+            continue
+    return parsed
@@ -0,0 +1,97 @@
+"""
+Журнал событий групп WebSocket для возобновления потока после разрыва.
+
+Каждое событие группы получает номер (seq), монотонно растущий в пределах
+группы, и добавляется в ограниченный поток Redis ``events:<группа>`` с id
+``<seq>-0``. Клиент запоминает последний полученный seq каждой группы и после
+переподключения получает только пропущенные события. Если часть из них уже
+вытеснена из потока, вызывающий код отправляет клиенту полный снимок.
+"""
+import json
+import logging
+
+import redis
+from django.conf import settings
+
+from core.redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Номер и запись события атомарно, чтобы id в потоке шли строго по порядку
+_APPEND_SCRIPT = """
+local seq = redis.call('INCR', KEYS[2])
+redis.call('XADD', KEYS[1], 'MAXLEN', '~', ARGV[2], seq .. '-0', 'event', ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+return seq
+"""
+
+_append_script = None
+
+
+def _stream_key(group):
+    return f'events:{group}'
+
+
+def _seq_key(group):
+    return f'events:{group}:seq'
+
+
+def append(group, event):
+    """Записать событие группы в журнал. Возвращает его seq или None, если Redis недоступен."""
+    global _append_script
+    try:
+        if _append_script is None:
+            _append_script = get_redis().register_script(_APPEND_SCRIPT)
+        return _append_script(
+            keys=[_stream_key(group), _seq_key(group)],
+            args=[
+                json.dumps(event, default=str),
+                settings.BROADCAST_STREAM_LENGTH,
+                settings.BROADCAST_STREAM_TTL,
+            ]
+        )
+    except redis.RedisError:
+        logger.exception('Не удалось записать событие группы %s в журнал', group)
+        return None
+
+
+def current_seq(group):
+    """Номер последнего события группы (0, если событий нет или журнал недоступен)."""
+    try:
+        return int(get_redis().get(_seq_key(group)) or 0)
+    except redis.RedisError:
+        logger.exception('Журнал событий группы %s недоступен', group)
+        return 0
+
+
+def read_since(group, last_seq):
+    """
+    События группы с номером больше last_seq.
+
+    Возвращает (seq последнего события, список (seq, событие)) или None, если
+    продолжить поток нельзя: пропущенные события вытеснены из журнала, журнал
+    истек или недоступен. Тогда клиенту нужен полный снимок.
+    """
+    try:
+        connection = get_redis()
+        current = int(connection.get(_seq_key(group)) or 0)
+        if last_seq > current:
+            # Журнал начат заново (истек срок хранения), номера клиента устарели
+            return None
+        if last_seq == current:
+            return current, []
+
+        entries = connection.xrange(_stream_key(group), min=f'{last_seq + 1}-0')
+    except redis.RedisError:
+        logger.exception('Журнал событий группы %s недоступен', group)
+        return None
+
+    events = [
+        (int(entry_id.split(b'-')[0]), json.loads(fields[b'event']))
+        for entry_id, fields in entries
+    ]
+    if not events or events[0][0] != last_seq + 1:
+        return None
+    # Пока читали поток, в него могли добавиться новые события
+    return max(current, events[-1][0]), events
@@ -0,0 +1,210 @@
+import asyncio
+import json
+import resource
+import time
+import tracemalloc
+import uuid
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from desks.models import Area, Desk
+from office_layout.models import OfficeLayout
+from reservations.models import Reservation
+from users.models import User
+
+# Префикс тестовых пользователей, зон и столов; к нему добавляется id запуска,
+# по которому данные запуска удаляются после замера
+PREFIX = 'benchmark_websocket'
+
+# Сколько соединений открывать одновременно
+CONNECT_CHUNK = 100
+
+
+class Command(BaseCommand):
+    """Нагрузочный замер рассылки уведомлений по WebSocket."""
+
+    help = (
+        'Открывает много соединений OfficeConsumer в одном процессе, сохраняет '
+        'бронирования пачками и сообщает задержку доставки уведомлений '
+        '(p50/p99) и память на соединение.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--connections', type=int, default=1000, help='Число соединений')
+        parser.add_argument(
+            '--users', type=int, default=100,
+            help='Число пользователей, соединения распределяются между ними поровну'
+        )
+        parser.add_argument('--bursts', type=int, default=5, help='Число пачек сохранений')
+        parser.add_argument(
+            '--burst-size', type=int, default=20,
+            help='Сколько бронирований сохраняется в пачке (не больше --users)'
+        )
+        parser.add_argument(
+            '--layer', choices=['memory', 'redis'], default='memory',
+            help='Слой каналов: в памяти процесса или Redis из настроек'
+        )
+        parser.add_argument(
+            '--timeout', type=float, default=30,
+            help='Сколько секунд ждать открытия соединений и доставки пачки'
+        )
+
+    def handle(self, *args, **options):
+        options['burst_size'] = min(options['burst_size'], options['users'])
+        overrides = {'BROADCAST_IN_BACKGROUND': False}
+        if options['layer'] == 'memory':
+            overrides['CHANNEL_LAYERS'] = {
+                'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}
+            }
+
+        # Данные каждого запуска помечены своим id: они не совпадают с
+        # настоящими номерами столов и удаляются, даже если замер прерван
+        run_id = uuid.uuid4().hex[:8]
+        with override_settings(**overrides):
+            try:
+                reservations, tokens = self.seed(run_id, options['users'])
+                report = asyncio.run(self.run(reservations, tokens, options))
+            finally:
+                self.cleanup(run_id)
+
+        self.write_report(report, options)
+
+    def seed(self, run_id, count):
+        """Пользователи с токенами и по одному бронированию на каждого на отдельном этаже."""
+        prefix = f'{PREFIX}_{run_id}'
+        # Этаж без схем и зон: уведомления и сброс пакетов не затрагивают настоящие этажи
+        floor = max(
+            Area.objects.aggregate(floor=Max('floor'))['floor'] or 0,
+            OfficeLayout.objects.aggregate(floor=Max('floor'))['floor'] or 0,
+        ) + 1
+        area = Area.objects.create(name=prefix, floor=floor)
+        users = User.objects.bulk_create([User(username=f'{prefix}_{i}') for i in range(count)])
+        desks = Desk.objects.bulk_create([
+            Desk(name=f'{prefix} {i}', desk_number=f'B-{run_id}-{i}', area=area, x_coordinate=i, y_coordinate=0)
+            for i in range(count)
+        ])
+        tokens = Token.objects.bulk_create([Token(key=Token.generate_key(), user=user) for user in users])
+
+        start_time = timezone.now() + timedelta(days=1)
+        reservations = Reservation.objects.bulk_create([
+            Reservation(user=user, desk=desk, start_time=start_time, end_time=start_time + timedelta(hours=1))
+            for user, desk in zip(users, desks)
+        ])
+        return reservations, [token.key for token in tokens]
+
+    def cleanup(self, run_id):
+        """Удалить данные запуска, в том числе созданные частично."""
+        prefix = f'{PREFIX}_{run_id}'
+        Reservation.objects.filter(user__username__startswith=f'{prefix}_').delete()
+        Area.objects.filter(name=prefix).delete()
+        User.objects.filter(username__startswith=f'{prefix}_').delete()
+
+    async def run(self, reservations, tokens, options):
+        # Приложение импортируется здесь: настройки слоя каналов уже подменены
+        from config.asgi import application
+
+        # Соединение i принадлежит пользователю i % users
+        tracemalloc.start()
+        memory_before = tracemalloc.get_traced_memory()[0]
+        communicators = []
+        connect_started = time.perf_counter()
+        for offset in range(0, options['connections'], CONNECT_CHUNK):
+            chunk = [
+                WebsocketCommunicator(application, f'/ws/office/{tokens[i % len(tokens)]}/')
+                for i in range(offset, min(offset + CONNECT_CHUNK, options['connections']))
+            ]
+            results = await asyncio.gather(*(communicator.connect(options['timeout']) for communicator in chunk))
+            if not all(connected for connected, _ in results):
+                raise RuntimeError('Не удалось открыть соединение')
+            # Приветственное сообщение
+            await asyncio.gather(*(communicator.receive_output(options['timeout']) for communicator in chunk))
+            communicators += chunk
+        connect_seconds = time.perf_counter() - connect_started
+        memory_per_connection = (tracemalloc.get_traced_memory()[0] - memory_before) / len(communicators)
+        tracemalloc.stop()
+
+        connections_per_user = {}
+        for i in range(len(communicators)):
+            user_id = reservations[i % len(tokens)].user_id
+            connections_per_user[user_id] = connections_per_user.get(user_id, 0) + 1
+
+        sent_at = {}
+        latencies = []
+        received = asyncio.Event()
+        state = {'expected': 0}
+
+        async def read(communicator):
+            while True:
+                output = await communicator.receive_output(timeout=None)
+                if output['type'] != 'websocket.send':
+                    return
+                message = json.loads(output['text'])
+                if message.get('type') == 'reservation_update' and message['reservation_id'] in sent_at:
+                    latencies.append(time.perf_counter() - sent_at[message['reservation_id']])
+                    if len(latencies) >= state['expected']:
+                        received.set()
+
+        readers = [asyncio.create_task(read(communicator)) for communicator in communicators]
+        save = sync_to_async(lambda reservation: reservation.save(update_fields=['updated_at']))
+        lost = 0
+        for burst in range(options['bursts']):
+            sent_at.clear()
+            latencies_before = len(latencies)
+            received.clear()
+            batch = [
+                reservations[(burst * options['burst_size'] + i) % len(reservations)]
+                for i in range(options['burst_size'])
+            ]
+            state['expected'] = latencies_before + sum(
+                connections_per_user.get(reservation.user_id, 0) for reservation in batch
+            )
+            for reservation in batch:
+                sent_at[reservation.id] = time.perf_counter()
+                await save(reservation)
+            try:
+                await asyncio.wait_for(received.wait(), options['timeout'])
+            except asyncio.TimeoutError:
+                lost += state['expected'] - len(latencies)
+                self.stderr.write(f'Пачка {burst + 1}: доставлены не все уведомления')
+
+        for reader in readers:
+            reader.cancel()
+        await asyncio.gather(*(communicator.disconnect() for communicator in communicators))
+
+        return {
+            'connect_seconds': connect_seconds,
+            'memory_per_connection': memory_per_connection,
+            'latencies': sorted(latencies),
+            'lost': lost,
+        }
+
+    def write_report(self, report, options):
+        latencies = report['latencies']
+
+        def percentile(p):
+            if not latencies:
+                return 0
+            return latencies[int(p * (len(latencies) - 1))] * 1000
+
+        self.stdout.write(
+            f'Соединений: {options["connections"]} (пользователей {options["users"]}, '
+            f'слой {options["layer"]}), открыты за {report["connect_seconds"]:.2f} с'
+        )
+        self.stdout.write(
+            f'Память на соединение: {report["memory_per_connection"] / 1024:.1f} КиБ '
+            f'(пик RSS процесса {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} МиБ)'
+        )
+        self.stdout.write(
+            f'Доставлено уведомлений: {len(latencies)}, '
+            f'p50 {percentile(0.5):.1f} мс, p99 {percentile(0.99):.1f} мс, '
+            f'максимум {percentile(1):.1f} мс'
+        )
+        if report['lost']:
+            self.stdout.write(self.style.WARNING(f'Не доставлено за --timeout: {report["lost"]}'))
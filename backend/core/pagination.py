@@ -0,0 +1,163 @@
+import json
+from functools import reduce
+from operator import or_
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection
+from django.db.models import BooleanField, Q
+from django.db.models.constants import LOOKUP_SEP
+from django.db.models.expressions import RawSQL
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination, PageNumberPagination
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Курсорная (keyset) пагинация без COUNT и OFFSET.
+
+    Порядок берется из queryset, уже отсортированного представлением или
+    OrderingFilter, и дополняется id, чтобы порядок был строго определен.
+    Курсор хранит значения всех полей порядка последней строки страницы, а
+    следующая страница выбирается сравнением строк, например
+    ``(start_time, id) < (%s, %s)``, поэтому сколько угодно строк с одинаковым
+    значением первого поля проходятся без смещения. Поля порядка не должны
+    содержать NULL.
+
+    Если в запросе есть ?page=, используется постраничная пагинация с
+    общим количеством — она нужна административному интерфейсу.
+    """
+
+    page_number_class = PageNumberPagination
+    page_number = None
+
+    def get_ordering(self, request, queryset, view):
+        """Порядок queryset с id в конце для однозначной позиции курсора."""
+        ordering = tuple(queryset.query.order_by)
+        if not ordering or not all(isinstance(field, str) for field in ordering):
+            ordering = tuple(super().get_ordering(request, queryset, view))
+        if ordering[-1].lstrip('-') not in ('id', 'pk'):
+            tie_breaker = '-id' if ordering[0].startswith('-') else 'id'
+            ordering = ordering + (tie_breaker,)
+        return ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.page_number_class.page_query_param in request.query_params:
+            self.page_number = self.page_number_class()
+            return self.page_number.paginate_queryset(queryset, request, view)
+
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.model = queryset.model
+        self.ordering = self.get_ordering(request, queryset, view)
+        self.cursor = self.decode_cursor(request)
+        reverse = bool(self.cursor and self.cursor.reverse)
+        position = self.cursor.position if self.cursor else None
+
+        ordering = [_flip(field) for field in self.ordering] if reverse else list(self.ordering)
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self._after(ordering, position))
+
+        # Одна лишняя строка показывает, есть ли следующая страница
+        results = list(queryset[:self.page_size + 1])
+        self.page = results[:self.page_size]
+        has_more = len(results) > self.page_size
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = position is not None, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.position = position
+        self.display_page_controls = self.has_next or self.has_previous
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        position = self._position(self.page[-1]) if self.page else self.position
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        position = self._position(self.page[0]) if self.page else self.position
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=position))
+
+    def encode_cursor(self, cursor):
+        position = json.dumps(cursor.position, cls=DjangoJSONEncoder, separators=(',', ':'))
+        return super().encode_cursor(cursor._replace(position=position))
+
+    def decode_cursor(self, request):
+        """Курсор с позицией — значениями полей порядка, приведенными к типам полей."""
+        cursor = super().decode_cursor(request)
+        if cursor is None or cursor.position is None:
+            return cursor
+        try:
+            values = json.loads(cursor.position)
+            if not isinstance(values, list) or len(values) != len(self.ordering):
+                raise ValueError
+            position = [
+                self._field(field).to_python(value) for field, value in zip(self.ordering, values)
+            ]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+        return cursor._replace(position=position)
+
+    def _field(self, ordering_field):
+        """Поле модели для элемента порядка, в том числе через связи."""
+        model = self.model
+        *relations, name = ordering_field.lstrip('-').split(LOOKUP_SEP)
+        for relation in relations:
+            model = model._meta.get_field(relation).related_model
+        return model._meta.pk if name == 'pk' else model._meta.get_field(name)
+
+    def _position(self, instance):
+        values = []
+        for field in self.ordering:
+            value = instance
+            for name in field.lstrip('-').split(LOOKUP_SEP):
+                value = getattr(value, name)
+            values.append(value)
+        return values
+
+    def _after(self, ordering, position):
+        """Условие «строка идет после позиции» для указанного порядка."""
+        descending = {field.startswith('-') for field in ordering}
+        local = all(LOOKUP_SEP not in field for field in ordering)
+        if len(descending) == 1 and local:
+            # Одно направление: сравнение строк целиком, его использует индекс
+            quote = connection.ops.quote_name
+            table = quote(self.model._meta.db_table)
+            columns = ', '.join(f'{table}.{quote(self._field(field).column)}' for field in ordering)
+            placeholders = ', '.join(['%s'] * len(ordering))
+            operator = '<' if descending.pop() else '>'
+            return RawSQL(
+                f'({columns}) {operator} ({placeholders})', position, output_field=BooleanField()
+            )
+
+        # Разные направления: (a > x) OR (a = x AND b < y) OR ...
+        conditions = []
+        for i, field in enumerate(ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            equal = {other.lstrip('-'): value for other, value in zip(ordering[:i], position[:i])}
+            conditions.append(Q(**equal, **{f'{name}__{lookup}': position[i]}))
+        return reduce(or_, conditions)
+
+    def get_paginated_response(self, data):
+        if self.page_number:
+            return self.page_number.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    def to_html(self):
+        if self.page_number:
+            return self.page_number.to_html()
+        return super().to_html()
+
+
+def _flip(field):
+    return field[1:] if field.startswith('-') else f'-{field}'
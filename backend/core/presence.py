@@ -0,0 +1,128 @@
+"""
+Присутствие сотрудников и фактическая занятость столов по этажам.
+
+Для каждого этажа в Redis хранятся два сортированных множества, где оценка
+элемента — время (unix), до которого запись действительна:
+
+- ``presence:floor:<этаж>:users`` — пользователи, от которых недавно пришел
+  сигнал: ping соединения WebSocket, подписанного на этаж, или отметка о
+  прибытии (Reservation.check_in). Запись живет PRESENCE_TTL секунд после
+  последнего сигнала;
+- ``presence:floor:<этаж>:desks`` — столы с отметкой о прибытии, до окончания
+  бронирования или до его отмены и завершения.
+
+Просроченные записи не удаляются отдельной задачей: при чтении учитываются
+только элементы с оценкой больше текущего времени, а при записи просроченные
+вычищаются. Ошибки Redis не прерывают основную операцию.
+"""
+import logging
+import time
+
+import redis
+from django.conf import settings
+
+from core.redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+def _users_key(floor):
+    return f'presence:floor:{floor}:users'
+
+
+def _desks_key(floor):
+    return f'presence:floor:{floor}:desks'
+
+
+def _touch_user(pipe, user_id, floor, now):
+    """Продлить присутствие пользователя, вычистить просроченные записи этажа."""
+    key = _users_key(floor)
+    pipe.zadd(key, {user_id: now + settings.PRESENCE_TTL})
+    pipe.zremrangebyscore(key, '-inf', now)
+    pipe.expire(key, settings.PRESENCE_TTL)
+
+
+def heartbeat(user_id, floors):
+    """Отметить пользователя присутствующим на этажах на PRESENCE_TTL секунд."""
+    if not floors:
+        return
+    now = time.time()
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for floor in floors:
+            _touch_user(pipe, user_id, floor, now)
+        pipe.execute()
+    except redis.RedisError:
+        logger.exception('Не удалось обновить присутствие пользователя %s', user_id)
+
+
+def check_in(user_id, desk_id, floor, until):
+    """Отметить прибытие: пользователь присутствует, стол занят до until."""
+    now = time.time()
+    until = until.timestamp()
+    if until <= now:
+        return
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        _touch_user(pipe, user_id, floor, now)
+        # Срок ключа столов не задается: в нем бывают записи с разным сроком,
+        # а размер ограничен числом столов этажа
+        pipe.zadd(_desks_key(floor), {desk_id: until})
+        pipe.zremrangebyscore(_desks_key(floor), '-inf', now)
+        pipe.execute()
+    except redis.RedisError:
+        logger.exception('Не удалось отметить прибытие за стол %s', desk_id)
+
+
+def release_desk(desk_id, floor):
+    """Снять отметку о занятости стола (бронирование отменено или завершено)."""
+    try:
+        get_redis().zrem(_desks_key(floor), desk_id)
+    except redis.RedisError:
+        logger.exception('Не удалось снять занятость стола %s', desk_id)
+
+
+def floor_presence(floor):
+    """
+    Присутствующие пользователи и занятые столы этажа сейчас.
+
+    Возвращает {'user_ids': [...], 'desk_ids': [...]} или None, если Redis
+    недоступен.
+    """
+    now = time.time()
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        pipe.zrangebyscore(_users_key(floor), now, '+inf')
+        pipe.zrangebyscore(_desks_key(floor), now, '+inf')
+        users, desks = pipe.execute()
+    except redis.RedisError:
+        logger.exception('Данные о присутствии недоступны')
+        return None
+    return {
+        'user_ids': sorted(int(member) for member in users),
+        'desk_ids': sorted(int(member) for member in desks),
+    }
+
+
+def floor_counts(floors):
+    """
+    Число присутствующих и занятых столов по этажам одним обращением к Redis.
+
+    Возвращает {этаж: {'people': n, 'occupied_desks': n}} или None, если Redis
+    недоступен.
+    """
+    floors = list(floors)
+    now = time.time()
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for floor in floors:
+            pipe.zcount(_users_key(floor), now, '+inf')
+            pipe.zcount(_desks_key(floor), now, '+inf')
+        counts = pipe.execute()
+    except redis.RedisError:
+        logger.exception('Данные о присутствии недоступны')
+        return None
+    return {
+        floor: {'people': counts[2 * i], 'occupied_desks': counts[2 * i + 1]}
+        for i, floor in enumerate(floors)
+    }
@@ -0,0 +1,208 @@
+"""
+Сообщения WebSocket для клиентов и их кодирование.
+
+Клиент выбирает кодировку при подключении (?encoding=):
+
+- ``json`` — JSON с полными именами полей (по умолчанию);
+- ``compact`` — JSON с короткими именами полей (SHORT_KEYS);
+- ``msgpack`` — MessagePack с короткими именами полей, бинарные кадры.
+
+Бинарный кадр начинается с байта формата: 0 — тело как есть, 1 — тело сжато
+zlib. Тело — MessagePack или JSON в UTF-8 для ``json``/``compact``. Сжатие
+(?compress=1) применяется к большим разовым сообщениям, например снимкам.
+
+Через слой каналов события групп передаются как есть, без готовых кадров.
+Кадр события кодируется при первой отправке в нужной кодировке и
+запоминается в процессе по группе и номеру (event_frame), поэтому остальным
+соединениям процесса с той же кодировкой уходит тот же готовый кадр, а
+неиспользуемые кодировки не кодируются вовсе.
+"""
+import json
+import threading
+import zlib
+from collections import OrderedDict
+
+import msgpack
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+ENCODINGS = ('json', 'compact', 'msgpack')
+DEFAULT_ENCODING = 'json'
+
+FRAME_PLAIN = b'\x00'
+FRAME_ZLIB = b'\x01'
+
+# Сколько закодированных кадров событий групп хранить в памяти процесса
+EVENT_FRAME_CACHE_SIZE = 512
+
+# Короткие имена полей для компактных кодировок
+SHORT_KEYS = {
+    'type': 't',
+    'stream': 'g',
+    'seq': 'n',
+    'desk_id': 'd',
+    'desk_ids': 'ds',
+    'reservation_id': 'r',
+    'reservation_ids': 'rs',
+    'status': 's',
+    'action': 'a',
+    'updated_by': 'u',
+    'occurrences': 'o',
+    'messages': 'm',
+    'floors': 'f',
+    'positions': 'p',
+    'desks': 'dk',
+    'reservations': 'rv',
+    'id': 'i',
+    'start_time': 'st',
+    'end_time': 'et',
+    'x_coordinate': 'x',
+    'y_coordinate': 'y',
+}
+
+
+def desk_status_update(event):
+    """Сообщение об изменении статуса стола."""
+    return {
+        'type': 'desk_status_update',
+        'desk_id': event.get('desk_id'),
+        'status': event.get('status'),
+        'updated_by': event.get('updated_by')
+    }
+
+
+def reservation_update(event):
+    """Сообщение об изменении бронирования."""
+    message = {
+        'type': 'reservation_update',
+        'reservation_id': event.get('reservation_id'),
+        'action': event.get('action'),
+        'status': event.get('status'),
+        'desk_id': event.get('desk_id'),
+        'updated_by': event.get('updated_by')
+    }
+    # Для серии повторяющихся бронирований передаем количество повторений
+    if 'occurrences' in event:
+        message['occurrences'] = event['occurrences']
+    return message
+
+
+def desks_reset(event):
+    """Сообщение о сбросе статусов группы столов."""
+    return {
+        'type': 'desks_reset',
+        'desk_ids': event.get('desk_ids', []),
+        'status': event.get('status'),
+        'updated_by': event.get('updated_by')
+    }
+
+
+def desks_positions_update(event):
+    """Сообщение о перемещении столов на схеме этажа."""
+    return {
+        'type': 'desks_positions_update',
+        'desks': event.get('desks', []),
+        'updated_by': event.get('updated_by')
+    }
+
+
+def reservations_batch_update(event):
+    """Сообщение о смене статуса группы бронирований."""
+    return {
+        'type': 'reservations_batch_update',
+        'reservation_ids': event.get('reservation_ids', []),
+        'desk_ids': event.get('desk_ids', []),
+        'status': event.get('status'),
+        'updated_by': event.get('updated_by')
+    }
+
+
+def batch(event):
+    """Несколько изменений одним кадром."""
+    return {
+        'type': 'batch',
+        'messages': [client_message(message) for message in event['messages']]
+    }
+
+
+# Сообщение клиенту для каждого типа события группы
+CLIENT_MESSAGES = {
+    'desk_status_update_message': desk_status_update,
+    'reservation_update_message': reservation_update,
+    'desks_reset_message': desks_reset,
+    'desks_positions_message': desks_positions_update,
+    'reservations_batch_message': reservations_batch_update,
+    'batch_message': batch,
+}
+
+
+def client_message(event):
+    """Сообщение для клиента по событию группы, с группой и номером для возобновления."""
+    message = CLIENT_MESSAGES[event['type']](event)
+    if event.get('seq') is not None:
+        message['stream'] = event['stream']
+        message['seq'] = event['seq']
+    return message
+
+
+def _shorten(value):
+    """Заменить имена полей на короткие во всех вложенных объектах."""
+    if isinstance(value, dict):
+        return {SHORT_KEYS.get(key, key): _shorten(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_shorten(item) for item in value]
+    return value
+
+
+def _msgpack_default(value):
+    # Даты и прочие типы — так же, как в JSON
+    return DjangoJSONEncoder().default(value)
+
+
+def encode(message, encoding=DEFAULT_ENCODING, compress=False):
+    """
+    Закодировать сообщение. Возвращает кадр: str для текстового, bytes для бинарного.
+
+    compress сжимает сообщения не меньше WS_COMPRESS_MIN_BYTES.
+    """
+    if encoding == 'msgpack':
+        body = msgpack.packb(_shorten(message), default=_msgpack_default)
+    elif encoding == 'compact':
+        body = json.dumps(_shorten(message), cls=DjangoJSONEncoder, separators=(',', ':'))
+    else:
+        body = json.dumps(message, cls=DjangoJSONEncoder)
+
+    if compress and len(body) >= settings.WS_COMPRESS_MIN_BYTES:
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        return FRAME_ZLIB + zlib.compress(body)
+    if isinstance(body, bytes):
+        return FRAME_PLAIN + body
+    return body
+
+
+_event_frames = OrderedDict()
+_event_frames_lock = threading.Lock()
+
+
+def event_frame(event, encoding):
+    """Кадр события группы в кодировке; событие с номером кодируется один раз на процесс."""
+    if event.get('seq') is None:
+        return encode(client_message(event), encoding)
+
+    # Номера начинаются заново, если журнал группы сброшен, поэтому событие
+    # сверяется целиком, а не только по номеру
+    key = (event['stream'], event['seq'], encoding)
+    with _event_frames_lock:
+        cached = _event_frames.get(key)
+        if cached is not None and cached[0] == event:
+            _event_frames.move_to_end(key)
+            return cached[1]
+
+    frame = encode(client_message(event), encoding)
+    with _event_frames_lock:
+        _event_frames[key] = (event, frame)
+        _event_frames.move_to_end(key)
+        while len(_event_frames) > EVENT_FRAME_CACHE_SIZE:
+            _event_frames.popitem(last=False)
+    return frame
@@ -0,0 +1,28 @@
+import redis
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+_connection = None
+
+
+def get_redis():
+    """Общее подключение к Redis для кешей и индексов приложения."""
+    global _connection
+    if _connection is None:
+        # Короткие таймауты: при недоступном Redis вызывающий код должен
+        # быстро перейти на запасной путь через БД, а не ждать соединения
+        _connection = redis.Redis.from_url(
+            settings.REDIS_URL,
+            socket_timeout=0.5,
+            socket_connect_timeout=0.5
+        )
+    return _connection
+
+
+@receiver(setting_changed)
+def reset_connection(setting, **kwargs):
+    """Переподключиться при смене REDIS_URL (override_settings в тестах)."""
+    global _connection
+    if setting == 'REDIS_URL':
+        _connection = None
@@ -0,0 +1,47 @@
+import json
+from rest_framework import renderers
+from rest_framework.utils import encoders
+
+
+class NDJSONRenderer(renderers.BaseRenderer):
+    """Рендерер NDJSON: один JSON-объект на строку."""
+    
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+    
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        """Преобразовать список объектов в строки NDJSON."""
+        if data is None:
+            return b''
+        rows = data if isinstance(data, list) else [data]
+        return ''.join(ndjson_line(row) for row in rows).encode(self.charset)
+
+
+def ndjson_line(row):
+    """Одна строка NDJSON для объекта."""
+    return json.dumps(row, cls=encoders.JSONEncoder, ensure_ascii=False) + '\n'
+
+
+class CompactJSONRenderer(renderers.JSONRenderer):
+    """
+    Колоночный JSON для больших выборок (?format=compact).
+
+    Сам рендерер ничего не преобразует: представление при этом формате
+    собирает ответ в виде колонок (см. columns) вместо списка объектов.
+    """
+    
+    format = 'compact'
+
+
+def columns(rows, names):
+    """Разложить список кортежей по колонкам: {имя: [значения]}."""
+    rows = list(rows)
+    if not rows:
+        return {name: [] for name in names}
+    return {name: list(values) for name, values in zip(names, zip(*rows))}
+
+
+def epoch(value):
+    """Время в секундах Unix для колоночного формата."""
+    return int(value.timestamp()) if value else None
@@ -1,39 +1,161 @@
-import json
-from django.db.models.signals import post_save, post_delete
+from django.db import transaction
+from django.db.models.signals import post_init, post_save, post_delete
 from django.dispatch import receiver
-from channels.layers import get_channel_layer
-from asgiref.sync import async_to_sync
-from desks.models import Desk
+from django.contrib.auth import get_user_model
+from rest_framework.authtoken.models import Token
+from core import broadcast, throttling
+from core.authentication import invalidate_tokens
+from desks.models import Area, Desk
+from desks import availability
+from office_layout import bundle
+from office_layout.models import OfficeElement, OfficeLayout
 from reservations.models import Reservation
 
+# Поля стола и зоны, входящие в пакет схемы этажа (office_layout.bundle)
+DESK_LAYOUT_FIELDS = (
+    'area_id', 'name', 'desk_number', 'x_coordinate', 'y_coordinate',
+    'desk_type', 'features', 'notes'
+)
+AREA_LAYOUT_FIELDS = ('floor', 'name')
+
+
+def _reservation_interval(instance):
+    """Стол и интервал бронирования без обращения к отложенным полям."""
+    values = instance.__dict__
+    return values.get('desk_id'), values.get('start_time'), values.get('end_time')
+
+
+def refresh_reservation_availability(instance):
+    """Обновить индекс доступности по старому и новому интервалу бронирования."""
+    intervals = [_reservation_interval(instance)]
+    snapshot = getattr(instance, '_availability_snapshot', None)
+    if snapshot and snapshot != intervals[0]:
+        intervals.append(snapshot)
+    instance._availability_snapshot = intervals[0]
+    
+    # Пересчитываем после фиксации транзакции, чтобы читать сохраненные данные
+    transaction.on_commit(lambda: availability.refresh_intervals(intervals))
+
+
+@receiver(post_init, sender=Reservation)
+def reservation_init_handler(sender, instance, **kwargs):
+    """Запоминаем исходный интервал бронирования для обновления индекса доступности."""
+    instance._availability_snapshot = _reservation_interval(instance)
+
+
+@receiver(post_save, sender=Token)
+@receiver(post_delete, sender=Token)
+def token_change_handler(sender, instance, **kwargs):
+    """Сбрасываем кеш аутентификации при удалении или пересоздании токена."""
+    # Ключ запоминаем сразу: после delete() первичный ключ экземпляра обнуляется
+    token_keys = [instance.key]
+    transaction.on_commit(lambda: invalidate_tokens(token_keys))
+
+
+@receiver(post_save, sender=get_user_model())
+def user_change_handler(sender, instance, **kwargs):
+    """Сбрасываем кеш аутентификации пользователя при изменении, в том числе деактивации."""
+    token_keys = list(Token.objects.filter(user_id=instance.pk).values_list('key', flat=True))
+    if token_keys:
+        transaction.on_commit(lambda: invalidate_tokens(token_keys))
+
 
 @receiver(post_save, sender=Desk)
 def desk_update_handler(sender, instance, created, **kwargs):
     """Обработчик сигнала обновления рабочего места."""
-    channel_layer = get_channel_layer()
+    # Статус, разосланный сервером, не должен повторно рассылаться от клиентов
+    desk_id, status = instance.id, instance.status
+    transaction.on_commit(lambda: throttling.remember_desk_statuses([desk_id], status))
     
-    # Отправляем уведомление всем клиентам о изменении стола
-    async_to_sync(channel_layer.group_send)(
-        'office_updates',
+    # Отправляем уведомление клиентам, просматривающим этаж стола
+    broadcast.send(
+        broadcast.floor_group(instance.area.floor),
         {
             'type': 'desk_status_update_message',
             'desk_id': instance.id,
             'status': instance.status,
             'updated_by': 'system'
-        }
+        },
+        key=('desk', instance.id)
     )
 
 
+def _layout_values(instance, fields):
+    values = instance.__dict__
+    return tuple(values.get(field) for field in fields)
+
+
+@receiver(post_init, sender=Desk)
+@receiver(post_init, sender=Area)
+@receiver(post_init, sender=OfficeElement)
+def layout_init_handler(sender, instance, **kwargs):
+    """Запоминаем поля, от которых зависит пакет схемы, чтобы сравнить их при сохранении."""
+    if sender is Desk:
+        instance._layout_snapshot = _layout_values(instance, DESK_LAYOUT_FIELDS)
+    elif sender is Area:
+        instance._layout_snapshot = _layout_values(instance, AREA_LAYOUT_FIELDS)
+    else:
+        instance._layout_snapshot = instance.__dict__.get('layout_id')
+
+
+@receiver(post_save, sender=Desk)
+@receiver(post_delete, sender=Desk)
+def desk_layout_handler(sender, instance, created=False, **kwargs):
+    """Пакеты схем этажа устаревают, если стол добавлен, удален, перемещен или переименован."""
+    values = _layout_values(instance, DESK_LAYOUT_FIELDS)
+    snapshot = instance._layout_snapshot
+    instance._layout_snapshot = values
+    if kwargs['signal'] is post_save and not created and values == snapshot:
+        # Изменился только статус
+        return
+    
+    area_ids = {area_id for area_id in (snapshot[0], values[0]) if area_id is not None}
+    floors = list(Area.objects.filter(id__in=area_ids).values_list('floor', flat=True))
+    transaction.on_commit(lambda: bundle.bump_floors(floors))
+
+
+@receiver(post_save, sender=Area)
+@receiver(post_delete, sender=Area)
+def area_layout_handler(sender, instance, created=False, **kwargs):
+    """Пакеты схем устаревают при переименовании зоны или переносе ее на другой этаж."""
+    values = _layout_values(instance, AREA_LAYOUT_FIELDS)
+    snapshot = instance._layout_snapshot
+    instance._layout_snapshot = values
+    if created or (kwargs['signal'] is post_save and values == snapshot):
+        # В новой зоне еще нет столов
+        return
+    
+    floors = [snapshot[0], values[0]]
+    transaction.on_commit(lambda: bundle.bump_floors(floors))
+
+
+@receiver(post_save, sender=OfficeLayout)
+@receiver(post_delete, sender=OfficeLayout)
+def office_layout_handler(sender, instance, **kwargs):
+    """Пакет схемы устаревает при любом ее изменении."""
+    # id запоминаем сразу: после delete() первичный ключ экземпляра обнуляется
+    layout_ids = [instance.id]
+    transaction.on_commit(lambda: bundle.bump_layouts(layout_ids))
+
+
+@receiver(post_save, sender=OfficeElement)
+@receiver(post_delete, sender=OfficeElement)
+def office_element_handler(sender, instance, **kwargs):
+    """Пакет схемы устаревает при изменении ее элементов, в том числе переносе в другую схему."""
+    layout_ids = {instance.layout_id, instance._layout_snapshot} - {None}
+    instance._layout_snapshot = instance.layout_id
+    transaction.on_commit(lambda: bundle.bump_layouts(layout_ids))
+
+
 @receiver(post_save, sender=Reservation)
 def reservation_update_handler(sender, instance, created, **kwargs):
     """Обработчик сигнала обновления бронирования."""
-    channel_layer = get_channel_layer()
-    
     action = 'created' if created else 'updated'
+    refresh_reservation_availability(instance)
     
-    # Отправляем уведомление всем клиентам о изменении бронирования
-    async_to_sync(channel_layer.group_send)(
-        'office_updates',
+    # Отправляем уведомление владельцу бронирования
+    broadcast.send(
+        broadcast.user_group(instance.user_id),
         {
             'type': 'reservation_update_message',
             'reservation_id': instance.id,
@@ -41,23 +163,107 @@ def reservation_update_handler(sender, instance, created, **kwargs):
             'status': instance.status,
             'desk_id': instance.desk_id,
             'updated_by': 'system'
-        }
+        },
+        key=('reservation', instance.id)
     )
 
 
 @receiver(post_delete, sender=Reservation)
 def reservation_delete_handler(sender, instance, **kwargs):
     """Обработчик сигнала удаления бронирования."""
-    channel_layer = get_channel_layer()
+    refresh_reservation_availability(instance)
     
-    # Отправляем уведомление всем клиентам об удалении бронирования
-    async_to_sync(channel_layer.group_send)(
-        'office_updates',
+    # Отправляем уведомление владельцу об удалении бронирования
+    broadcast.send(
+        broadcast.user_group(instance.user_id),
         {
             'type': 'reservation_update_message',
             'reservation_id': instance.id,
             'action': 'deleted',
             'desk_id': instance.desk_id,
             'updated_by': 'system'
+        },
+        key=('reservation', instance.id)
+    )
+
+
+def broadcast_reservation_series(parent_reservation, occurrences_count):
+    """Отправка одного уведомления о создании серии повторяющихся бронирований."""
+    broadcast.send(
+        broadcast.user_group(parent_reservation.user_id),
+        {
+            'type': 'reservation_update_message',
+            'reservation_id': parent_reservation.id,
+            'action': 'created',
+            'status': parent_reservation.status,
+            'desk_id': parent_reservation.desk_id,
+            'occurrences': occurrences_count,
+            'updated_by': 'system'
+        },
+        key=('reservation', parent_reservation.id)
+    )
+
+
+def broadcast_reservations_status(reservations, status):
+    """
+    Уведомления о массовой смене статуса бронирований.
+    
+    reservations — кортежи (id бронирования, id стола, id пользователя);
+    каждый пользователь получает одно сообщение о своих бронированиях.
+    """
+    by_user = {}
+    for reservation_id, desk_id, user_id in reservations:
+        by_user.setdefault(user_id, []).append((reservation_id, desk_id))
+    
+    for user_id, rows in by_user.items():
+        broadcast.send(
+            broadcast.user_group(user_id),
+            {
+                'type': 'reservations_batch_message',
+                'reservation_ids': [reservation_id for reservation_id, _ in rows],
+                'desk_ids': sorted({desk_id for _, desk_id in rows}),
+                'status': status,
+                'updated_by': 'system'
+            }
+        )
+
+
+def broadcast_desks_reset(desks, status):
+    """
+    Уведомления о сбросе статусов группы столов.
+    
+    desks — кортежи (id стола, этаж); на каждый этаж уходит одно сообщение.
+    """
+    by_floor = {}
+    for desk_id, floor in desks:
+        by_floor.setdefault(floor, []).append(desk_id)
+    
+    for floor, desk_ids in by_floor.items():
+        broadcast.send(
+            broadcast.floor_group(floor),
+            {
+                'type': 'desks_reset_message',
+                'desk_ids': desk_ids,
+                'status': status,
+                'updated_by': 'system'
+            }
+        )
+
+
+def broadcast_desks_positions(floor, desks, updated_by):
+    """
+    Одно уведомление о перемещении столов этажа.
+    
+    desks — кортежи (id стола, x, y).
+    """
+    broadcast.send(
+        broadcast.floor_group(floor),
+        {
+            'type': 'desks_positions_message',
+            'desks': [
+                {'id': desk_id, 'x_coordinate': x, 'y_coordinate': y}
+                for desk_id, x, y in desks
+            ],
+            'updated_by': updated_by
         }
-    )
\ No newline at end of file
+    )
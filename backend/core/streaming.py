@@ -0,0 +1,45 @@
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.core.handlers.asgi import ASGIRequest
+from django.http import StreamingHttpResponse
+
+
+def iter_chunks(queryset, chunk_size):
+    """
+    Перебрать queryset списками по chunk_size объектов.
+
+    Используется iterator(), поэтому на PostgreSQL строки читаются через
+    серверный курсор и в памяти одновременно находится не больше одной пачки.
+    """
+    iterator = queryset.iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+async def _aiter_sync(iterator):
+    """Асинхронная обертка над синхронным генератором с чтением по одной части."""
+    iterator = iter(iterator)
+    sentinel = object()
+    while True:
+        # thread_sensitive: все части читаются в одном потоке, как и курсор БД
+        part = await sync_to_async(next, thread_sensitive=True)(iterator, sentinel)
+        if part is sentinel:
+            return
+        yield part
+
+
+def streaming_response(request, content, content_type):
+    """
+    Потоковый ответ, который не буферизуется целиком ни под WSGI, ни под ASGI.
+
+    Под ASGI Django полностью вычитывает синхронные итераторы перед отправкой,
+    поэтому для ASGI-запроса генератор оборачивается в асинхронный.
+    """
+    request = getattr(request, '_request', request)
+    if isinstance(request, ASGIRequest):
+        content = _aiter_sync(content)
+    return StreamingHttpResponse(content, content_type=content_type)
@@ -1,7 +1,16 @@
+import logging
+import time
+
+from django.db import connection
 from django.utils import timezone
 from config.celery import app
+from core import throttling
+from core.signals import broadcast_desks_reset, broadcast_reservations_status
 from reservations.models import Reservation, ReservationStatus
-from desks.models import Desk, DeskStatus
+from desks import availability
+from desks.models import Area, Desk, DeskStatus
+
+logger = logging.getLogger(__name__)
 
 
 @app.task
@@ -9,16 +18,13 @@ def check_expired_reservations():
     """Задача для проверки истекших бронирований."""
     now = timezone.now()
     
-    # Получаем активные бронирования, у которых истек срок
-    expired_reservations = Reservation.objects.filter(
-        status=ReservationStatus.ACTIVE,
-        end_time__lt=now
+    # Активные бронирования, у которых истек срок, переводим в "Завершено"
+    return _transition_reservations(
+        ReservationStatus.COMPLETED,
+        'end_time < %s',
+        [now],
+        now
     )
-    
-    for reservation in expired_reservations:
-        # Меняем статус бронирования на "Завершено"
-        reservation.status = ReservationStatus.COMPLETED
-        reservation.save()
 
 
 @app.task
@@ -27,30 +33,79 @@ def check_no_show_reservations():
     now = timezone.now()
     threshold = now - timezone.timedelta(hours=1)  # 1 час после начала
     
-    # Получаем активные бронирования, которые начались более часа назад,
-    # но пользователь не отметился о прибытии
-    no_show_reservations = Reservation.objects.filter(
-        status=ReservationStatus.ACTIVE,
-        start_time__lt=threshold,
-        check_in_time=None
+    # Активные бронирования, которые начались более часа назад,
+    # но пользователь не отметился о прибытии, переводим в "Неявка"
+    return _transition_reservations(
+        ReservationStatus.NO_SHOW,
+        'start_time < %s AND check_in_time IS NULL',
+        [threshold],
+        now
     )
+
+
+def _transition_reservations(new_status, condition, params, now):
+    """
+    Перевести активные бронирования, подходящие под условие, в новый статус.
+    
+    Выполняется одним UPDATE ... RETURNING вместо save() на каждую строку,
+    поэтому сигналы post_save не вызываются: каждый владелец получает одно
+    уведомление о своих бронированиях, а индекс доступности пересчитывается для затронутых столов.
+    Возвращает число измененных строк и время выполнения.
+    """
+    started = time.monotonic()
+    
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {Reservation._meta.db_table} '
+            f'SET status = %s, updated_at = %s '
+            f'WHERE status = %s AND {condition} '
+            f'RETURNING id, desk_id, user_id, start_time, end_time',
+            [new_status, now, ReservationStatus.ACTIVE, *params]
+        )
+        rows = cursor.fetchall()
     
-    for reservation in no_show_reservations:
-        # Меняем статус бронирования на "Неявка"
-        reservation.status = ReservationStatus.NO_SHOW
-        reservation.save()
+    if rows:
+        broadcast_reservations_status([row[:3] for row in rows], new_status)
+        availability.refresh_intervals([(row[1], row[3], row[4]) for row in rows])
+    
+    metrics = {
+        'status': new_status,
+        'rows': len(rows),
+        'duration_ms': round((time.monotonic() - started) * 1000, 1),
+    }
+    logger.info('Бронирования переведены в статус %(status)s: %(rows)d за %(duration_ms)s мс', metrics)
+    return metrics
 
 
 @app.task
 def reset_desk_statuses():
     """Задача для сброса статусов столов в конце рабочего дня."""
-    # Получаем столы, которые не на обслуживании
-    desks = Desk.objects.exclude(status=DeskStatus.MAINTENANCE)
+    started = time.monotonic()
+    
+    # Сбрасываем на "Доступно" только столы, статус которых действительно
+    # меняется; столы на обслуживании не трогаем
+    # Этаж возвращаем из зоны, чтобы разослать уведомления по группам этажей
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {Desk._meta.db_table} AS desk SET status = %s '
+            f'FROM {Area._meta.db_table} AS area '
+            f'WHERE area.id = desk.area_id AND desk.status NOT IN (%s, %s) '
+            f'RETURNING desk.id, area.floor',
+            [DeskStatus.AVAILABLE, DeskStatus.AVAILABLE, DeskStatus.MAINTENANCE]
+        )
+        desks = cursor.fetchall()
+    
+    # Одно уведомление на этаж со списком столов вместо сообщения на каждый стол
+    if desks:
+        broadcast_desks_reset(desks, DeskStatus.AVAILABLE)
+        throttling.remember_desk_statuses([desk_id for desk_id, _ in desks], DeskStatus.AVAILABLE)
     
-    for desk in desks:
-        # Сбрасываем статус на "Доступно"
-        desk.status = DeskStatus.AVAILABLE
-        desk.save()
+    metrics = {
+        'rows': len(desks),
+        'duration_ms': round((time.monotonic() - started) * 1000, 1),
+    }
+    logger.info('Статусы столов сброшены: %(rows)d за %(duration_ms)s мс', metrics)
+    return metrics
 
 
 @app.task
@@ -0,0 +1,53 @@
+"""
+Общая основа тестов приложения.
+
+Тесты, унаследованные от TestCase и TransactionTestCase этого модуля,
+работают со слоем каналов в памяти процесса, отправляют уведомления сразу
+(без фонового потока) и используют отдельную базу Redis REDIS_TEST_URL,
+которая очищается перед каждым тестом: ключи прошлых запусков и соседних
+тестов не влияют на результат, а база приложения не затрагивается.
+"""
+from functools import cache
+
+import redis
+from django import test
+from django.conf import settings
+from django.test import override_settings
+
+TEST_SETTINGS = {
+    'CHANNEL_LAYERS': {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    'BROADCAST_IN_BACKGROUND': False,
+    'REDIS_URL': settings.REDIS_TEST_URL,
+}
+
+
+def _test_redis():
+    return redis.Redis.from_url(settings.REDIS_TEST_URL, socket_timeout=0.5, socket_connect_timeout=0.5)
+
+
+@cache
+def redis_available():
+    """Доступна ли тестовая база Redis (проверяется один раз за запуск)."""
+    try:
+        return _test_redis().ping()
+    except redis.RedisError:
+        return False
+
+
+class RedisTestMixin:
+    """Очистка тестовой базы Redis перед каждым тестом (setUp наследника вызывает super)."""
+
+    def setUp(self):
+        super().setUp()
+        if redis_available():
+            _test_redis().flushdb()
+
+
+@override_settings(**TEST_SETTINGS)
+class TestCase(RedisTestMixin, test.TestCase):
+    pass
+
+
+@override_settings(**TEST_SETTINGS)
+class TransactionTestCase(RedisTestMixin, test.TransactionTestCase):
+    pass
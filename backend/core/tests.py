@@ -1,3 +1,654 @@
-from django.test import TestCase
+import json
+import pickle
+import zlib
+from datetime import timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import msgpack
+
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.db import connection, transaction
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from desks.models import Area, Desk, DeskStatus
+from reservations.models import Reservation, ReservationStatus
+from users.models import User
+from .pagination import KeysetPagination
+from .testing import TestCase, TransactionTestCase, redis_available
+from . import authentication, broadcast, event_log, presence, protocol, throttling
+from .redis import get_redis
+from .routing import websocket_urlpatterns
+from .tasks import check_expired_reservations, check_no_show_reservations, reset_desk_statuses
+
+
+class ReservationMaintenanceTaskTests(TestCase):
+    """Массовая смена статусов бронирований задачами Celery."""
+
+    def setUp(self):
+        super().setUp()
+        area = Area.objects.create(name='Open space')
+        self.user = User.objects.create(username='user')
+        self.desks = [
+            Desk.objects.create(
+                name=f'Desk {i}', desk_number=f'D{i}', area=area, x_coordinate=0, y_coordinate=0
+            )
+            for i in range(3)
+        ]
+        self.now = timezone.now()
+        self.channel_layer = get_channel_layer()
+        self.channel_name = async_to_sync(self.channel_layer.new_channel)()
+        async_to_sync(self.channel_layer.group_add)(broadcast.user_group(self.user.id), self.channel_name)
+
+    def reserve(self, desk, start, end, **kwargs):
+        return Reservation.objects.create(
+            user=self.user, desk=desk, start_time=start, end_time=end, **kwargs
+        )
+
+    def receive(self):
+        return async_to_sync(self.channel_layer.receive)(self.channel_name)
+
+    def drain(self):
+        """Пропустить уведомления, отправленные при создании бронирований."""
+        while self.channel_layer.channels.get(self.channel_name):
+            self.receive()
+
+    def test_expired(self):
+        expired = [
+            self.reserve(desk, self.now - timedelta(hours=5), self.now - timedelta(hours=1))
+            for desk in self.desks[:2]
+        ]
+        current = self.reserve(self.desks[2], self.now - timedelta(hours=1), self.now + timedelta(hours=1))
+        self.drain()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            metrics = check_expired_reservations()
+
+        self.assertEqual(metrics['rows'], 2)
+        self.assertIn('duration_ms', metrics)
+        self.assertEqual(
+            set(Reservation.objects.filter(status=ReservationStatus.COMPLETED).values_list('id', flat=True)),
+            {reservation.id for reservation in expired}
+        )
+        current.refresh_from_db()
+        self.assertEqual(current.status, ReservationStatus.ACTIVE)
+
+        # Одно общее уведомление вместо уведомления на каждую строку
+        message = self.receive()
+        self.assertEqual(message['type'], 'reservations_batch_message')
+        self.assertEqual(sorted(message['reservation_ids']), sorted(r.id for r in expired))
+        self.assertEqual(message['status'], ReservationStatus.COMPLETED)
+        self.assertFalse(self.channel_layer.channels.get(self.channel_name))
+
+    def test_no_show(self):
+        missed = self.reserve(self.desks[0], self.now - timedelta(hours=2), self.now + timedelta(hours=2))
+        checked_in = self.reserve(
+            self.desks[1], self.now - timedelta(hours=2), self.now + timedelta(hours=2),
+            check_in_time=self.now - timedelta(hours=2)
+        )
+        self.drain()
+
+        self.assertEqual(check_no_show_reservations()['rows'], 1)
+        missed.refresh_from_db()
+        checked_in.refresh_from_db()
+        self.assertEqual(missed.status, ReservationStatus.NO_SHOW)
+        self.assertEqual(checked_in.status, ReservationStatus.ACTIVE)
+
+    def test_nothing_to_do(self):
+        self.drain()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(check_expired_reservations()['rows'], 0)
+        self.assertFalse(self.channel_layer.channels.get(self.channel_name))
+
+
+class ResetDeskStatusesTests(TestCase):
+    """Сброс статусов столов одним UPDATE и одним уведомлением."""
+
+    def test_only_changed_desks(self):
+        area = Area.objects.create(name='Open space')
+        statuses = [DeskStatus.AVAILABLE, DeskStatus.OCCUPIED, DeskStatus.RESERVED, DeskStatus.MAINTENANCE]
+        desks = {
+            status: Desk.objects.create(
+                name=status, desk_number=status, area=area, status=status, x_coordinate=0, y_coordinate=0
+            )
+            for status in statuses
+        }
+        channel_layer = get_channel_layer()
+        channel_name = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)(broadcast.floor_group(area.floor), channel_name)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(reset_desk_statuses()['rows'], 2)
+
+        message = async_to_sync(channel_layer.receive)(channel_name)
+        self.assertEqual(message['type'], 'desks_reset_message')
+        self.assertEqual(
+            sorted(message['desk_ids']),
+            sorted([desks[DeskStatus.OCCUPIED].id, desks[DeskStatus.RESERVED].id])
+        )
+        self.assertFalse(channel_layer.channels.get(channel_name))
+        self.assertEqual(
+            Desk.objects.get(id=desks[DeskStatus.MAINTENANCE].id).status, DeskStatus.MAINTENANCE
+        )
+
+
+class BroadcastTests(TestCase):
+    """Отложенная до фиксации транзакции и схлопывающая отправка уведомлений."""
+
+    def setUp(self):
+        super().setUp()
+        self.area = Area.objects.create(name='Open space')
+        self.channel_layer = get_channel_layer()
+        self.channel_name = async_to_sync(self.channel_layer.new_channel)()
+        async_to_sync(self.channel_layer.group_add)(broadcast.floor_group(self.area.floor), self.channel_name)
+
+    def create_desk(self, number):
+        return Desk.objects.create(
+            name=number, desk_number=number, area=self.area, x_coordinate=0, y_coordinate=0
+        )
+
+    def pending_messages(self):
+        return self.channel_layer.channels.get(self.channel_name)
+
+    def test_coalesced_batch(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            first = self.create_desk('D1')
+            second = self.create_desk('D2')
+        with broadcast.batch(), self.captureOnCommitCallbacks(execute=True):
+            for status in (DeskStatus.OCCUPIED, DeskStatus.RESERVED, DeskStatus.AVAILABLE):
+                first.status = status
+                first.save()
+            second.status = DeskStatus.MAINTENANCE
+            second.save()
+        # Сообщения о создании столов вне пакета ушли по одному
+        for _ in range(2):
+            async_to_sync(self.channel_layer.receive)(self.channel_name)
+
+        message = async_to_sync(self.channel_layer.receive)(self.channel_name)
+        self.assertEqual(message['type'], 'batch_message')
+        self.assertEqual(
+            [(item['desk_id'], item['status']) for item in message['messages']],
+            [(first.id, DeskStatus.AVAILABLE), (second.id, DeskStatus.MAINTENANCE)]
+        )
+        self.assertFalse(self.pending_messages())
+
+    def test_rollback_is_not_broadcast(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                self.create_desk('D1')
+                raise RuntimeError
+        self.assertFalse(self.pending_messages())
+
+
+class OfficeConsumerGroupTests(TransactionTestCase):
+    """Соединение получает только столы своих этажей и свои бронирования."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username='viewer')
+        self.other_user = User.objects.create(username='other')
+        self.token = Token.objects.create(user=self.user)
+        self.first_floor_desk = Desk.objects.create(
+            name='D1', desk_number='D1', area=Area.objects.create(name='First', floor=1),
+            x_coordinate=0, y_coordinate=0
+        )
+        self.second_floor_desk = Desk.objects.create(
+            name='D2', desk_number='D2', area=Area.objects.create(name='Second', floor=2),
+            x_coordinate=0, y_coordinate=0
+        )
+
+    async def connect(self, query=''):
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns), f'/ws/office/{self.token.key}/{query}'
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual((await communicator.receive_json_from())['type'], 'connection_established')
+        return communicator
+
+    async def test_floor_and_user_routing(self):
+        communicator = await self.connect('?floors=1')
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'subscribed', 'floors': [1]})
+
+        start = timezone.now() + timedelta(days=1)
+        await sync_to_async(Reservation.objects.create)(
+            user=self.other_user, desk=self.first_floor_desk, start_time=start, end_time=start + timedelta(hours=1)
+        )
+        self.second_floor_desk.status = DeskStatus.MAINTENANCE
+        await sync_to_async(self.second_floor_desk.save)()
+        self.first_floor_desk.status = DeskStatus.OCCUPIED
+        await sync_to_async(self.first_floor_desk.save)()
+
+        # Чужое бронирование и стол другого этажа не приходят
+        message = await communicator.receive_json_from()
+        self.assertEqual(message['type'], 'desk_status_update')
+        self.assertEqual(message['desk_id'], self.first_floor_desk.id)
+
+        own = await sync_to_async(Reservation.objects.create)(
+            user=self.user, desk=self.second_floor_desk, start_time=start, end_time=start + timedelta(hours=1)
+        )
+        message = await communicator.receive_json_from()
+        self.assertEqual((message['type'], message['reservation_id']), ('reservation_update', own.id))
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+    async def test_subscribe_messages(self):
+        communicator = await self.connect()
+        await communicator.send_json_to({'type': 'subscribe', 'floors': [2, 'x', 3]})
+        self.assertEqual((await communicator.receive_json_from())['floors'], [2, 3])
+        await communicator.send_json_to({'type': 'unsubscribe', 'floors': [3]})
+        self.assertEqual((await communicator.receive_json_from())['floors'], [2])
+        await communicator.disconnect()
+
+
+@skipUnless(redis_available(), 'Redis недоступен')
+class EventLogTests(TestCase):
+    """Журнал событий группы и чтение пропущенных событий."""
+
+    group = 'test_event_log'
+
+    def test_read_since(self):
+        seqs = [event_log.append(self.group, {'type': 'desk_status_update_message', 'desk_id': i}) for i in range(3)]
+        self.assertEqual(seqs, [1, 2, 3])
+
+        current, events = event_log.read_since(self.group, 1)
+        self.assertEqual(current, 3)
+        self.assertEqual([(seq, event['desk_id']) for seq, event in events], [(2, 1), (3, 2)])
+        self.assertEqual(event_log.read_since(self.group, 3), (3, []))
+
+    def test_gap_requires_snapshot(self):
+        for i in range(3):
+            event_log.append(self.group, {'type': 'desk_status_update_message', 'desk_id': i})
+        # Первое событие вытеснено из потока
+        get_redis().xdel(f'events:{self.group}', '1-0')
+        self.assertIsNone(event_log.read_since(self.group, 0))
+        self.assertIsNotNone(event_log.read_since(self.group, 1))
+        # Номер клиента больше текущего: журнал начат заново
+        self.assertIsNone(event_log.read_since(self.group, 10))
+
+
+@skipUnless(redis_available(), 'Redis недоступен')
+class OfficeConsumerResumeTests(TransactionTestCase):
+    """Возобновление потока после переподключения."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username='viewer')
+        self.token = Token.objects.create(user=self.user)
+        self.area = Area.objects.create(name='Resume', floor=77)
+        self.group = broadcast.floor_group(self.area.floor)
+        self.desk = Desk.objects.create(
+            name='D1', desk_number='D1', area=self.area, x_coordinate=0, y_coordinate=0
+        )
+
+    async def connect(self, query=''):
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns), f'/ws/office/{self.token.key}/?floors={self.area.floor}{query}'
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual((await communicator.receive_json_from())['type'], 'connection_established')
+        self.assertEqual((await communicator.receive_json_from())['type'], 'subscribed')
+        return communicator
+
+    async def set_status(self, status):
+        self.desk.status = status
+        await sync_to_async(self.desk.save)()
+
+    async def test_resume_and_snapshot(self):
+        await self.set_status(DeskStatus.OCCUPIED)
+        await self.set_status(DeskStatus.RESERVED)
+
+        communicator = await self.connect()
+        await communicator.send_json_to({'type': 'resume', 'positions': {self.group: 2}})
+        message = await communicator.receive_json_from()
+        self.assertEqual((message['stream'], message['seq'], message['status']), (self.group, 3, DeskStatus.RESERVED))
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'resumed', 'positions': {self.group: 3}})
+
+        # Пропущенные события вытеснены из журнала — приходит снимок этажа
+        await sync_to_async(get_redis().delete)(f'events:{self.group}')
+        await communicator.send_json_to({'type': 'resume', 'positions': {self.group: 1}})
+        snapshot = await communicator.receive_json_from()
+        self.assertEqual(snapshot['type'], 'snapshot')
+        self.assertEqual(snapshot['desks'], [{'id': self.desk.id, 'status': DeskStatus.RESERVED}])
+        self.assertEqual((await communicator.receive_json_from())['positions'], {self.group: 3})
+        await communicator.disconnect()
+
+    async def test_live_events_held_until_resume(self):
+        await self.set_status(DeskStatus.OCCUPIED)
+        communicator = await self.connect('&resume=1')
+
+        # Живое событие до resume придерживается, а не обгоняет пропущенные
+        await self.set_status(DeskStatus.RESERVED)
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.send_json_to({'type': 'resume', 'positions': {self.group: 1}})
+        seqs = [(await communicator.receive_json_from()).get('seq') for _ in range(3)]
+        self.assertEqual(seqs, [2, 3, None])
+        # Придержанное событие уже дослано и повторно не приходит
+        self.assertTrue(await communicator.receive_nothing())
+
+        await self.set_status(DeskStatus.AVAILABLE)
+        self.assertEqual((await communicator.receive_json_from())['seq'], 4)
+        await communicator.disconnect()
+
+
+@skipUnless(redis_available(), 'Redis недоступен')
+class CachedTokenAuthenticationTests(TestCase):
+    """Аутентификация по токену без запросов к БД и сброс кеша."""
+
+    def setUp(self):
+        super().setUp()
+        authentication._local_cache.clear()
+        self.user = User.objects.create(username='cached')
+        self.token = Token.objects.create(user=self.user)
+        self.client = APIClient(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def auth_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/users/me/')
+        self.assertEqual(response.status_code, 200)
+        return [query['sql'] for query in queries if Token._meta.db_table in query['sql']]
+
+    def test_cached_read_path(self):
+        self.assertEqual(len(self.auth_queries()), 1)
+        self.assertEqual(self.auth_queries(), [])
+        # Без локального кеша пользователь берется из Redis
+        authentication._local_cache.clear()
+        self.assertEqual(self.auth_queries(), [])
+
+    def test_cached_user_not_shared(self):
+        first = authentication.get_user_for_token(self.token.key)
+        first.first_name = 'changed'
+        # Каждый вызов получает свой экземпляр: изменения одного запроса не видны другим
+        second = authentication.get_user_for_token(self.token.key)
+        self.assertIsNot(first, second)
+        self.assertEqual(second.first_name, '')
+        self.assertIsNot(second, authentication.get_user_for_token(self.token.key))
+
+    def test_cached_fields_without_password(self):
+        self.auth_queries()
+        cached = json.loads(get_redis().get(f'auth:user:{self.token.key}'))
+        self.assertEqual((cached['id'], cached['username'], cached['is_active']), (self.user.id, 'cached', True))
+        self.assertNotIn('password', cached)
+
+        # Пользователь из кеша сохраняется без потери пароля и других полей
+        self.user.set_password('secret')
+        self.user.save()
+        authentication._local_cache.clear()
+        self.assertEqual(self.client.patch('/api/users/update_me/', {'department': 'IT'}).status_code, 200)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.department, 'IT')
+        self.assertTrue(self.user.check_password('secret'))
+
+    def test_unreadable_entry_ignored(self):
+        # Запись не в JSON (например, pickle) не исполняется, пользователь берется из БД
+        get_redis().set(f'auth:user:{self.token.key}', pickle.dumps(self.user))
+        with self.assertLogs('core.authentication', 'WARNING'):
+            self.assertEqual(len(self.auth_queries()), 1)
+        self.assertEqual(json.loads(get_redis().get(f'auth:user:{self.token.key}'))['id'], self.user.id)
+
+    def test_deactivation_invalidates(self):
+        self.auth_queries()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+    def test_token_regeneration_invalidates(self):
+        self.auth_queries()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.token.delete()
+            Token.objects.create(user=self.user)
+        self.assertEqual(self.client.get('/api/users/me/').status_code, 401)
+
+
+@skipUnless(redis_available(), 'Redis недоступен')
+@override_settings(
+    WS_RATE_LIMIT_PER_SECOND=0.01,
+    WS_RATE_LIMIT_BURST=4
+)
+class OfficeConsumerThrottlingTests(TransactionTestCase):
+    """Лимит, проверка и отсечение повторов сообщений клиента."""
+
+    def setUp(self):
+        super().setUp()
+        self.token = Token.objects.create(user=User.objects.create(username='client'))
+        self.desk = Desk.objects.create(
+            name='D1', desk_number='D1', area=Area.objects.create(name='Throttle', floor=78),
+            x_coordinate=0, y_coordinate=0
+        )
+
+    async def connect(self):
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns), f'/ws/office/{self.token.key}/?floors=78'
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.receive_json_from()
+        await communicator.receive_json_from()
+        return communicator
+
+    async def test_invalid_and_duplicate(self):
+        communicator = await self.connect()
+        await communicator.send_json_to({'type': 'desk_status_update', 'desk_id': 'x', 'status': 'occupied'})
+        self.assertEqual((await communicator.receive_json_from())['type'], 'error')
+
+        update = {'type': 'desk_status_update', 'desk_id': self.desk.id, 'status': DeskStatus.OCCUPIED}
+        await communicator.send_json_to(update)
+        self.assertEqual((await communicator.receive_json_from())['status'], DeskStatus.OCCUPIED)
+        # Тот же статус повторно не рассылается
+        await communicator.send_json_to(update)
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+    async def test_rate_limit(self):
+        before = await sync_to_async(throttling.dropped_counts)()
+        communicator = await self.connect()
+        for _ in range(6):
+            await communicator.send_json_to({'type': 'ping', 'timestamp': 1})
+        for _ in range(4):
+            self.assertEqual((await communicator.receive_json_from())['type'], 'pong')
+        self.assertTrue(await communicator.receive_nothing())
+        await communicator.disconnect()
+
+        after = await sync_to_async(throttling.dropped_counts)()
+        self.assertEqual(after.get('rate_limited', 0) - before.get('rate_limited', 0), 2)
+
+    @override_settings(WS_DROPS_FLUSH_EVERY=3)
+    async def test_drops_flushed_while_connected(self):
+        communicator = await self.connect()
+        for _ in range(9):
+            await communicator.send_json_to({'type': 'ping', 'timestamp': 1})
+        for _ in range(4):
+            await communicator.receive_json_from()
+        self.assertTrue(await communicator.receive_nothing())
+
+        # Счетчики попадают в Redis каждые 3 отброшенных сообщения, не дожидаясь отключения
+        self.assertEqual(await sync_to_async(throttling.dropped_counts)(), {'rate_limited': 3})
+        client = APIClient()
+        await sync_to_async(client.force_authenticate)(await sync_to_async(User.objects.get)(username='client'))
+        stats = (await sync_to_async(client.get)('/api/office/stats/')).data['websocket_stats']
+        self.assertEqual(stats, {'dropped_messages': {'rate_limited': 3}})
+
+        await communicator.disconnect()
+        self.assertEqual(await sync_to_async(throttling.dropped_counts)(), {'rate_limited': 5})
+
+
+@skipUnless(redis_available(), 'Redis недоступен')
+@override_settings(WS_COMPRESS_MIN_BYTES=0)
+class OfficeConsumerEncodingTests(TransactionTestCase):
+    """Компактные кодировки и сжатие сообщений сервера."""
+
+    def setUp(self):
+        super().setUp()
+        self.token = Token.objects.create(user=User.objects.create(username='encoded'))
+        self.area = Area.objects.create(name='Encoding', floor=79)
+        self.desk = Desk.objects.create(
+            name='D1', desk_number='D1', area=self.area, x_coordinate=0, y_coordinate=0
+        )
+
+    async def connect(self, query):
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns), f'/ws/office/{self.token.key}/?floors=79&{query}'
+        )
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.receive_output()
+        await communicator.receive_output()
+        return communicator
+
+    async def test_group_event_encoded_once(self):
+        first = await self.connect('encoding=msgpack')
+        second = await self.connect('encoding=msgpack')
+        compact = await self.connect('encoding=compact')
+
+        with mock.patch.object(protocol, 'encode', wraps=protocol.encode) as encode:
+            self.desk.status = DeskStatus.OCCUPIED
+            await sync_to_async(self.desk.save)()
+
+            frames = [(await communicator.receive_output())['bytes'] for communicator in (first, second)]
+            compact_frame = await compact.receive_from()
+        # Кодируются только кодировки подключенных клиентов, каждая один раз
+        self.assertEqual(sorted(call.args[1] for call in encode.call_args_list), ['compact', 'msgpack'])
+        self.assertIs(frames[0], frames[1])
+        self.assertEqual(frames[0][:1], protocol.FRAME_PLAIN)
+        message = msgpack.unpackb(frames[0][1:])
+        self.assertEqual((message['t'], message['d'], message['s']), ('desk_status_update', self.desk.id, DeskStatus.OCCUPIED))
+        self.assertEqual(json.loads(compact_frame), message)
+        for communicator in (first, second, compact):
+            await communicator.disconnect()
+
+    async def test_compressed_snapshot(self):
+        communicator = await self.connect('compress=1')
+        await communicator.send_json_to({'type': 'resume', 'positions': {broadcast.floor_group(79): 10 ** 6}})
+        frame = (await communicator.receive_output())['bytes']
+        self.assertEqual(frame[:1], protocol.FRAME_ZLIB)
+        snapshot = json.loads(zlib.decompress(frame[1:]))
+        self.assertEqual(snapshot['desks'], [{'id': self.desk.id, 'status': DeskStatus.AVAILABLE}])
+        await communicator.disconnect()
+
+
+@skipUnless(redis_available(), 'Redis недоступен')
+class PresenceTests(TransactionTestCase):
+    """Присутствие по ping соединений и отметкам о прибытии."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username='present')
+        self.token = Token.objects.create(user=self.user)
+        self.desk = Desk.objects.create(
+            name='D1', desk_number='D1', area=Area.objects.create(name='Presence', floor=80),
+            x_coordinate=0, y_coordinate=0
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    async def test_ping_heartbeat(self):
+        communicator = WebsocketCommunicator(
+            URLRouter(websocket_urlpatterns), f'/ws/office/{self.token.key}/?floors=80'
+        )
+        await communicator.connect()
+        await communicator.receive_json_from()
+        await communicator.receive_json_from()
+        await communicator.send_json_to({'type': 'ping', 'timestamp': 1})
+        await communicator.receive_json_from()
+        await communicator.disconnect()
+
+        self.assertEqual(await sync_to_async(presence.floor_presence)(80), {'user_ids': [self.user.id], 'desk_ids': []})
+
+    def test_check_in_and_cancel(self):
+        now = timezone.now()
+        reservation = Reservation.objects.create(
+            user=self.user, desk=self.desk, start_time=now - timedelta(hours=1), end_time=now + timedelta(hours=1)
+        )
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.post(f'/api/reservations/{reservation.id}/check_in/').status_code, 200)
+        # Этаж берется из стола и зоны, загруженных вместе с бронированием
+        self.assertFalse([query for query in queries if query['sql'].startswith('SELECT "desks_area"."floor"')])
+
+        response = self.client.get('/api/desks/presence/', {'floor': 80})
+        self.assertEqual(response.data, {'floor': 80, 'people_present': 1, 'occupied_desk_ids': [self.desk.id]})
+        stats = self.client.get('/api/office/stats/').data['presence_stats']
+        self.assertIn({'floor': 80, 'people': 1, 'occupied_desks': 1}, stats['floors'])
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.post(f'/api/reservations/{reservation.id}/cancel/').status_code, 200)
+        self.assertFalse([query for query in queries if query['sql'].startswith('SELECT "desks_area"."floor"')])
+        self.assertEqual(presence.floor_presence(80)['desk_ids'], [])
+
+        # Без загруженного стола этаж читается отдельным запросом
+        reservation = Reservation.objects.create(
+            user=self.user, desk=self.desk, start_time=now - timedelta(hours=1), end_time=now + timedelta(hours=1)
+        )
+        Reservation.objects.get(pk=reservation.pk).check_in()
+        self.assertEqual(presence.floor_presence(80)['desk_ids'], [self.desk.id])
+
+
+@mock.patch.object(KeysetPagination, 'page_size', 100)
+class KeysetPaginationTests(TestCase):
+    """Курсор по всем полям порядка проходит любое число одинаковых значений."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username='staff', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        area = Area.objects.create(name='Open space')
+        # Больше offset_cutoff (1000) строк с одинаковым значением первого поля
+        self.desks = Desk.objects.bulk_create([
+            Desk(name=f'Desk {i % 7}', desk_number=f'D{i:04}', area=area, x_coordinate=0, y_coordinate=0)
+            for i in range(1100)
+        ])
+
+    def walk(self, url):
+        """Пройти страницы вперед и назад, вернуть id в порядке выдачи."""
+        forward, pages = [], []
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                data = self.client.get(url).json()
+            # Страница без COUNT и OFFSET
+            for query in queries.captured_queries:
+                self.assertNotIn('OFFSET', query['sql'])
+                self.assertNotIn('COUNT(', query['sql'])
+            forward += [row['id'] for row in data['results']]
+            pages.append([row['id'] for row in data['results']])
+            url = data['next']
+        self.assertEqual(len(forward), len(set(forward)))
+
+        # Назад от последней страницы — те же страницы в обратном порядке
+        url = data['previous']
+        for page in reversed(pages[:-1]):
+            data = self.client.get(url).json()
+            self.assertEqual([row['id'] for row in data['results']], page)
+            url = data['previous']
+        self.assertIsNone(url)
+        return forward
+
+    def test_tied_desks(self):
+        ids = self.walk('/api/desks/?ordering=status')
+        self.assertEqual(ids, sorted(desk.id for desk in self.desks))
+
+        # Разные направления полей
+        ids = self.walk('/api/desks/?ordering=-name,desk_number')
+        expected = sorted(self.desks, key=lambda desk: desk.desk_number)
+        expected = sorted(expected, key=lambda desk: desk.name, reverse=True)
+        self.assertEqual(ids, [desk.id for desk in expected])
+
+    def test_tied_reservations(self):
+        start = timezone.now().replace(hour=9, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        Reservation.objects.bulk_create([
+            Reservation(user=self.user, desk=desk, start_time=start, end_time=start + timedelta(hours=8))
+            for desk in self.desks
+        ])
+        ids = self.walk('/api/reservations/')
+        self.assertEqual(ids, sorted(Reservation.objects.values_list('id', flat=True), reverse=True))
+
+    def test_invalid_cursor(self):
+        for cursor in ['garbage', 'cD0lNUIxJTVE', 'cD0lNUIlMjJ4JTIyJTJDJTIyeSUyMiU1RA==']:
+            self.assertEqual(self.client.get('/api/desks/', {'cursor': cursor}).status_code, 404, cursor)
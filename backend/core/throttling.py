@@ -0,0 +1,96 @@
+"""
+Ограничение и отбраковка сообщений, присылаемых клиентами по WebSocket.
+
+Лимит считается для каждого соединения в памяти (TokenBucket), поэтому
+поток сообщений отбрасывается без обращения к Redis и БД. Одинаковые
+обновления статуса стола от разных соединений отсекаются по последнему
+разосланному статусу в Redis. Число отброшенных сообщений по причинам
+накапливается в соединении и добавляется к хешу Redis ``ws:dropped`` каждые
+WS_DROPS_FLUSH_EVERY отброшенных сообщений и при отключении; общие счетчики
+отдает статистика офиса (core.views.OfficeStatsView).
+"""
+import logging
+import time
+
+import redis
+from django.conf import settings
+
+from core.redis import get_redis
+
+logger = logging.getLogger(__name__)
+
+DROPPED_KEY = 'ws:dropped'
+
+
+class TokenBucket:
+    """Корзина токенов: rate токенов в секунду, не больше capacity подряд."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def consume(self):
+        """Забрать токен. Возвращает False, если лимит исчерпан."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens < 1:
+            return False
+        self.tokens -= 1
+        return True
+
+
+def _desk_status_key(desk_id):
+    return f'ws:desk_status:{desk_id}'
+
+
+def remember_desk_statuses(desk_ids, status):
+    """Запомнить статус столов, разосланный сервером после их сохранения."""
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for desk_id in desk_ids:
+            pipe.set(_desk_status_key(desk_id), status, ex=settings.WS_STATUS_DEDUP_SECONDS)
+        pipe.execute()
+    except redis.RedisError:
+        logger.exception('Не удалось сохранить статус стола для отсечения повторов')
+
+
+def is_duplicate_desk_status(desk_id, status):
+    """
+    Совпадает ли статус с последним разосланным для стола.
+
+    Запоминает новый статус на WS_STATUS_DEDUP_SECONDS. При недоступном
+    Redis дубликаты не отсекаются.
+    """
+    try:
+        previous = get_redis().set(
+            _desk_status_key(desk_id), status,
+            ex=settings.WS_STATUS_DEDUP_SECONDS, get=True
+        )
+    except redis.RedisError:
+        logger.exception('Не удалось проверить повтор статуса стола')
+        return False
+    return previous is not None and previous.decode() == status
+
+
+def record_drops(counts):
+    """Добавить счетчики отброшенных сообщений соединения к общим."""
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for reason, count in counts.items():
+            pipe.hincrby(DROPPED_KEY, reason, count)
+        pipe.execute()
+    except redis.RedisError:
+        logger.exception('Не удалось сохранить счетчики отброшенных сообщений')
+
+
+def dropped_counts():
+    """Общие счетчики отброшенных сообщений по причинам или None, если Redis недоступен."""
+    try:
+        counts = get_redis().hgetall(DROPPED_KEY)
+    except redis.RedisError:
+        logger.exception('Счетчики отброшенных сообщений недоступны')
+        return None
+    return {reason.decode(): int(count) for reason, count in counts.items()}
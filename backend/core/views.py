@@ -5,6 +5,7 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework import status
 from desks.models import Desk, Area
 from reservations.models import Reservation, ReservationStatus
+from core import presence, throttling
 
 
 class OfficeStatsView(APIView):
@@ -15,7 +16,12 @@ class OfficeStatsView(APIView):
     def get(self, request):
         """Обработка GET-запроса для получения статистики."""
         now = timezone.now()
-        today = now.date()
+        # Границы текущего дня диапазоном, а не через start_time__date:
+        # так фильтр может использовать индексы по start_time
+        today_start = timezone.make_aware(
+            timezone.datetime.combine(timezone.localdate(now), timezone.datetime.min.time())
+        )
+        today_end = today_start + timezone.timedelta(days=1)
         
         # Статистика по столам
         total_desks = Desk.objects.count()
@@ -38,9 +44,17 @@ class OfficeStatsView(APIView):
                 'occupied_desks': area_desks.filter(status__in=['occupied', 'reserved']).count()
             })
         
+        # Присутствие по этажам: сигналы соединений и отметки о прибытии в Redis
+        floors = sorted({area.floor for area in areas})
+        floor_counts = presence.floor_counts(floors)
+        
+        # Сообщения клиентов WebSocket, отброшенные лимитами и проверками
+        dropped_messages = throttling.dropped_counts()
+        
         # Статистика по бронированиям
         today_reservations = Reservation.objects.filter(
-            start_time__date=today,
+            start_time__gte=today_start,
+            start_time__lt=today_end,
             status=ReservationStatus.ACTIVE
         ).count()
         
@@ -51,15 +65,16 @@ class OfficeStatsView(APIView):
         ).count()
         
         upcoming_reservations = Reservation.objects.filter(
-            start_time__date=today,
             start_time__gt=now,
+            start_time__lt=today_end,
             status=ReservationStatus.ACTIVE
         ).count()
         
         # Статистика по пользователю
         user_reservations_today = Reservation.objects.filter(
             user=request.user,
-            start_time__date=today
+            start_time__gte=today_start,
+            start_time__lt=today_end
         ).count()
         
         user_active_reservation = Reservation.objects.filter(
@@ -79,6 +94,14 @@ class OfficeStatsView(APIView):
                 'maintenance': maintenance_desks
             },
             'area_stats': area_stats,
+            'presence_stats': None if floor_counts is None else {
+                'people_present': sum(counts['people'] for counts in floor_counts.values()),
+                'desks_occupied': sum(counts['occupied_desks'] for counts in floor_counts.values()),
+                'floors': [{'floor': floor, **counts} for floor, counts in floor_counts.items()]
+            },
+            'websocket_stats': None if dropped_messages is None else {
+                'dropped_messages': dropped_messages
+            },
             'reservation_stats': {
                 'today_total': today_reservations,
                 'active_now': active_reservations,
@@ -0,0 +1,288 @@
+"""
+Индекс доступности столов в Redis.
+
+Для каждого дня хранится хеш ``availability:<дата>``: поле — id стола,
+значение — битовая карта занятых 15-минутных слотов этого дня (бит N
+соответствует слоту, начинающемуся в N * 15 минут от полуночи по местному
+времени). Столы без активных бронирований в хеш не попадают. Ключ
+``availability:<дата>:ready`` отмечает, что день построен полностью; пока его
+нет, день считается холодным и запросы идут в БД.
+
+Карты обновляются точечно при сохранении и удалении бронирований
+(core.signals) и целиком командой ``rebuild_availability``. Каждое точечное
+обновление повышает поколение дня ``availability:<дата>:generation``, в том
+числе для холодных дней. Построение дня целиком и точечный пересчет сверяют
+поколение до чтения БД и при записи (WATCH/MULTI): если за это время
+бронирования изменились, построенный день не помечается готовым, а пересчет
+повторяется, чтобы более раннее чтение БД не перезаписало более позднее.
+"""
+import logging
+from datetime import timedelta
+
+import redis
+from django.utils import timezone
+
+from core.redis import get_redis
+from reservations.models import Reservation, ReservationStatus
+
+logger = logging.getLogger(__name__)
+
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+BITMAP_BYTES = (SLOTS_PER_DAY + 7) // 8
+
+# Сколько хранить карту дня после его окончания
+DAY_TTL_AFTER_END = timedelta(days=1)
+
+# Сколько раз пересчитывать карты столов, если поколение дня изменилось
+# во время пересчета; затем день помечается холодным
+REFRESH_ATTEMPTS = 3
+
+
+def _day_key(day):
+    return f'availability:{day.isoformat()}'
+
+
+def _ready_key(day):
+    return f'availability:{day.isoformat()}:ready'
+
+
+def _generation_key(day):
+    return f'availability:{day.isoformat()}:generation'
+
+
+def day_bounds(day):
+    """Начало и конец дня в текущем часовом поясе."""
+    day_start = timezone.make_aware(timezone.datetime.combine(day, timezone.datetime.min.time()))
+    return day_start, day_start + timedelta(days=1)
+
+
+def days_spanned(start_time, end_time):
+    """Местные даты, которые затрагивает интервал."""
+    first_day = timezone.localtime(start_time).date()
+    # Интервал полуоткрытый: окончание ровно в полночь не занимает следующий день
+    last_day = timezone.localtime(end_time - timedelta(microseconds=1)).date()
+    return [first_day + timedelta(days=i) for i in range((last_day - first_day).days + 1)]
+
+
+def _clock_slot(value, round_up=False):
+    """Номер слота по времени на часах (минуты от полуночи)."""
+    minutes = value.hour * 60 + value.minute
+    if round_up and (minutes % SLOT_MINUTES or value.second or value.microsecond):
+        return minutes // SLOT_MINUTES + 1
+    return minutes // SLOT_MINUTES
+
+
+def window_mask(time_from, time_to):
+    """
+    Маска слотов для окна внутри одного дня.
+
+    Возвращает None, если границы окна не выровнены по слотам: такой запрос
+    нельзя точно ответить по битовой карте.
+    """
+    for value in (time_from, time_to):
+        if value.minute % SLOT_MINUTES or value.second or value.microsecond:
+            return None
+
+    first_slot = _clock_slot(time_from)
+    last_slot = SLOTS_PER_DAY if time_to.date() > time_from.date() else _clock_slot(time_to)
+    if last_slot <= first_slot:
+        return None
+    return ((1 << (last_slot - first_slot)) - 1) << first_slot
+
+
+def reservation_mask(start_time, end_time, day):
+    """Маска слотов дня, которые занимает бронирование (частично занятый слот считается занятым)."""
+    local_start = timezone.localtime(start_time)
+    local_end = timezone.localtime(end_time)
+
+    first_slot = 0 if local_start.date() < day else _clock_slot(local_start)
+    last_slot = SLOTS_PER_DAY if local_end.date() > day else _clock_slot(local_end, round_up=True)
+    if last_slot <= first_slot:
+        return 0
+    return ((1 << (last_slot - first_slot)) - 1) << first_slot
+
+
+def _active_reservations(days, desk_ids=None):
+    """Активные бронирования, пересекающиеся с указанными днями."""
+    range_start = day_bounds(min(days))[0]
+    range_end = day_bounds(max(days))[1]
+    queryset = Reservation.objects.filter(
+        status=ReservationStatus.ACTIVE,
+        start_time__lt=range_end,
+        end_time__gt=range_start
+    )
+    if desk_ids is not None:
+        queryset = queryset.filter(desk_id__in=desk_ids)
+    return queryset.order_by().values_list('desk_id', 'start_time', 'end_time')
+
+
+def _compute_bitmaps(days, desk_ids=None):
+    """Битовые карты {день: {id стола: маска}} по данным БД одним запросом."""
+    bitmaps = {day: {} for day in days}
+    for desk_id, start_time, end_time in _active_reservations(days, desk_ids):
+        for day in days_spanned(start_time, end_time):
+            if day in bitmaps:
+                desk_bitmaps = bitmaps[day]
+                desk_bitmaps[desk_id] = desk_bitmaps.get(desk_id, 0) | reservation_mask(start_time, end_time, day)
+    return bitmaps
+
+
+def _day_expire_at(day):
+    return day_bounds(day)[1] + DAY_TTL_AFTER_END
+
+
+def build_days(days):
+    """
+    Полностью перестроить карты указанных дней. Возвращает карты.
+
+    Дни, поколение которых изменилось во время построения, не записываются и
+    остаются холодными: прочитанные из БД данные могли не учесть бронирование,
+    зафиксированное между чтением и записью.
+    """
+    days = sorted(set(days))
+    if not days:
+        return {}
+
+    connection = get_redis()
+    generation_keys = [_generation_key(day) for day in days]
+    # Поколение читается до БД: изменение после чтения будет замечено при записи
+    generations = connection.mget(generation_keys)
+    bitmaps = _compute_bitmaps(days)
+
+    with connection.pipeline(transaction=True) as pipe:
+        try:
+            pipe.watch(*generation_keys)
+            current = pipe.mget(generation_keys)
+            pipe.multi()
+            for day, before, after in zip(days, generations, current):
+                if before != after:
+                    continue
+                expire_at = _day_expire_at(day)
+                pipe.delete(_day_key(day))
+                if bitmaps[day]:
+                    pipe.hset(_day_key(day), mapping={
+                        desk_id: mask.to_bytes(BITMAP_BYTES, 'little')
+                        for desk_id, mask in bitmaps[day].items()
+                    })
+                    pipe.expireat(_day_key(day), expire_at)
+                pipe.set(_ready_key(day), 1)
+                pipe.expireat(_ready_key(day), expire_at)
+            pipe.execute()
+        except redis.WatchError:
+            # Бронирования изменились между проверкой и записью: дни остаются холодными
+            logger.info('Карты доступности за %s изменились во время построения', days)
+    return bitmaps
+
+
+def refresh_desks(desk_ids, days):
+    """
+    Пересчитать карты столов за указанные дни после изменения бронирований.
+
+    Холодные дни не пересчитываем: они будут построены целиком при первом
+    запросе. Поколение повышается у всех дней, чтобы идущее параллельно
+    построение дня не пометило его построенным по устаревшим данным. Запись
+    карт теплых дней выполняется, только если их поколение не изменилось с
+    чтения БД; иначе пересчет повторяется (до REFRESH_ATTEMPTS раз), а затем
+    дни помечаются холодными. При ошибке Redis день помечается холодным,
+    чтобы не отдавать устаревшие данные.
+    """
+    desk_ids = set(desk_ids)
+    days = sorted(set(days))
+    if not desk_ids or not days:
+        return
+
+    connection = get_redis()
+    try:
+        pipe = connection.pipeline(transaction=False)
+        for day in days:
+            pipe.incr(_generation_key(day))
+            pipe.expireat(_generation_key(day), _day_expire_at(day))
+        pipe.mget([_ready_key(day) for day in days])
+        results = pipe.execute()
+        ready = results[-1]
+        warm = [(day, results[2 * i]) for i, (day, flag) in enumerate(zip(days, ready)) if flag]
+        if not warm:
+            return
+
+        warm_days = [day for day, _ in warm]
+        generation_keys = [_generation_key(day) for day in warm_days]
+        generations = [generation for _, generation in warm]
+        for _ in range(REFRESH_ATTEMPTS):
+            # Поколение получено до чтения БД: изменение после чтения будет замечено при записи
+            bitmaps = _compute_bitmaps(warm_days, desk_ids)
+            with connection.pipeline(transaction=True) as pipe:
+                try:
+                    pipe.watch(*generation_keys)
+                    current = [int(value or 0) for value in pipe.mget(generation_keys)]
+                    if current != generations:
+                        # Бронирования изменились после чтения БД: пересчитываем заново
+                        generations = current
+                        continue
+                    pipe.multi()
+                    for day in warm_days:
+                        day_bitmaps = bitmaps[day]
+                        for desk_id in desk_ids:
+                            if day_bitmaps.get(desk_id):
+                                pipe.hset(_day_key(day), desk_id, day_bitmaps[desk_id].to_bytes(BITMAP_BYTES, 'little'))
+                            else:
+                                pipe.hdel(_day_key(day), desk_id)
+                        pipe.expireat(_day_key(day), _day_expire_at(day))
+                    pipe.execute()
+                    return
+                except redis.WatchError:
+                    generations = [int(value or 0) for value in connection.mget(generation_keys)]
+
+        logger.info('Карты доступности за %s менялись во время пересчета, дни помечены холодными', warm_days)
+        connection.delete(*[_ready_key(day) for day in warm_days])
+    except redis.RedisError:
+        logger.exception('Не удалось обновить индекс доступности столов')
+        try:
+            connection.delete(*[_ready_key(day) for day in days])
+        except redis.RedisError:
+            pass
+
+
+def refresh_intervals(intervals):
+    """Обновить карты по списку интервалов (id стола, начало, окончание)."""
+    desk_ids = set()
+    days = set()
+    for desk_id, start_time, end_time in intervals:
+        if desk_id and start_time and end_time and start_time < end_time:
+            desk_ids.add(desk_id)
+            days.update(days_spanned(start_time, end_time))
+    refresh_desks(desk_ids, days)
+
+
+def busy_desk_ids(day, time_from, time_to):
+    """
+    Id столов, занятых в окне [time_from, time_to) указанного дня.
+
+    Ответ строится побитовым AND карты стола с маской окна. Для холодного дня
+    карта строится одним запросом к БД и сохраняется для следующих запросов.
+    Возвращает None, если окно не выровнено по слотам или Redis недоступен:
+    тогда вызывающий код должен использовать обычный запрос к БД.
+    """
+    mask = window_mask(time_from, time_to)
+    if mask is None:
+        return None
+
+    try:
+        connection = get_redis()
+        pipe = connection.pipeline(transaction=False)
+        pipe.exists(_ready_key(day))
+        pipe.hgetall(_day_key(day))
+        is_ready, raw_bitmaps = pipe.execute()
+
+        if is_ready:
+            day_bitmaps = {
+                int(desk_id): int.from_bytes(bitmap, 'little')
+                for desk_id, bitmap in raw_bitmaps.items()
+            }
+        else:
+            day_bitmaps = build_days([day])[day]
+    except redis.RedisError:
+        logger.exception('Индекс доступности столов недоступен, используется БД')
+        return None
+
+    return {desk_id for desk_id, bitmap in day_bitmaps.items() if bitmap & mask}
@@ -0,0 +1,40 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from desks import availability
+
+
+class Command(BaseCommand):
+    """Перестроение индекса доступности столов в Redis."""
+
+    help = 'Перестраивает битовые карты занятости столов в Redis по данным БД.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days',
+            type=int,
+            default=settings.AVAILABILITY_CACHE_DAYS,
+            help='Сколько дней начиная с --start перестроить'
+        )
+        parser.add_argument(
+            '--start',
+            type=str,
+            help='Первый день в формате YYYY-MM-DD (по умолчанию сегодня)'
+        )
+
+    def handle(self, *args, **options):
+        if options['start']:
+            start = timezone.datetime.strptime(options['start'], '%Y-%m-%d').date()
+        else:
+            start = timezone.localdate()
+
+        days = [start + timedelta(days=i) for i in range(options['days'])]
+        bitmaps = availability.build_days(days)
+
+        desk_days = sum(len(day_bitmaps) for day_bitmaps in bitmaps.values())
+        self.stdout.write(self.style.SUCCESS(
+            f'Перестроено дней: {len(days)}, карт столов: {desk_days}'
+        ))
@@ -47,7 +47,9 @@ class DeskDetailSerializer(serializers.ModelSerializer):
         from django.utils import timezone
         now = timezone.now()
         
-        current_reservation = Reservation.objects.filter(
+        reservations = ReservationSerializer.setup_eager_loading(Reservation.objects)
+        
+        current_reservation = reservations.filter(
             desk=obj,
             start_time__lte=now,
             end_time__gte=now,
@@ -58,7 +60,7 @@ class DeskDetailSerializer(serializers.ModelSerializer):
             return ReservationSerializer(current_reservation).data
         
         # Проверяем будущее бронирование
-        future_reservation = Reservation.objects.filter(
+        future_reservation = reservations.filter(
             desk=obj,
             start_time__gt=now,
             status='active'
@@ -1,3 +1,288 @@
-from django.test import TestCase
+from datetime import date, time, timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import redis
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from core.redis import get_redis
+from core.testing import TestCase, redis_available
+from reservations.models import Reservation, ReservationStatus
+from users.models import User
+from . import availability
+from .models import Area, Desk, DeskStatus, DeskType
+
+
+@skipUnless(redis_available(), 'Redis недоступен')
+class AvailabilityBuildRaceTests(TestCase):
+    """Построение холодного дня параллельно с изменением бронирований."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create(username='user')
+        self.desk = Desk.objects.create(
+            name='D1', desk_number='D1', area=Area.objects.create(name='Open space'),
+            x_coordinate=0, y_coordinate=0
+        )
+        self.day = timezone.localdate() + timedelta(days=1)
+        self.day_start = availability.day_bounds(self.day)[0]
+
+    def test_reservation_committed_during_build(self):
+        compute_bitmaps = availability._compute_bitmaps
+
+        def compute_then_book(days, desk_ids=None):
+            # БД прочитана, затем бронирование фиксируется и обновляет индекс
+            bitmaps = compute_bitmaps(days, desk_ids)
+            with self.captureOnCommitCallbacks(execute=True):
+                Reservation.objects.create(
+                    user=self.user, desk=self.desk,
+                    start_time=self.day_start + timedelta(hours=10),
+                    end_time=self.day_start + timedelta(hours=11)
+                )
+            return bitmaps
+
+        window = (self.day_start + timedelta(hours=9), self.day_start + timedelta(hours=12))
+        with mock.patch.object(availability, '_compute_bitmaps', compute_then_book):
+            self.assertEqual(availability.busy_desk_ids(self.day, *window), set())
+
+        # День не помечен построенным по устаревшим данным
+        self.assertFalse(get_redis().exists(f'availability:{self.day.isoformat()}:ready'))
+        self.assertEqual(availability.busy_desk_ids(self.day, *window), {self.desk.id})
+        self.assertTrue(get_redis().exists(f'availability:{self.day.isoformat()}:ready'))
+
+    def test_interleaved_refreshes(self):
+        window = (self.day_start + timedelta(hours=9), self.day_start + timedelta(hours=12))
+        self.assertEqual(availability.busy_desk_ids(self.day, *window), set())
+        compute_bitmaps = availability._compute_bitmaps
+        calls = []
+
+        def compute_then_book(days, desk_ids=None):
+            # Первый пересчет прочитал БД, затем второй успевает записать свежую карту
+            bitmaps = compute_bitmaps(days, desk_ids)
+            calls.append(days)
+            if len(calls) == 1:
+                with self.captureOnCommitCallbacks(execute=True):
+                    Reservation.objects.create(
+                        user=self.user, desk=self.desk,
+                        start_time=self.day_start + timedelta(hours=10),
+                        end_time=self.day_start + timedelta(hours=11)
+                    )
+            return bitmaps
+
+        with mock.patch.object(availability, '_compute_bitmaps', compute_then_book):
+            availability.refresh_desks([self.desk.id], [self.day])
+
+        # Устаревшая карта первого пересчета не перезаписала свежую
+        self.assertEqual(len(calls), 3)
+        self.assertTrue(get_redis().exists(f'availability:{self.day.isoformat()}:ready'))
+        self.assertEqual(availability.busy_desk_ids(self.day, *window), {self.desk.id})
+
+
+class SlotMaskTests(TestCase):
+    """Маски 15-минутных слотов окна запроса и бронирования."""
+
+    def setUp(self):
+        super().setUp()
+        self.day = date(2030, 1, 7)
+        self.day_start = availability.day_bounds(self.day)[0]
+
+    def slots(self, mask):
+        return [slot for slot in range(availability.SLOTS_PER_DAY) if mask >> slot & 1]
+
+    def test_window_mask(self):
+        at = lambda hours, minutes=0: timezone.datetime.combine(self.day, time(hours, minutes))
+        self.assertEqual(self.slots(availability.window_mask(at(9), at(10))), [36, 37, 38, 39])
+        # До полуночи следующего дня — до последнего слота
+        midnight = timezone.datetime.combine(self.day + timedelta(days=1), time(0))
+        self.assertEqual(self.slots(availability.window_mask(at(23, 30), midnight)), [94, 95])
+        # Невыровненное или пустое окно нельзя ответить по картам
+        self.assertIsNone(availability.window_mask(at(9, 10), at(10)))
+        self.assertIsNone(availability.window_mask(at(10), at(10)))
+
+    def test_reservation_mask(self):
+        at = lambda hours, minutes=0: self.day_start + timedelta(hours=hours, minutes=minutes)
+        # Частично занятые слоты считаются занятыми целиком
+        self.assertEqual(self.slots(availability.reservation_mask(at(9, 10), at(9, 20), self.day)), [36, 37])
+        self.assertEqual(self.slots(availability.reservation_mask(at(9), at(9, 15), self.day)), [36])
+        # Бронирование через полночь занимает конец первого и начало второго дня
+        self.assertEqual(self.slots(availability.reservation_mask(at(23, 30), at(24, 30), self.day)), [94, 95])
+        self.assertEqual(
+            self.slots(availability.reservation_mask(at(23, 30), at(24, 30), self.day + timedelta(days=1))), [0, 1]
+        )
+        self.assertEqual(availability.days_spanned(at(9), at(24)), [self.day])
+        self.assertEqual(len(self.slots(availability.reservation_mask(at(-1), at(25), self.day))), 96)
+
+
+class AvailableDesksTests(TestCase):
+    """Доступные столы по битовым картам в Redis и по БД без Redis."""
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.user = User.objects.create(username='user')
+        self.client.force_authenticate(self.user)
+        area = Area.objects.create(name='Open space')
+        self.desks = [
+            Desk.objects.create(name=f'D{i}', desk_number=f'D{i}', area=area, x_coordinate=0, y_coordinate=0)
+            for i in range(3)
+        ]
+        self.day = timezone.localdate() + timedelta(days=1)
+        self.day_start = availability.day_bounds(self.day)[0]
+        self.book(self.desks[0], 10, 11)
+
+    def book(self, desk, start_hours, end_hours):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Reservation.objects.create(
+                user=self.user, desk=desk,
+                start_time=self.day_start + timedelta(hours=start_hours),
+                end_time=self.day_start + timedelta(hours=end_hours)
+            )
+
+    def available(self, time_from='09:00', time_to='12:00', reservation_queries=None):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get('/api/desks/available/', {
+                'date': self.day.isoformat(), 'time_from': time_from, 'time_to': time_to
+            })
+        self.assertEqual(response.status_code, 200)
+        if reservation_queries is not None:
+            queries = [query['sql'] for query in captured.captured_queries if 'reservations_reservation' in query['sql']]
+            self.assertEqual(len(queries), reservation_queries, '\n'.join(queries))
+        return sorted(desk['id'] for desk in response.data)
+
+    @skipUnless(redis_available(), 'Redis недоступен')
+    def test_cold_then_warm_day(self):
+        # Холодный день: карта строится одним запросом к бронированиям
+        self.assertEqual(self.available(reservation_queries=1), [self.desks[1].id, self.desks[2].id])
+        self.assertTrue(get_redis().exists(f'availability:{self.day.isoformat()}:ready'))
+        # Теплый день: бронирования из БД не читаются
+        self.assertEqual(self.available(reservation_queries=0), [self.desks[1].id, self.desks[2].id])
+        self.assertEqual(self.available('11:00', '12:00', reservation_queries=0), [desk.id for desk in self.desks])
+
+        # Изменения бронирований точечно обновляют теплый день
+        reservation = self.book(self.desks[1], 11, 12)
+        self.assertEqual(self.available(reservation_queries=0), [self.desks[2].id])
+        with self.captureOnCommitCallbacks(execute=True):
+            reservation.status = ReservationStatus.CANCELLED
+            reservation.save()
+        self.assertEqual(self.available(reservation_queries=0), [self.desks[1].id, self.desks[2].id])
+
+    def test_database_fallback(self):
+        # Невыровненное окно и недоступный Redis отвечаются запросом к БД
+        time_from = timezone.datetime.combine(self.day, time(9, 10))
+        self.assertIsNone(availability.busy_desk_ids(self.day, time_from, time_from + timedelta(hours=3)))
+        self.assertEqual(self.available('09:10', '12:00'), [self.desks[1].id, self.desks[2].id])
+
+        with mock.patch.object(availability, 'get_redis', side_effect=redis.ConnectionError):
+            with self.assertLogs('desks.availability', 'ERROR'):
+                self.assertEqual(self.available(reservation_queries=1), [self.desks[1].id, self.desks[2].id])
+                self.assertEqual(self.available('11:00', '12:00'), [desk.id for desk in self.desks])
+
+    def test_compact_format(self):
+        self.desks[2].area = Area.objects.create(name='Quiet room')
+        self.desks[2].features = ['monitor']
+        self.desks[2].x_coordinate = 12.5
+        self.desks[2].save()
+        params = {'date': self.day.isoformat(), 'time_from': '09:00', 'time_to': '12:00'}
+        expected = sorted(self.client.get('/api/desks/available/', params).json(), key=lambda desk: desk['id'])
+
+        response = self.client.get('/api/desks/available/', {**params, 'format': 'compact'})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        names = ['ids', 'desk_numbers', 'names', 'area_ids', 'xs', 'ys', 'statuses', 'desk_types', 'features']
+        # Колонки одной длины и построчно совпадают с обычным ответом
+        self.assertEqual({len(data[name]) for name in names}, {len(expected)})
+        rows = sorted(zip(*(data[name] for name in names)))
+        self.assertEqual(rows, [
+            (
+                desk['id'], desk['desk_number'], desk['name'], desk['area'], desk['x_coordinate'],
+                desk['y_coordinate'], desk['status'], desk['desk_type'], desk['features']
+            )
+            for desk in expected
+        ])
+        # Название зоны — один раз в справочнике на каждую зону из ответа
+        self.assertEqual(data['areas'], {str(desk['area']): desk['area_name'] for desk in expected})
+        self.assertEqual(len(data['areas']), 2)
+
+
+class HeatmapTests(TestCase):
+    """Число свободных столов по дням и группам."""
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.user = User.objects.create(username='user')
+        self.client.force_authenticate(self.user)
+        self.areas = [Area.objects.create(name='A'), Area.objects.create(name='B')]
+        self.desks = [
+            Desk.objects.create(
+                name=name, desk_number=name, area=area, desk_type=desk_type, x_coordinate=0, y_coordinate=0
+            )
+            for name, area, desk_type in [
+                ('A1', self.areas[0], DeskType.REGULAR),
+                ('A2', self.areas[0], DeskType.STANDING),
+                ('B1', self.areas[1], DeskType.REGULAR),
+            ]
+        ]
+        # Стол на обслуживании в тепловую карту не входит
+        Desk.objects.create(
+            name='B2', desk_number='B2', area=self.areas[1], status=DeskStatus.MAINTENANCE,
+            x_coordinate=0, y_coordinate=0
+        )
+        self.start = timezone.localdate() + timedelta(days=1)
+        day_start = availability.day_bounds(self.start)[0]
+        Reservation.objects.bulk_create([
+            Reservation(
+                user=self.user, desk=desk, status=status,
+                start_time=day_start + timedelta(hours=start_hours),
+                end_time=day_start + timedelta(hours=end_hours)
+            )
+            for desk, start_hours, end_hours, status in [
+                (self.desks[0], 9, 10, ReservationStatus.ACTIVE),
+                # До окна 09:00-18:00 — стол свободен
+                (self.desks[1], 7, 9, ReservationStatus.ACTIVE),
+                # Через ночь: занимает только окно второго дня
+                (self.desks[2], 20, 34, ReservationStatus.ACTIVE),
+                (self.desks[0], 57, 60, ReservationStatus.CANCELLED),
+            ]
+        ])
+
+    def heatmap(self, **params):
+        params = {'start': self.start.isoformat(), 'end': (self.start + timedelta(days=2)).isoformat(), **params}
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/desks/heatmap/', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        # Столы и бронирования всего диапазона — по одному запросу
+        self.assertEqual(len(queries), 2)
+        return response.data['days']
+
+    def test_free_counts(self):
+        days = self.heatmap()
+        self.assertEqual([day['free'] for day in days], [2, 2, 3])
+        self.assertEqual({day['total'] for day in days}, {3})
+        self.assertNotIn('groups', days[0])
+
+    def test_group_by(self):
+        groups = [
+            {group['key']: (group['free'], group['total']) for group in day['groups']}
+            for day in self.heatmap(group_by='area')
+        ]
+        a, b = (area.id for area in self.areas)
+        self.assertEqual(groups, [{a: (1, 2), b: (1, 1)}, {a: (2, 2), b: (0, 1)}, {a: (2, 2), b: (1, 1)}])
+
+        groups = self.heatmap(group_by='desk_type', area=a)[0]['groups']
+        self.assertEqual(
+            {group['key']: group['free'] for group in groups}, {DeskType.REGULAR: 0, DeskType.STANDING: 1}
+        )
+
+    def test_invalid_params(self):
+        for params in [
+            {'start': 'today'},
+            {'end': self.start.isoformat()},
+            {'start': self.start.isoformat(), 'end': (self.start - timedelta(days=1)).isoformat()},
+            {'start': self.start.isoformat(), 'end': (self.start + timedelta(days=100)).isoformat()},
+            {'start': self.start.isoformat(), 'end': self.start.isoformat(), 'group_by': 'floor'},
+            {'start': self.start.isoformat(), 'end': self.start.isoformat(), 'time_from': '18:00', 'time_to': '09:00'},
+        ]:
+            self.assertEqual(self.client.get('/api/desks/heatmap/', params).status_code, 400, params)
@@ -2,15 +2,30 @@ from django.utils import timezone
 from rest_framework import viewsets, filters, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from django_filters.rest_framework import DjangoFilterBackend
 from .models import Area, Desk, DeskStatus
+from . import availability
 from .serializers import (
     AreaSerializer, 
     DeskSerializer, 
     DeskDetailSerializer,
     DeskUpdateSerializer
 )
-from reservations.models import Reservation
+from core.presence import floor_presence
+from core.pagination import KeysetPagination
+from core.renderers import CompactJSONRenderer, columns
+from reservations.models import Reservation, ReservationStatus
+
+
+# Максимальная длина диапазона тепловой карты (два месяца)
+HEATMAP_MAX_DAYS = 62
+
+# Поля, по которым можно группировать тепловую карту
+HEATMAP_GROUP_FIELDS = {
+    'area': 'area_id',
+    'desk_type': 'desk_type',
+}
 
 
 class AreaViewSet(viewsets.ModelViewSet):
@@ -30,6 +45,7 @@ class DeskViewSet(viewsets.ModelViewSet):
     
     queryset = Desk.objects.all()
     serializer_class = DeskSerializer
+    pagination_class = KeysetPagination
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
     filterset_fields = ['area', 'status', 'desk_type']
     search_fields = ['name', 'desk_number', 'notes']
@@ -44,9 +60,18 @@ class DeskViewSet(viewsets.ModelViewSet):
             return DeskUpdateSerializer
         return self.serializer_class
     
-    @action(detail=False, methods=['get'])
+    @action(
+        detail=False,
+        methods=['get'],
+        renderer_classes=api_settings.DEFAULT_RENDERER_CLASSES + [CompactJSONRenderer]
+    )
     def available(self, request):
-        """Получить список доступных столов на указанную дату."""
+        """
+        Получить список доступных столов на указанную дату.
+        
+        ?format=compact возвращает колонки значений и справочник зон вместо
+        списка объектов.
+        """
         date_str = request.query_params.get('date')
         time_from_str = request.query_params.get('time_from')
         time_to_str = request.query_params.get('time_to')
@@ -99,12 +124,15 @@ class DeskViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Находим занятые столы в указанный период времени
-        occupied_desk_ids = Reservation.objects.filter(
-            status='active',
-            start_time__lt=time_to,
-            end_time__gt=time_from
-        ).values_list('desk_id', flat=True)
+        # Находим занятые столы в указанный период времени: сначала по битовым
+        # картам слотов в Redis, при невозможности — запросом к БД
+        occupied_desk_ids = availability.busy_desk_ids(date, time_from, time_to)
+        if occupied_desk_ids is None:
+            occupied_desk_ids = Reservation.objects.filter(
+                status='active',
+                start_time__lt=time_to,
+                end_time__gt=time_from
+            ).values_list('desk_id', flat=True)
         
         # Получаем доступные столы
         available_desks = Desk.objects.exclude(
@@ -122,6 +150,191 @@ class DeskViewSet(viewsets.ModelViewSet):
         if desk_type:
             available_desks = available_desks.filter(desk_type=desk_type)
         
+        if request.accepted_renderer.format == 'compact':
+            return Response(self._compact_desks(available_desks))
+        
         # Сериализуем результат
         serializer = self.get_serializer(available_desks, many=True)
-        return Response(serializer.data)
\ No newline at end of file
+        return Response(serializer.data)
+    
+    @staticmethod
+    def _compact_desks(queryset):
+        """Столы в колоночном виде, названия зон — справочником по id."""
+        rows = []
+        areas = {}
+        for row in queryset.values_list(
+            'id', 'desk_number', 'name', 'area_id', 'x_coordinate', 'y_coordinate',
+            'status', 'desk_type', 'features', 'area__name'
+        ):
+            rows.append(row[:-1])
+            areas.setdefault(row[3], row[-1])
+        
+        data = columns(rows, [
+            'ids', 'desk_numbers', 'names', 'area_ids', 'xs', 'ys',
+            'statuses', 'desk_types', 'features'
+        ])
+        data['areas'] = areas
+        return data
+    
+    @action(detail=False, methods=['get'])
+    def presence(self, request):
+        """
+        Присутствующие сотрудники и фактически занятые столы этажа (?floor=).
+        
+        Данные берутся из Redis (core.presence); если он недоступен — из
+        бронирований с отметкой о прибытии.
+        """
+        try:
+            floor = int(request.query_params['floor'])
+        except (KeyError, ValueError):
+            return Response(
+                {"error": "Укажите этаж: ?floor=N."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        current = floor_presence(floor)
+        if current is None:
+            now = timezone.now()
+            rows = Reservation.objects.filter(
+                desk__area__floor=floor,
+                status=ReservationStatus.ACTIVE,
+                check_in_time__isnull=False,
+                start_time__lte=now,
+                end_time__gt=now
+            ).values_list('user_id', 'desk_id')
+            current = {
+                'user_ids': sorted({user_id for user_id, _desk_id in rows}),
+                'desk_ids': sorted({desk_id for _user_id, desk_id in rows}),
+            }
+        
+        return Response({
+            'floor': floor,
+            'people_present': len(current['user_ids']),
+            'occupied_desk_ids': current['desk_ids'],
+        })
+    
+    @action(detail=False, methods=['get'])
+    def heatmap(self, request):
+        """
+        Количество свободных столов по дням для недельного или месячного вида.
+        
+        Все бронирования диапазона загружаются одним запросом и раскладываются
+        по дням в памяти, поэтому месяц стоит одного запроса вместо одного на день.
+        """
+        try:
+            start_date = timezone.datetime.strptime(request.query_params['start'], '%Y-%m-%d').date()
+            end_date = timezone.datetime.strptime(request.query_params['end'], '%Y-%m-%d').date()
+        except (KeyError, ValueError):
+            return Response(
+                {"error": "Укажите start и end в формате YYYY-MM-DD."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if end_date < start_date:
+            return Response(
+                {"error": "Дата окончания должна быть не раньше даты начала."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if (end_date - start_date).days + 1 > HEATMAP_MAX_DAYS:
+            return Response(
+                {"error": f"Диапазон не может превышать {HEATMAP_MAX_DAYS} дней."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        try:
+            time_from = self._parse_clock(request.query_params.get('time_from'), '09:00')
+            time_to = self._parse_clock(request.query_params.get('time_to'), '18:00')
+        except (ValueError, TypeError):
+            return Response(
+                {"error": "Неверный формат времени. Используйте HH:MM."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if time_to <= time_from:
+            return Response(
+                {"error": "Время окончания должно быть позже времени начала."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        group_by = request.query_params.get('group_by')
+        if group_by and group_by not in HEATMAP_GROUP_FIELDS:
+            return Response(
+                {"error": f"group_by может быть одним из: {', '.join(HEATMAP_GROUP_FIELDS)}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # Те же столы, что и в available: без обслуживаемых и занятых
+        desks = Desk.objects.exclude(status__in=[DeskStatus.MAINTENANCE, DeskStatus.OCCUPIED])
+        
+        area = request.query_params.get('area')
+        if area:
+            desks = desks.filter(area=area)
+        
+        desk_type = request.query_params.get('desk_type')
+        if desk_type:
+            desks = desks.filter(desk_type=desk_type)
+        
+        group_field = HEATMAP_GROUP_FIELDS.get(group_by)
+        desk_groups = dict(desks.order_by().values_list('id', group_field or 'id'))
+        
+        days = [start_date + timezone.timedelta(days=i) for i in range((end_date - start_date).days + 1)]
+        windows = {
+            day: (
+                timezone.make_aware(timezone.datetime.combine(day, time_from)),
+                timezone.make_aware(timezone.datetime.combine(day, time_to))
+            )
+            for day in days
+        }
+        
+        # Один запрос: все активные бронирования этих столов в диапазоне дат
+        reservations = Reservation.objects.filter(
+            status='active',
+            desk_id__in=desks.values('id'),
+            start_time__lt=windows[end_date][1],
+            end_time__gt=windows[start_date][0]
+        ).order_by().values_list('desk_id', 'start_time', 'end_time')
+        
+        busy = {day: set() for day in days}
+        for desk_id, start_time, end_time in reservations:
+            for day in availability.days_spanned(start_time, end_time):
+                window = windows.get(day)
+                if window and start_time < window[1] and end_time > window[0]:
+                    busy[day].add(desk_id)
+        
+        group_totals = {}
+        if group_field:
+            for group_key in desk_groups.values():
+                group_totals[group_key] = group_totals.get(group_key, 0) + 1
+        
+        result = []
+        for day in days:
+            day_data = {
+                'date': day.isoformat(),
+                'total': len(desk_groups),
+                'free': len(desk_groups) - len(busy[day])
+            }
+            if group_field:
+                free_by_group = dict(group_totals)
+                for desk_id in busy[day]:
+                    free_by_group[desk_groups[desk_id]] -= 1
+                day_data['groups'] = [
+                    {'key': group_key, 'total': group_totals[group_key], 'free': free_by_group[group_key]}
+                    for group_key in group_totals
+                ]
+            result.append(day_data)
+        
+        return Response({
+            'start': start_date.isoformat(),
+            'end': end_date.isoformat(),
+            'time_from': time_from.strftime('%H:%M'),
+            'time_to': time_to.strftime('%H:%M'),
+            'group_by': group_by,
+            'days': result
+        })
+    
+    @staticmethod
+    def _parse_clock(value, default):
+        """Разбор времени в формате HH:MM."""
+        hours, minutes = map(int, (value or default).split(':'))
+        return timezone.datetime.min.time().replace(hour=hours, minute=minutes)
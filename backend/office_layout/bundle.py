@@ -0,0 +1,119 @@
+"""
+Готовые пакеты схем офиса в Redis.
+
+Полная схема (схема, элементы и столы этажа) меняется редко, поэтому она
+сериализуется один раз, сжимается gzip и хранится в хеше ``layout:<id>:bundle``
+вместе с версией, из которой построена, и ETag (хеш содержимого). Версия схемы
+``layout:<id>:version`` повышается сигналами (core.signals) при изменении
+схемы, ее элементов, столов и зон ее этажа и явно — массовыми операциями,
+которые сигналов не вызывают. Пакет с устаревшей версией строится заново при
+следующем запросе. Вместе с версией в Redis повышается и столбец
+OfficeLayout.content_version, по которому списки схем показывают клиенту,
+изменилась ли схема.
+
+Статус стола в пакет не входит: он меняется постоянно и приходит клиенту
+через /api/desks/available/ и WebSocket.
+"""
+import gzip
+import hashlib
+import logging
+
+import redis
+from django.conf import settings
+from django.db.models import F
+from rest_framework.renderers import JSONRenderer
+
+from core.redis import get_redis
+from .models import OfficeLayout
+
+logger = logging.getLogger(__name__)
+
+
+def _version_key(layout_id):
+    return f'layout:{layout_id}:version'
+
+
+def _bundle_key(layout_id):
+    return f'layout:{layout_id}:bundle'
+
+
+def bump_layouts(layout_ids):
+    """Повысить версии схем: их пакеты будут построены заново."""
+    layout_ids = set(layout_ids)
+    if not layout_ids:
+        return
+    OfficeLayout.objects.filter(id__in=layout_ids).update(content_version=F('content_version') + 1)
+    try:
+        pipe = get_redis().pipeline(transaction=False)
+        for layout_id in layout_ids:
+            pipe.incr(_version_key(layout_id))
+        pipe.execute()
+    except redis.RedisError:
+        # Пакеты этих схем останутся устаревшими до истечения LAYOUT_BUNDLE_TTL
+        logger.exception('Не удалось повысить версии схем %s', sorted(layout_ids))
+
+
+def bump_floors(floors):
+    """Повысить версии всех схем этажей (изменились столы или зоны)."""
+    floors = {floor for floor in floors if floor is not None}
+    if floors:
+        bump_layouts(OfficeLayout.objects.filter(floor__in=floors).values_list('id', flat=True))
+
+
+def _read_current(connection, layout_id, *fields):
+    """
+    Текущая версия схемы и поля ее пакета одним обращением к Redis.
+
+    Вместо полей возвращается None, если пакета нет или он построен из
+    другой версии.
+    """
+    pipe = connection.pipeline(transaction=False)
+    pipe.get(_version_key(layout_id))
+    pipe.hmget(_bundle_key(layout_id), 'version', *fields)
+    version, (cached_version, *values) = pipe.execute()
+    version = int(version or 0)
+    if cached_version is None or int(cached_version) != version:
+        return version, None
+    return version, values
+
+
+def get_current_etag(layout_id):
+    """
+    ETag актуального пакета схемы или None, если пакета нет или он устарел.
+
+    Тело пакета не читается: так дешево проверить, изменилась ли схема.
+    Ошибки Redis передаются вызывающему коду.
+    """
+    values = _read_current(get_redis(), layout_id, 'etag')[1]
+    return None if values is None else values[0].decode()
+
+
+def get_bundle(layout_id, build):
+    """
+    Пакет схемы: (ETag, JSON в gzip) или None, если схемы нет.
+
+    build() возвращает данные схемы для сериализации или None. Версия читается
+    до построения: если схема изменится во время построения, пакет окажется
+    устаревшим и будет построен заново при следующем запросе. Ошибки Redis
+    передаются вызывающему коду.
+    """
+    connection = get_redis()
+    version, values = _read_current(connection, layout_id, 'etag', 'body')
+    if values is not None:
+        etag, body = values
+        return etag.decode(), body
+
+    data = build()
+    if data is None:
+        return None
+
+    content = JSONRenderer().render(data)
+    etag = f'"{hashlib.md5(content).hexdigest()}"'
+    # mtime=0: одинаковое содержимое дает одинаковые байты
+    body = gzip.compress(content, mtime=0)
+
+    pipe = connection.pipeline(transaction=False)
+    pipe.hset(_bundle_key(layout_id), mapping={'version': version, 'etag': etag, 'body': body})
+    pipe.expire(_bundle_key(layout_id), settings.LAYOUT_BUNDLE_TTL)
+    pipe.execute()
+    return etag, body
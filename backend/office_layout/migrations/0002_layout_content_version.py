@@ -0,0 +1,18 @@
+# Generated by Django 5.0.14 on 2026-10-18 04:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('office_layout', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='officelayout',
+            name='content_version',
+            field=models.PositiveIntegerField(default=1, editable=False, verbose_name='Версия содержимого'),
+        ),
+    ]
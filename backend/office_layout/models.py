@@ -17,6 +17,13 @@ class OfficeLayout(models.Model):
     )
     svg_data = models.TextField(blank=True, verbose_name=_('SVG данные'))
     is_active = models.BooleanField(default=True, verbose_name=_('Активна'))
+    # Повышается вместе с версией пакета схемы (office_layout.bundle.bump_layouts)
+    # при изменении схемы, ее элементов, столов и зон этажа
+    content_version = models.PositiveIntegerField(
+        default=1,
+        editable=False,
+        verbose_name=_('Версия содержимого')
+    )
     created_at = models.DateTimeField(auto_now_add=True, verbose_name=_('Создано'))
     updated_at = models.DateTimeField(auto_now=True, verbose_name=_('Обновлено'))
     
@@ -27,6 +34,16 @@ class OfficeLayout(models.Model):
         
     def __str__(self):
         return f"{self.name} (Этаж {self.floor})"
+    
+    def save(self, *args, **kwargs):
+        """Сохранение без content_version: версию повышает только bump_layouts."""
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            # Иначе сохранение загруженного ранее экземпляра вернуло бы старую версию
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'content_version'
+            ]
+        super().save(*args, **kwargs)
 
 
 class OfficeElement(models.Model):
@@ -16,23 +16,46 @@ class OfficeElementSerializer(serializers.ModelSerializer):
         ]
 
 
+class LayoutDeskSerializer(DeskSerializer):
+    """Стол на схеме этажа: без статуса, который меняется независимо от геометрии."""
+    
+    class Meta(DeskSerializer.Meta):
+        fields = [
+            'id', 'name', 'desk_number', 'area', 'area_name',
+            'x_coordinate', 'y_coordinate', 'desk_type',
+            'features', 'notes'
+        ]
+
+
 class OfficeLayoutSerializer(serializers.ModelSerializer):
-    """Сериализатор для схемы офиса."""
+    """
+    Сериализатор для схемы офиса в списках: без элементов и SVG.
     
-    elements = OfficeElementSerializer(many=True, read_only=True)
+    elements_count заполняется аннотацией запроса (office_layout.views.with_summary);
+    по content_version клиент понимает, изменилась ли геометрия схемы, не
+    загружая ее. Полная схема — OfficeLayoutDetailSerializer.
+    """
+    
+    elements_count = serializers.IntegerField(read_only=True)
     
     class Meta:
         model = OfficeLayout
         fields = [
             'id', 'name', 'floor', 'width', 'height',
             'background_image', 'svg_data', 'is_active',
-            'created_at', 'updated_at', 'elements'
+            'created_at', 'updated_at', 'elements_count', 'content_version'
         ]
-        read_only_fields = ['created_at', 'updated_at']
+        read_only_fields = ['content_version', 'created_at', 'updated_at']
+        extra_kwargs = {'svg_data': {'write_only': True}}
 
 
 class OfficeLayoutDetailSerializer(serializers.ModelSerializer):
-    """Детальный сериализатор для схемы офиса с элементами и столами."""
+    """
+    Детальный сериализатор для схемы офиса с элементами и столами.
+    
+    Результат кешируется пакетом схемы (office_layout.bundle), поэтому в нем
+    нет данных, меняющихся без изменения геометрии, — статусов столов.
+    """
     
     elements = OfficeElementSerializer(many=True, read_only=True)
     desks = serializers.SerializerMethodField()
@@ -48,10 +71,8 @@ class OfficeLayoutDetailSerializer(serializers.ModelSerializer):
     
     def get_desks(self, obj):
         """Получить столы для указанного этажа."""
-        from desks.models import Area
-        area_ids = Area.objects.filter(floor=obj.floor).values_list('id', flat=True)
-        desks = Desk.objects.filter(area_id__in=area_ids)
-        return DeskSerializer(desks, many=True).data
+        desks = Desk.objects.filter(area__floor=obj.floor).select_related('area').order_by('id')
+        return LayoutDeskSerializer(desks, many=True).data
 
 
 class OfficeLayoutUpdateSerializer(serializers.ModelSerializer):
@@ -71,4 +92,15 @@ class OfficeElementCreateUpdateSerializer(serializers.ModelSerializer):
             'layout', 'element_type', 'name', 'x', 'y',
             'width', 'height', 'rotation', 'svg_path',
             'color', 'z_index', 'properties'
-        ]
\ No newline at end of file
+        ]
+
+
+class OfficeElementBulkSerializer(OfficeElementCreateUpdateSerializer):
+    """Элемент в массовых операциях: схема задается одна для всей пачки."""
+    
+    class Meta(OfficeElementCreateUpdateSerializer.Meta):
+        fields = [
+            'element_type', 'name', 'x', 'y',
+            'width', 'height', 'rotation', 'svg_path',
+            'color', 'z_index', 'properties'
+        ]
@@ -0,0 +1,199 @@
+"""
+Пространственный индекс схем офиса для запросов по видимой области.
+
+Элементы и столы схемы раскладываются по ячейкам равномерной сетки по своим
+ограничивающим рамкам. Рамка элемента учитывает поворот: Konva поворачивает
+прямоугольник вокруг его точки (x, y) по часовой стрелке. Стол на карте —
+прямоугольник DESK_WIDTH x DESK_HEIGHT от его координат.
+
+Индекс строится по данным готового пакета схемы (office_layout.bundle) и
+хранится в памяти процесса, не более MAX_CACHED_INDEXES схем: давно не
+запрошенные вытесняются. Когда ETag пакета меняется, индекс обновляется
+по разнице: переиндексируются только добавленные, удаленные и измененные
+объекты.
+"""
+import math
+import threading
+from collections import OrderedDict, defaultdict
+
+# Размер стола на карте (frontend/src/components/map/OfficeMap.js)
+DESK_WIDTH = 50
+DESK_HEIGHT = 30
+
+# Сторона ячейки сетки в пикселях схемы
+GRID_CELL_SIZE = 100
+
+# Объекты, задевающие больше ячеек, хранятся списком и проверяются при каждом запросе
+MAX_CELLS_PER_ITEM = 1024
+
+# Сколько индексов схем хранится в памяти процесса; давно не запрошенные вытесняются
+MAX_CACHED_INDEXES = 64
+
+# layout_id -> GridIndex в порядке последнего обращения
+_indexes = OrderedDict()
+_indexes_lock = threading.Lock()
+
+
+def element_shape(element):
+    """Прямоугольник элемента: (x, y, ширина, высота, поворот в градусах)."""
+    return (element['x'], element['y'], element['width'], element['height'], element['rotation'] or 0)
+
+
+def desk_shape(desk):
+    """Прямоугольник стола на карте."""
+    return (desk['x_coordinate'], desk['y_coordinate'], DESK_WIDTH, DESK_HEIGHT, 0)
+
+
+def _corners(shape):
+    x, y, width, height, rotation = shape
+    angle = math.radians(rotation)
+    cos, sin = math.cos(angle), math.sin(angle)
+    for dx, dy in ((0, 0), (width, 0), (width, height), (0, height)):
+        yield x + dx * cos - dy * sin, y + dx * sin + dy * cos
+
+
+def bounding_box(shape):
+    """Ограничивающая рамка повернутого прямоугольника: (x1, y1, x2, y2)."""
+    xs, ys = zip(*_corners(shape))
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def contains(shape, px, py):
+    """Лежит ли точка внутри повернутого прямоугольника."""
+    x, y, width, height, rotation = shape
+    angle = math.radians(rotation)
+    cos, sin = math.cos(angle), math.sin(angle)
+    # Переводим точку в систему координат прямоугольника
+    dx, dy = px - x, py - y
+    u = dx * cos + dy * sin
+    v = -dx * sin + dy * cos
+    return min(0, width) <= u <= max(0, width) and min(0, height) <= v <= max(0, height)
+
+
+def intersects(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+class GridIndex:
+    """Равномерная сетка: ячейка -> ключи объектов, чьи рамки ее задевают."""
+
+    def __init__(self, cell_size=GRID_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = defaultdict(set)
+        self.large = set()
+        # ключ -> (рамка, фигура, данные, порядок в схеме)
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.etag = None
+
+    def _cell_range(self, box):
+        size = self.cell_size
+        return (
+            range(math.floor(box[0] / size), math.floor(box[2] / size) + 1),
+            range(math.floor(box[1] / size), math.floor(box[3] / size) + 1),
+        )
+
+    def _cells(self, box):
+        columns, rows = self._cell_range(box)
+        return [(column, row) for column in columns for row in rows]
+
+    def _cell_count(self, box):
+        columns, rows = self._cell_range(box)
+        return len(columns) * len(rows)
+
+    def insert(self, key, shape, data, order):
+        box = bounding_box(shape)
+        self.entries[key] = (box, shape, data, order)
+        if self._cell_count(box) > MAX_CELLS_PER_ITEM:
+            self.large.add(key)
+            return
+        for cell in self._cells(box):
+            self.cells[cell].add(key)
+
+    def remove(self, key):
+        box = self.entries.pop(key)[0]
+        if key in self.large:
+            self.large.discard(key)
+            return
+        for cell in self._cells(box):
+            self.cells[cell].discard(key)
+            if not self.cells[cell]:
+                del self.cells[cell]
+
+    def sync(self, items):
+        """
+        Привести индекс к набору объектов {ключ: (фигура, данные)}.
+
+        Возвращает число переиндексированных объектов.
+        """
+        changed = 0
+        for key in set(self.entries) - set(items):
+            self.remove(key)
+            changed += 1
+        for order, (key, (shape, data)) in enumerate(items.items()):
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] == shape and entry[2] == data:
+                if entry[3] != order:
+                    self.entries[key] = (entry[0], shape, data, order)
+                continue
+            if entry is not None:
+                self.remove(key)
+            self.insert(key, shape, data, order)
+            changed += 1
+        return changed
+
+    def query(self, box):
+        """Ключи объектов, рамки которых пересекают box, в порядке схемы."""
+        if self._cell_count(box) > len(self.entries):
+            # Область больше схемы — дешевле проверить все объекты
+            candidates = set(self.entries)
+        else:
+            candidates = set(self.large)
+            for cell in self._cells(box):
+                candidates.update(self.cells.get(cell, ()))
+        keys = [key for key in candidates if intersects(self.entries[key][0], box)]
+        return sorted(keys, key=lambda key: self.entries[key][3])
+
+    def hit(self, x, y):
+        """Ключи объектов, внутри которых лежит точка, в порядке схемы."""
+        return [key for key in self.query((x, y, x, y)) if contains(self.entries[key][1], x, y)]
+
+    def data(self, key):
+        return self.entries[key][2]
+
+
+def layout_items(layout_data):
+    """Объекты схемы для индекса из данных пакета: {ключ: (фигура, данные)}."""
+    items = {}
+    for element in layout_data['elements']:
+        items[('element', element['id'])] = (element_shape(element), element)
+    for desk in layout_data['desks']:
+        items[('desk', desk['id'])] = (desk_shape(desk), desk)
+    return items
+
+
+def get_index(layout_id, etag, load):
+    """
+    Индекс схемы, соответствующий пакету с ETag etag.
+
+    load() возвращает данные схемы и вызывается, только если индекс устарел.
+    Без etag (пакеты недоступны) индекс строится заново и не сохраняется.
+    """
+    if etag is None:
+        index = GridIndex()
+        index.sync(layout_items(load()))
+        return index
+
+    with _indexes_lock:
+        index = _indexes.get(layout_id)
+        if index is None:
+            index = _indexes[layout_id] = GridIndex()
+            if len(_indexes) > MAX_CACHED_INDEXES:
+                _indexes.popitem(last=False)
+        else:
+            _indexes.move_to_end(layout_id)
+    with index.lock:
+        if index.etag != etag:
+            index.sync(layout_items(load()))
+            index.etag = etag
+    return index
@@ -1,3 +1,387 @@
-from django.test import TestCase
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.permissions import BasePermission, IsAuthenticated
+from rest_framework.test import APIClient
+
+from core.testing import TestCase, redis_available
+from desks.models import Area, Desk, DeskStatus
+from users.models import User
+from . import bundle, spatial
+from .models import OfficeElement, OfficeLayout
+from .views import OfficeLayoutViewSet
+
+
+class UpdateDesksPositionsTests(TestCase):
+    """Перемещение столов на схеме одним запросом на запись."""
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username='editor', is_staff=True))
+        self.layout = OfficeLayout.objects.create(name='Floor 3', floor=3)
+        area = Area.objects.create(name='Open space', floor=3)
+        self.desks = Desk.objects.bulk_create([
+            Desk(name=f'D{i}', desk_number=f'D{i}', area=area, x_coordinate=0, y_coordinate=0)
+            for i in range(300)
+        ])
+        self.other_floor_desk = Desk.objects.create(
+            name='Other', desk_number='OTHER', area=Area.objects.create(name='Other', floor=4),
+            x_coordinate=0, y_coordinate=0
+        )
+        self.url = f'/api/office/layouts/{self.layout.id}/update_desks_positions/'
+
+    def test_bulk_update_and_single_broadcast(self):
+        payload = [{'id': desk.id, 'x_coordinate': i, 'y_coordinate': 2 * i} for i, desk in enumerate(self.desks)]
+        payload += [
+            {'id': self.other_floor_desk.id, 'x_coordinate': 1, 'y_coordinate': 1},
+            {'id': 10 ** 9, 'x_coordinate': 1, 'y_coordinate': 1},
+            {'id': self.desks[0].id, 'x_coordinate': 'left', 'y_coordinate': 1},
+            {'x_coordinate': 1},
+        ]
+
+        with mock.patch('core.broadcast.send') as send, self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post(self.url, {'desks': payload}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['updated_desks']), 300)
+        self.assertEqual(len(response.data['errors']), 4)
+        # Схема, столы с зонами и одно обновление в транзакции
+        self.assertEqual(len(queries), 5, '\n'.join(query['sql'] for query in queries.captured_queries))
+
+        send.assert_called_once()
+        group, message = send.call_args.args
+        self.assertEqual(group, 'floor_3')
+        self.assertEqual(message['type'], 'desks_positions_message')
+        self.assertEqual(len(message['desks']), 300)
+
+        self.desks[10].refresh_from_db()
+        self.assertEqual((self.desks[10].x_coordinate, self.desks[10].y_coordinate), (10, 20))
+        self.other_floor_desk.refresh_from_db()
+        self.assertEqual(self.other_floor_desk.x_coordinate, 0)
+
+
+class OfficeElementBulkTests(TestCase):
+    """Массовое создание и обновление элементов схемы."""
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username='editor', is_staff=True))
+        self.layout = OfficeLayout.objects.create(name='Floor 1', floor=1)
+
+    def post(self, action, data, queries=None):
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.post(f'/api/office/elements/{action}/', data, format='json')
+        if queries is not None:
+            self.assertEqual(len(captured), queries, '\n'.join(query['sql'] for query in captured.captured_queries))
+        return response
+
+    def test_bulk_create(self):
+        elements = [{'element_type': 'wall', 'x': i, 'y': 0, 'width': 10} for i in range(1200)]
+        elements.insert(5, {'element_type': 'roof', 'x': 0, 'y': 0})
+
+        # Схема, транзакция и по запросу на каждые 500 элементов
+        response = self.post('bulk_create', {'layout_id': self.layout.id, 'elements': elements}, queries=6)
+        self.assertEqual(len(response.data['created_elements']), 1200)
+        self.assertEqual([error['index'] for error in response.data['errors']], [5])
+        self.assertIsNotNone(response.data['created_elements'][0]['id'])
+
+        response = self.post('bulk_create', {'layout_id': self.layout.id, 'elements': elements, 'atomic': True})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(OfficeElement.objects.count(), 1200)
+
+    def test_bulk_update(self):
+        elements = OfficeElement.objects.bulk_create([
+            OfficeElement(layout=self.layout, x=0, y=0) for _ in range(300)
+        ])
+        payload = [{'id': element.id, 'x': 5, 'color': 'red'} for element in elements]
+        payload += [{'x': 1}, {'id': 10 ** 9, 'x': 1}, {'id': elements[0].id, 'x': 'left'}]
+
+        response = self.post('bulk_update', {'elements': payload, 'atomic': True})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['index'] for error in response.data['errors']], [300, 301, 302])
+        self.assertFalse(OfficeElement.objects.filter(x=5).exists())
+
+        # Элементы одним запросом и одно обновление в транзакции
+        response = self.post('bulk_update', {'elements': payload}, queries=4)
+        self.assertEqual(len(response.data['updated_elements']), 300)
+        self.assertEqual(OfficeElement.objects.filter(x=5, color='red').count(), 300)
+
+
+class OfficeLayoutListTests(TestCase):
+    """Списки схем без элементов и SVG, детальная схема с предзагрузкой."""
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username='viewer'))
+        self.layouts = []
+        for floor in range(1, 4):
+            self.add_layout(floor)
+
+    def add_layout(self, floor):
+        layout = OfficeLayout.objects.create(name=f'Floor {floor}', floor=floor, svg_data='<svg/>')
+        OfficeElement.objects.bulk_create([OfficeElement(layout=layout, x=i, y=0) for i in range(5)])
+        self.layouts.append(layout)
+        return layout
+
+    def get(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_summary_rows(self):
+        response, queries = self.get('/api/office/layouts/active/')
+        self.assertEqual(queries, 1)
+        row = response.data[0]
+        self.assertEqual(row['elements_count'], 5)
+        self.assertNotIn('elements', row)
+        self.assertNotIn('svg_data', row)
+
+        # Число запросов не зависит от числа схем
+        self.add_layout(4)
+        self.assertEqual(self.get('/api/office/layouts/active/')[1], 1)
+        self.assertEqual(self.get('/api/office/layouts/')[1], 2)
+
+        # Версия повышается при изменении элемента
+        element = OfficeElement.objects.filter(layout=self.layouts[0]).first()
+        element.rotation = 45
+        with self.captureOnCommitCallbacks(execute=True):
+            element.save()
+        changed = self.get('/api/office/layouts/active/')[0].data[0]
+        self.assertEqual(changed['id'], row['id'])
+        self.assertGreater(changed['content_version'], row['content_version'])
+
+    def test_save_keeps_content_version(self):
+        # Экземпляр, загруженный до повышения версии, не возвращает старую версию при сохранении
+        layout = OfficeLayout.objects.get(pk=self.layouts[0].pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            OfficeElement.objects.create(layout=layout, x=10, y=0)
+        version = OfficeLayout.objects.get(pk=layout.pk).content_version
+        self.assertGreater(version, layout.content_version)
+
+        layout.name = 'Renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            layout.save()
+        self.assertEqual(OfficeLayout.objects.get(pk=layout.pk).content_version, version + 1)
+
+    def test_detail_prefetched(self):
+        area = Area.objects.create(name='Open space', floor=1)
+        Desk.objects.bulk_create([
+            Desk(name=f'D{i}', desk_number=f'D{i}', area=area, x_coordinate=0, y_coordinate=0)
+            for i in range(5)
+        ])
+        response, queries = self.get(f'/api/office/layouts/{self.layouts[0].id}/')
+        self.assertEqual(len(response.json()['elements']), 5)
+        self.assertEqual(len(response.json()['desks']), 5)
+        # Схема, элементы и столы с зонами
+        self.assertEqual(queries, 3)
+
+
+@skipUnless(redis_available(), 'Redis недоступен')
+class LayoutBundleTests(TestCase):
+    """Готовый пакет схемы: ETag, 304 и сброс при изменениях."""
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username='viewer'))
+        self.layout = OfficeLayout.objects.create(name='Floor 2', floor=2)
+        self.element = OfficeElement.objects.create(layout=self.layout, x=0, y=0)
+        self.desk = Desk.objects.create(
+            name='D1', desk_number='D1', area=Area.objects.create(name='Open space', floor=2),
+            x_coordinate=0, y_coordinate=0
+        )
+        self.url = f'/api/office/layouts/{self.layout.id}/'
+
+    def get(self, **headers):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, headers=headers)
+        return response, len(queries)
+
+    def test_cached_bundle(self):
+        response, queries = self.get(accept_encoding='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        gzip_etag = response['ETag']
+
+        response, queries = self.get()
+        self.assertEqual(queries, 0)
+        self.assertNotIn('Content-Encoding', response)
+        etag = response['ETag']
+        # У сжатого и несжатого ответа разные сильные валидаторы
+        self.assertEqual(gzip_etag, f'{etag[:-1]}-gzip"')
+        data = response.json()
+        self.assertEqual(len(data['elements']), 1)
+        self.assertNotIn('status', data['desks'][0])
+
+        response, queries = self.get(if_none_match=etag)
+        self.assertEqual((response.status_code, queries), (304, 0))
+        self.assertEqual(self.get(if_none_match=gzip_etag)[0].status_code, 200)
+        self.assertEqual(self.get(accept_encoding='gzip', if_none_match=f'"x", W/{gzip_etag}')[0].status_code, 304)
+        self.assertEqual(self.get(if_none_match='*')[0].status_code, 304)
+
+    def test_accept_encoding_quality(self):
+        for header, compressed in [
+            ('gzip;q=0', False),
+            ('deflate, gzip;q=0.5', True),
+            ('br', False),
+            ('*', True),
+            ('*;q=0.1, gzip;q=0', False),
+        ]:
+            response = self.get(accept_encoding=header)[0]
+            self.assertEqual(response.get('Content-Encoding') == 'gzip', compressed, header)
+            self.assertEqual(response['ETag'].endswith('-gzip"'), compressed, header)
+
+    def test_object_permissions_checked(self):
+        class DenyObject(BasePermission):
+            def has_object_permission(self, request, view, obj):
+                return False
+
+        self.get()
+        with mock.patch.object(OfficeLayoutViewSet, 'permission_classes', [IsAuthenticated, DenyObject]):
+            self.assertEqual(self.get()[0].status_code, 403)
+
+    def test_invalidation(self):
+        etag = self.get()[0]['ETag']
+
+        # Статус стола в пакет не входит
+        with self.captureOnCommitCallbacks(execute=True):
+            self.desk.status = DeskStatus.OCCUPIED
+            self.desk.save()
+        self.assertEqual(self.get()[1], 0)
+
+        for instance, field, value in [
+            (self.desk, 'x_coordinate', 5),
+            (self.element, 'rotation', 30),
+            (self.desk.area, 'name', 'Quiet zone'),
+            (self.layout, 'width', 1200),
+        ]:
+            with self.captureOnCommitCallbacks(execute=True):
+                setattr(instance, field, value)
+                instance.save()
+            response = self.get(if_none_match=etag)[0]
+            self.assertEqual(response.status_code, 200, field)
+            self.assertNotEqual(response['ETag'], etag)
+            etag = response['ETag']
+
+
+class SpatialIndexTests(TestCase):
+    """Запросы по видимой области и попадание в точку."""
+
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create(username='viewer'))
+        self.layout = OfficeLayout.objects.create(name='Floor 5', floor=5)
+        # Стена 200x20, повернутая на 90 градусов вокруг (500, 0): занимает x 480..500, y 0..200
+        self.wall = OfficeElement.objects.create(
+            layout=self.layout, element_type='wall', x=500, y=0, width=200, height=20, rotation=90, z_index=1
+        )
+        self.room = OfficeElement.objects.create(
+            layout=self.layout, element_type='room', x=0, y=0, width=1000, height=800, z_index=0
+        )
+        area = Area.objects.create(name='Open space', floor=5)
+        self.desks = Desk.objects.bulk_create([
+            Desk(name=f'D{i}', desk_number=f'D{i}', area=area, x_coordinate=100 * i, y_coordinate=300)
+            for i in range(10)
+        ])
+        self.url = f'/api/office/layouts/{self.layout.id}/'
+
+    def viewport(self, bbox):
+        response = self.client.get(self.url + 'viewport/', {'bbox': bbox})
+        self.assertEqual(response.status_code, 200)
+        return (
+            [element['id'] for element in response.data['elements']],
+            [desk['id'] for desk in response.data['desks']],
+        )
+
+    def test_geometry(self):
+        box = spatial.bounding_box(spatial.element_shape({'x': 500, 'y': 0, 'width': 200, 'height': 20, 'rotation': 90}))
+        self.assertEqual([round(value) for value in box], [480, 0, 500, 200])
+
+        shape = (0, 0, 100, 10, 45)
+        self.assertTrue(spatial.contains(shape, 30, 35))
+        # Внутри рамки, но вне повернутого прямоугольника
+        self.assertFalse(spatial.contains(shape, 60, 10))
+
+        index = spatial.GridIndex()
+        items = {('desk', i): ((i * 60, 0, 50, 30, 0), {'id': i}) for i in range(100)}
+        self.assertEqual(index.sync(items), 100)
+        items[('desk', 5)] = ((0, 5000, 50, 30, 0), {'id': 5})
+        del items[('desk', 7)]
+        # Переиндексируются только измененный и удаленный столы
+        self.assertEqual(index.sync(items), 2)
+        self.assertEqual(index.query((0, 4990, 10, 5010)), [('desk', 5)])
+        self.assertEqual(index.hit(425, 10), [])
+        self.assertEqual(index.hit(485, 10), [('desk', 8)])
+
+    def test_index_cache_bounded(self):
+        load = mock.Mock(return_value={'elements': [], 'desks': []})
+        with mock.patch.object(spatial, '_indexes', spatial.OrderedDict()), \
+                mock.patch.object(spatial, 'MAX_CACHED_INDEXES', 2):
+            first = spatial.get_index(1, '"a"', load)
+            spatial.get_index(2, '"a"', load)
+            # Обращение к схеме 1 делает ее последней использованной
+            self.assertIs(spatial.get_index(1, '"a"', load), first)
+            spatial.get_index(3, '"a"', load)
+            self.assertEqual(list(spatial._indexes), [1, 3])
+            self.assertEqual(load.call_count, 3)
+
+    def test_viewport(self):
+        elements, desks = self.viewport('490,150,0,0')
+        self.assertEqual(elements, [self.room.id, self.wall.id])
+        self.assertEqual(desks, [])
+
+        elements, desks = self.viewport('120,290,260,310')
+        self.assertEqual(elements, [self.room.id])
+        self.assertEqual(desks, [self.desks[1].id, self.desks[2].id])
+
+        self.assertEqual(self.viewport('-100000,-100000,100000,100000')[1], [desk.id for desk in self.desks])
+        self.assertEqual(self.viewport('2000,2000,3000,3000'), ([], []))
+
+        for bbox in ['', '1,2,3', '0,0,nan,1', 'a,b,c,d']:
+            self.assertEqual(self.client.get(self.url + 'viewport/', {'bbox': bbox}).status_code, 400)
+        self.assertEqual(self.client.get('/api/office/layouts/0/viewport/', {'bbox': '0,0,1,1'}).status_code, 404)
+
+    def test_hit(self):
+        response = self.client.get(self.url + 'hit/', {'x': 490, 'y': 100})
+        self.assertEqual([element['id'] for element in response.data['elements']], [self.wall.id, self.room.id])
+
+        response = self.client.get(self.url + 'hit/', {'x': 320, 'y': 310})
+        self.assertEqual([desk['id'] for desk in response.data['desks']], [self.desks[3].id])
+        self.assertEqual(self.client.get(self.url + 'hit/', {'x': 1}).status_code, 400)
+
+    @skipUnless(redis_available(), 'Redis недоступен')
+    def test_index_follows_bundle(self):
+        self.assertEqual(self.viewport('0,1000,100,1100')[1], [])
+        desk = self.desks[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            desk.y_coordinate = 1050
+            desk.save()
+        self.assertEqual(self.viewport('0,1000,100,1100')[1], [desk.id])
+
+        # Пока пакет не изменился, индекс не перестраивается и в БД не ходит
+        with CaptureQueriesContext(connection) as queries:
+            self.viewport('0,1000,100,1100')
+        self.assertEqual(len(queries), 0)
+
+    @skipUnless(redis_available(), 'Redis недоступен')
+    def test_bundle_body_read_only_on_change(self):
+        with mock.patch.object(bundle, 'get_bundle', wraps=bundle.get_bundle) as get_bundle:
+            self.viewport('0,0,100,100')
+            self.assertEqual(get_bundle.call_count, 1)
+            # Пакет и индекс актуальны: читается только ETag
+            self.viewport('0,0,100,100')
+            self.client.get(self.url + 'hit/', {'x': 490, 'y': 100})
+            self.assertEqual(get_bundle.call_count, 1)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.wall.rotation = 0
+                self.wall.save()
+            self.viewport('0,0,100,100')
+            self.assertEqual(get_bundle.call_count, 2)
@@ -1,17 +1,87 @@
+import gzip
+import json
+import logging
+import math
+
+import redis
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags
 from rest_framework import viewsets, status, filters
 from rest_framework.decorators import action
+from rest_framework.permissions import BasePermission
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
+from . import bundle, spatial
 from .models import OfficeLayout, OfficeElement
 from .serializers import (
     OfficeLayoutSerializer,
     OfficeLayoutDetailSerializer,
     OfficeLayoutUpdateSerializer,
     OfficeElementSerializer,
-    OfficeElementCreateUpdateSerializer
+    OfficeElementCreateUpdateSerializer,
+    OfficeElementBulkSerializer
 )
+from core.signals import broadcast_desks_positions
 from desks.models import Desk, Area
 
+logger = logging.getLogger(__name__)
+
+# Сколько строк записывать одним запросом при массовых изменениях
+BULK_BATCH_SIZE = 500
+
+def with_summary(queryset):
+    """
+    Схемы с числом элементов, без загрузки SVG и элементов.
+    
+    Об изменении геометрии клиент узнает по хранимой версии content_version,
+    поэтому содержимое элементов при выборке не читается.
+    """
+    elements = OfficeElement.objects.filter(layout=OuterRef('pk')).order_by().values('layout')
+    elements_count = elements.annotate(count=Count('id')).values('count')
+    
+    return queryset.defer('svg_data').annotate(
+        elements_count=Coalesce(Subquery(elements_count), 0)
+    )
+
+
+def accepts_gzip(accept_encoding):
+    """Принимает ли клиент gzip по заголовку Accept-Encoding с учетом q."""
+    qualities = {}
+    for item in accept_encoding.split(','):
+        coding, *params = [part.strip() for part in item.split(';')]
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.lower()] = quality
+    return qualities.get('gzip', qualities.get('x-gzip', qualities.get('*', 0))) > 0
+
+
+def etag_matches(etag, if_none_match):
+    """Совпадает ли ETag с If-None-Match (слабое сравнение, * — любой)."""
+    tags = parse_etags(if_none_match)
+    if '*' in tags:
+        return True
+    return etag in [tag.removeprefix('W/') for tag in tags]
+
+
+def has_object_permissions(permissions):
+    """Проверяют ли права представления доступ к конкретному объекту."""
+    return any(
+        type(permission).has_object_permission is not BasePermission.has_object_permission
+        for permission in permissions
+    )
+
 
 class OfficeLayoutViewSet(viewsets.ModelViewSet):
     """ViewSet для работы со схемами офиса."""
@@ -24,6 +94,15 @@ class OfficeLayoutViewSet(viewsets.ModelViewSet):
     ordering_fields = ['name', 'floor', 'created_at', 'updated_at']
     ordering = ['floor', 'name']
     
+    def get_queryset(self):
+        """Списки — сводки без геометрии, детальная схема — с элементами одним запросом."""
+        queryset = super().get_queryset()
+        if self.action in ['list', 'active']:
+            return with_summary(queryset)
+        if self.action in ['retrieve', 'viewport', 'hit']:
+            return queryset.prefetch_related('elements')
+        return queryset
+    
     def get_serializer_class(self):
         """Выбор сериализатора в зависимости от действия."""
         if self.action == 'retrieve':
@@ -32,61 +111,248 @@ class OfficeLayoutViewSet(viewsets.ModelViewSet):
             return OfficeLayoutUpdateSerializer
         return self.serializer_class
     
+    def build_bundle(self, layout_id):
+        """Данные полной схемы для пакета или None, если схемы нет."""
+        layout = self.get_queryset().filter(pk=layout_id).first()
+        return None if layout is None else OfficeLayoutDetailSerializer(layout).data
+    
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Полная схема из готового пакета в Redis (office_layout.bundle).
+        
+        Ответ отдается сжатым, если клиент принимает gzip (с учетом q), с ETag
+        по содержимому; у сжатого и несжатого ответа разные ETag. При
+        совпадении If-None-Match возвращается 304. Без Redis и для браузерного
+        API схема сериализуется как обычно.
+        
+        Схему может читать любой пользователь, прошедший проверку прав
+        представления, поэтому объект для проверки прав на него не
+        загружается; если у представления появятся объектные права, схема
+        перед отдачей пакета загружается через get_object().
+        """
+        if request.accepted_renderer.format != 'json':
+            return super().retrieve(request, *args, **kwargs)
+        try:
+            layout_id = int(kwargs['pk'])
+        except ValueError:
+            return super().retrieve(request, *args, **kwargs)
+        if has_object_permissions(self.get_permissions()):
+            self.get_object()
+        
+        try:
+            cached = bundle.get_bundle(layout_id, lambda: self.build_bundle(layout_id))
+        except redis.RedisError:
+            logger.exception('Пакеты схем недоступны, схема сериализуется из БД')
+            return super().retrieve(request, *args, **kwargs)
+        if cached is None:
+            return Response({'detail': 'Схема офиса не найдена'}, status=status.HTTP_404_NOT_FOUND)
+        etag, body = cached
+        
+        compressed = accepts_gzip(request.headers.get('Accept-Encoding', ''))
+        if compressed:
+            # Разные кодирования содержимого — разные сильные валидаторы
+            etag = f'{etag[:-1]}-gzip"'
+        
+        if etag_matches(etag, request.headers.get('If-None-Match', '')):
+            response = HttpResponseNotModified()
+        elif compressed:
+            response = HttpResponse(body, content_type='application/json')
+            response['Content-Encoding'] = 'gzip'
+        else:
+            response = HttpResponse(gzip.decompress(body), content_type='application/json')
+        
+        response['ETag'] = etag
+        patch_vary_headers(response, ['Accept-Encoding'])
+        # Клиент хранит схему, но каждый раз сверяет ETag
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+    
+    def get_spatial_index(self, pk):
+        """
+        Пространственный индекс схемы (office_layout.spatial) или None.
+        
+        Обычно из Redis читается только ETag пакета схемы; тело пакета
+        загружается, лишь когда ETag изменился и индекс нужно обновить. Без
+        Redis индекс строится из БД на каждый запрос.
+        """
+        try:
+            layout_id = int(pk)
+        except ValueError:
+            return None
+        build = lambda: self.build_bundle(layout_id)
+        try:
+            etag = bundle.get_current_etag(layout_id)
+            if etag is None:
+                # Пакет устарел: строим его и сразу используем тело
+                cached = bundle.get_bundle(layout_id, build)
+                if cached is None:
+                    return None
+                etag, body = cached
+                return spatial.get_index(layout_id, etag, lambda: json.loads(gzip.decompress(body)))
+            return spatial.get_index(layout_id, etag, lambda: self.load_bundle(layout_id, build))
+        except redis.RedisError:
+            logger.exception('Пакеты схем недоступны, индекс строится из БД')
+            data = build()
+            return None if data is None else spatial.get_index(layout_id, None, lambda: data)
+    
+    def load_bundle(self, layout_id, build):
+        """Данные пакета схемы для обновления индекса."""
+        cached = bundle.get_bundle(layout_id, build)
+        if cached is None:
+            # Схема удалена после проверки ETag: индекс опустеет до следующего запроса
+            return {'elements': [], 'desks': []}
+        return json.loads(gzip.decompress(cached[1]))
+    
+    @action(detail=True, methods=['get'])
+    def viewport(self, request, pk=None):
+        """
+        Элементы и столы схемы в видимой области ?bbox=x1,y1,x2,y2.
+        
+        Возвращаются объекты, ограничивающая рамка которых (с учетом поворота)
+        пересекает область, в порядке отрисовки.
+        """
+        try:
+            bbox = [float(value) for value in request.query_params.get('bbox', '').split(',')]
+        except ValueError:
+            bbox = []
+        if len(bbox) != 4 or not all(math.isfinite(value) for value in bbox):
+            return Response(
+                {'error': 'bbox должен иметь вид x1,y1,x2,y2'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        x1, y1, x2, y2 = bbox
+        bbox = [min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2)]
+        
+        index = self.get_spatial_index(pk)
+        if index is None:
+            return Response({'detail': 'Схема офиса не найдена'}, status=status.HTTP_404_NOT_FOUND)
+        with index.lock:
+            keys = index.query(bbox)
+            found = [(kind, index.data((kind, item_id))) for kind, item_id in keys]
+        
+        return Response({
+            'bbox': bbox,
+            'elements': [data for kind, data in found if kind == 'element'],
+            'desks': [data for kind, data in found if kind == 'desk'],
+        })
+    
+    @action(detail=True, methods=['get'])
+    def hit(self, request, pk=None):
+        """
+        Элементы и столы схемы под точкой ?x=&y=.
+        
+        Точка проверяется по самому прямоугольнику с учетом поворота, а не по
+        рамке. Элементы идут сверху вниз (первый — видимый на карте).
+        """
+        try:
+            x = float(request.query_params.get('x'))
+            y = float(request.query_params.get('y'))
+        except (TypeError, ValueError):
+            x = y = math.nan
+        if not (math.isfinite(x) and math.isfinite(y)):
+            return Response(
+                {'error': 'Необходимо указать числовые x и y'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        index = self.get_spatial_index(pk)
+        if index is None:
+            return Response({'detail': 'Схема офиса не найдена'}, status=status.HTTP_404_NOT_FOUND)
+        with index.lock:
+            keys = index.hit(x, y)
+            found = [(kind, index.data((kind, item_id))) for kind, item_id in keys]
+        
+        return Response({
+            'x': x,
+            'y': y,
+            'elements': [data for kind, data in reversed(found) if kind == 'element'],
+            'desks': [data for kind, data in reversed(found) if kind == 'desk'],
+        })
+    
     @action(detail=True, methods=['post'])
     def update_desks_positions(self, request, pk=None):
-        """Обновление позиций столов на схеме офиса."""
+        """
+        Обновление позиций столов на схеме офиса.
+        
+        Столы читаются одним запросом вместе с зонами, координаты записываются
+        одним bulk_update в транзакции, а клиентам этажа уходит одно
+        уведомление о перемещении вместо уведомления на каждый стол.
+        """
         layout = self.get_object()
         desks_data = request.data.get('desks', [])
         
-        updated_desks = []
+        positions = {}
         errors = []
         
         for desk_data in desks_data:
+            if not isinstance(desk_data, dict):
+                errors.append({'error': 'Отсутствуют обязательные поля', 'data': desk_data})
+                continue
+            
+            desk_id = desk_data.get('id')
+            x = desk_data.get('x_coordinate')
+            y = desk_data.get('y_coordinate')
+            
+            if not desk_id or x is None or y is None:
+                errors.append({'error': 'Отсутствуют обязательные поля', 'data': desk_data})
+                continue
+            
             try:
-                desk_id = desk_data.get('id')
-                x = desk_data.get('x_coordinate')
-                y = desk_data.get('y_coordinate')
-                
-                if not desk_id or x is None or y is None:
-                    errors.append({'error': 'Отсутствуют обязательные поля', 'data': desk_data})
-                    continue
-                
-                desk = Desk.objects.get(id=desk_id)
-                
-                # Проверяем, принадлежит ли стол к этому этажу
-                if desk.area.floor != layout.floor:
-                    errors.append({
-                        'error': 'Стол не принадлежит этому этажу',
-                        'desk_id': desk_id
-                    })
-                    continue
-                
-                desk.x_coordinate = x
-                desk.y_coordinate = y
-                desk.save()
-                
-                updated_desks.append({
-                    'id': desk.id,
-                    'desk_number': desk.desk_number,
-                    'x_coordinate': desk.x_coordinate,
-                    'y_coordinate': desk.y_coordinate
+                positions[int(desk_id)] = (float(x), float(y))
+            except (TypeError, ValueError):
+                errors.append({'error': 'Неверные значения полей', 'data': desk_data})
+        
+        desks = Desk.objects.select_related('area').in_bulk(list(positions))
+        
+        updated = []
+        for desk_id, (x, y) in positions.items():
+            desk = desks.get(desk_id)
+            if desk is None:
+                errors.append({'error': 'Стол не найден', 'desk_id': desk_id})
+                continue
+            
+            # Проверяем, принадлежит ли стол к этому этажу
+            if desk.area.floor != layout.floor:
+                errors.append({
+                    'error': 'Стол не принадлежит этому этажу',
+                    'desk_id': desk_id
                 })
+                continue
             
-            except Desk.DoesNotExist:
-                errors.append({'error': 'Стол не найден', 'desk_id': desk_id})
-            except Exception as e:
-                errors.append({'error': str(e), 'data': desk_data})
+            desk.x_coordinate = x
+            desk.y_coordinate = y
+            updated.append(desk)
+        
+        # bulk_update не вызывает post_save, поэтому уведомление отправляется здесь
+        with transaction.atomic():
+            Desk.objects.bulk_update(updated, ['x_coordinate', 'y_coordinate'], batch_size=BULK_BATCH_SIZE)
+            if updated:
+                broadcast_desks_positions(
+                    layout.floor,
+                    [(desk.id, desk.x_coordinate, desk.y_coordinate) for desk in updated],
+                    request.user.username
+                )
+                # bulk_update не вызывает сигналов, пакеты схем этажа сбрасываем сами
+                transaction.on_commit(lambda: bundle.bump_floors([layout.floor]))
         
         return Response({
             'success': True,
-            'updated_desks': updated_desks,
+            'updated_desks': [
+                {
+                    'id': desk.id,
+                    'desk_number': desk.desk_number,
+                    'x_coordinate': desk.x_coordinate,
+                    'y_coordinate': desk.y_coordinate
+                }
+                for desk in updated
+            ],
             'errors': errors
         })
     
     @action(detail=False, methods=['get'])
     def active(self, request):
         """Получить активные схемы офиса."""
-        active_layouts = OfficeLayout.objects.filter(is_active=True)
+        active_layouts = self.get_queryset().filter(is_active=True)
         serializer = self.get_serializer(active_layouts, many=True)
         return Response(serializer.data)
 
@@ -108,82 +374,154 @@ class OfficeElementViewSet(viewsets.ModelViewSet):
     
     @action(detail=False, methods=['post'])
     def bulk_create(self, request):
-        """Массовое создание элементов схемы офиса."""
+        """
+        Массовое создание элементов схемы офиса.
+        
+        Пачка проверяется одним сериализатором many=True и записывается
+        bulk_create частями в одной транзакции. Ошибки возвращаются по каждому
+        элементу (index — позиция в запросе). С atomic=true при любой ошибке
+        ничего не создается.
+        """
         elements_data = request.data.get('elements', [])
         layout_id = request.data.get('layout_id')
         
         try:
             layout = OfficeLayout.objects.get(id=layout_id)
-        except OfficeLayout.DoesNotExist:
+        except (OfficeLayout.DoesNotExist, ValueError, TypeError):
             return Response(
                 {'error': 'Схема офиса не найдена'},
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        created_elements = []
-        errors = []
+        if not isinstance(elements_data, list):
+            return Response(
+                {'error': 'elements должен быть списком'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        for element_data in elements_data:
-            element_data['layout'] = layout.id
-            serializer = OfficeElementCreateUpdateSerializer(data=element_data)
-            
-            if serializer.is_valid():
-                element = serializer.save()
-                created_elements.append(OfficeElementSerializer(element).data)
-            else:
-                errors.append({
-                    'data': element_data,
-                    'errors': serializer.errors
-                })
+        valid, errors = validate_elements(elements_data)
+        if errors and is_atomic(request):
+            return Response(
+                {'created_elements': [], 'errors': errors, 'success': False},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        elements = [OfficeElement(layout=layout, **data) for _index, data in valid]
+        with transaction.atomic():
+            OfficeElement.objects.bulk_create(elements, batch_size=BULK_BATCH_SIZE)
+            if elements:
+                transaction.on_commit(lambda: bundle.bump_layouts([layout.id]))
         
         return Response({
-            'created_elements': created_elements,
+            'created_elements': OfficeElementSerializer(elements, many=True).data,
             'errors': errors,
-            'success': len(created_elements) > 0
+            'success': len(elements) > 0
         })
     
     @action(detail=False, methods=['post'])
     def bulk_update(self, request):
-        """Массовое обновление элементов схемы офиса."""
+        """
+        Массовое обновление элементов схемы офиса.
+        
+        Элементы загружаются одним запросом и записываются bulk_update частями
+        в одной транзакции. Переносить элементы в другую схему нельзя: поле
+        layout не обновляется. Ошибки и atomic — как в bulk_create.
+        """
         elements_data = request.data.get('elements', [])
+        if not isinstance(elements_data, list):
+            return Response(
+                {'error': 'elements должен быть списком'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
-        updated_elements = []
         errors = []
-        
-        for element_data in elements_data:
-            element_id = element_data.pop('id', None)
-            
-            if not element_id:
+        items = []
+        for index, element_data in enumerate(elements_data):
+            element_data = dict(element_data) if isinstance(element_data, dict) else {}
+            try:
+                element_id = int(element_data.pop('id'))
+            except (KeyError, TypeError, ValueError):
                 errors.append({
+                    'index': index,
                     'error': 'Отсутствует ID элемента',
-                    'data': element_data
+                    'data': elements_data[index]
                 })
                 continue
-            
-            try:
-                element = OfficeElement.objects.get(id=element_id)
-                serializer = OfficeElementCreateUpdateSerializer(
-                    element, data=element_data, partial=True
-                )
-                
-                if serializer.is_valid():
-                    element = serializer.save()
-                    updated_elements.append(OfficeElementSerializer(element).data)
-                else:
-                    errors.append({
-                        'id': element_id,
-                        'data': element_data,
-                        'errors': serializer.errors
-                    })
-            
-            except OfficeElement.DoesNotExist:
+            items.append((index, element_id, element_data))
+        
+        valid, item_errors = validate_elements([data for _index, _id, data in items], partial=True)
+        for error in item_errors:
+            index, element_id, _data = items[error['index']]
+            errors.append({**error, 'index': index, 'id': element_id})
+        
+        elements = OfficeElement.objects.in_bulk([items[position][1] for position, _data in valid])
+        
+        updated = {}
+        fields = set()
+        for position, data in valid:
+            index, element_id, _data = items[position]
+            element = elements.get(element_id)
+            if element is None:
                 errors.append({
+                    'index': index,
                     'error': 'Элемент не найден',
                     'id': element_id
                 })
+                continue
+            
+            for field, value in data.items():
+                setattr(element, field, value)
+            fields.update(data)
+            updated[element_id] = element
+        
+        errors.sort(key=lambda error: error['index'])
+        if errors and is_atomic(request):
+            return Response(
+                {'updated_elements': [], 'errors': errors, 'success': False},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        if fields:
+            with transaction.atomic():
+                OfficeElement.objects.bulk_update(
+                    list(updated.values()), sorted(fields), batch_size=BULK_BATCH_SIZE
+                )
+                layout_ids = {element.layout_id for element in updated.values()}
+                transaction.on_commit(lambda: bundle.bump_layouts(layout_ids))
         
         return Response({
-            'updated_elements': updated_elements,
+            'updated_elements': OfficeElementSerializer(list(updated.values()), many=True).data,
             'errors': errors,
-            'success': len(updated_elements) > 0
-        })
\ No newline at end of file
+            'success': len(updated) > 0
+        })
+
+
+def is_atomic(request):
+    """Запрошена ли массовая операция по принципу «все или ничего»."""
+    return str(request.data.get('atomic', '')).lower() in ('1', 'true')
+
+
+def validate_elements(elements_data, partial=False):
+    """
+    Проверить пачку элементов сериализатором many=True.
+    
+    Возвращает список (позиция, проверенные данные) для верных элементов и
+    ошибки остальных с позицией в elements_data.
+    """
+    serializer = OfficeElementBulkSerializer(data=elements_data, many=True, partial=partial)
+    if serializer.is_valid():
+        return list(enumerate(serializer.validated_data)), []
+    
+    errors = [
+        {'index': index, 'data': elements_data[index], 'errors': item_errors}
+        for index, item_errors in enumerate(serializer.errors)
+        if item_errors
+    ]
+    
+    # При ошибке в пачке DRF не сохраняет данные верных элементов — проверяем их отдельно
+    positions = [index for index, item_errors in enumerate(serializer.errors) if not item_errors]
+    serializer = OfficeElementBulkSerializer(
+        data=[elements_data[index] for index in positions], many=True, partial=partial
+    )
+    serializer.is_valid()
+    return list(zip(positions, serializer.validated_data)), errors
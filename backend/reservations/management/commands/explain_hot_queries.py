@@ -0,0 +1,184 @@
+import random
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from desks.models import Area, Desk
+from reservations.models import Reservation, ReservationStatus
+from users.models import User
+
+
+class Command(BaseCommand):
+    """Проверка планов выполнения горячих запросов к бронированиям."""
+
+    help = (
+        'Выполняет EXPLAIN для горячих запросов к бронированиям и сообщает, '
+        'используется ли рассчитанный на них индекс.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--seed',
+            type=int,
+            default=0,
+            help='Создать указанное число тестовых бронирований перед проверкой '
+                 '(данные откатываются по завершении)'
+        )
+        parser.add_argument(
+            '--analyze',
+            action='store_true',
+            help='Использовать EXPLAIN ANALYZE (запросы будут выполнены)'
+        )
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            if options['seed']:
+                self.seed(options['seed'])
+
+            # Обновляем статистику, чтобы планировщик видел актуальный объем данных
+            with connection.cursor() as cursor:
+                cursor.execute(f'ANALYZE {Reservation._meta.db_table}')
+
+            missing = 0
+            for name, queryset, index_names in self.get_hot_queries():
+                plan = queryset.explain(analyze=options['analyze'])
+                used = [index_name for index_name in index_names if index_name in plan]
+                if used:
+                    self.stdout.write(self.style.SUCCESS(f'[OK] {name}: {", ".join(used)}'))
+                else:
+                    missing += 1
+                    self.stdout.write(self.style.WARNING(
+                        f'[--] {name}: не используется ни один из индексов {", ".join(index_names)}'
+                    ))
+                if options['verbosity'] > 1:
+                    self.stdout.write(plan)
+
+            # Тестовые данные не должны остаться в базе
+            transaction.set_rollback(True)
+
+        if missing:
+            self.stdout.write(self.style.WARNING(
+                f'Запросов без ожидаемого индекса: {missing}. '
+                'На маленьких таблицах планировщик может предпочесть Seq Scan, '
+                'используйте --seed для проверки на объеме.'
+            ))
+
+    def get_hot_queries(self):
+        """
+        Горячие запросы в том виде, в котором их выполняют представления и задачи.
+
+        Для каждого запроса указаны индексы, которые планировщик может выбрать:
+        для пересечения интервалов подходит индекс и по началу, и по окончанию.
+        """
+        now = timezone.now()
+        user = User.objects.order_by('-id').first()
+        desk = Desk.objects.order_by('-id').first()
+        window_start = now.replace(hour=9, minute=0, second=0, microsecond=0)
+        window_end = window_start.replace(hour=18)
+        active = Reservation.objects.filter(status=ReservationStatus.ACTIVE)
+        overlap_indexes = ('res_active_start_end_idx', 'res_active_end_idx')
+
+        queries = [
+            (
+                'desks.views.DeskViewSet.available',
+                active.filter(start_time__lt=window_end, end_time__gt=window_start).values('desk_id'),
+                overlap_indexes
+            ),
+            (
+                'core.tasks.check_expired_reservations',
+                active.filter(end_time__lt=now),
+                ('res_active_end_idx',)
+            ),
+            (
+                'core.tasks.check_no_show_reservations',
+                active.filter(start_time__lt=now - timedelta(hours=1), check_in_time=None),
+                ('res_active_no_checkin_idx',)
+            ),
+            (
+                'core.tasks.send_reservation_reminders',
+                active.filter(start_time__gt=now, start_time__lte=now + timedelta(hours=1)),
+                ('res_active_start_end_idx',)
+            ),
+            (
+                'core.views.OfficeStatsView (active_now)',
+                active.filter(start_time__lte=now, end_time__gte=now),
+                overlap_indexes
+            ),
+        ]
+
+        if user:
+            queries += [
+                (
+                    'ReservationViewSet.current',
+                    active.filter(user=user, start_time__lte=now, end_time__gte=now),
+                    ('res_user_status_start_idx',)
+                ),
+                (
+                    'ReservationViewSet.upcoming',
+                    active.filter(user=user, start_time__gt=now).order_by('start_time'),
+                    ('res_user_status_start_idx',)
+                ),
+                (
+                    'ReservationViewSet.calendar (пользователь)',
+                    active.filter(user=user, end_time__gte=now, start_time__lte=now + timedelta(days=7)),
+                    ('res_user_status_start_idx',)
+                ),
+            ]
+
+        if desk:
+            queries.append((
+                'DeskDetailSerializer.get_current_reservation',
+                active.filter(desk=desk, start_time__gt=now).order_by('start_time'),
+                ('res_active_desk_time_idx',)
+            ))
+
+        return queries
+
+    def seed(self, count):
+        """Создать тестовые бронирования без пересечений по столам."""
+        rng = random.Random(42)
+        area = Area.objects.create(name='explain_hot_queries', floor=99)
+        desks = Desk.objects.bulk_create([
+            Desk(
+                name=f'Explain {i}',
+                desk_number=f'EXPLAIN-{i}',
+                area=area,
+                x_coordinate=i,
+                y_coordinate=0
+            )
+            for i in range(200)
+        ])
+        users = User.objects.bulk_create([
+            User(username=f'explain_hot_queries_{i}')
+            for i in range(max(count // 50, 1))
+        ])
+
+        statuses = [
+            ReservationStatus.ACTIVE,
+            ReservationStatus.COMPLETED,
+            ReservationStatus.COMPLETED,
+            ReservationStatus.CANCELLED,
+            ReservationStatus.NO_SHOW,
+        ]
+        today = timezone.now().replace(hour=9, minute=0, second=0, microsecond=0)
+        # Дней столько, чтобы уместить все count бронирований
+        days = -(-count // len(desks))
+
+        # Один интервал на стол в день, поэтому ограничение исключения не нарушается
+        reservations = []
+        for day in range(-days // 2, days - days // 2):
+            start_time = today + timedelta(days=day)
+            for desk in desks:
+                if len(reservations) >= count:
+                    break
+                reservations.append(Reservation(
+                    user=rng.choice(users),
+                    desk=desk,
+                    start_time=start_time,
+                    end_time=start_time + timedelta(hours=rng.choice([2, 4, 9])),
+                    status=rng.choice(statuses)
+                ))
+        Reservation.objects.bulk_create(reservations, batch_size=1000)
+        self.stdout.write(f'Создано тестовых бронирований: {len(reservations)}')
@@ -0,0 +1,108 @@
+# Generated by Django 5.0.14 on 2026-10-18 03:18
+
+import logging
+
+import django.contrib.postgres.constraints
+import django.contrib.postgres.fields.ranges
+import django.contrib.postgres.operations
+import reservations.models
+from django.conf import settings
+from django.db import migrations, models
+
+logger = logging.getLogger(__name__)
+
+# Пометка в примечаниях бронирований, отмененных этой миграцией; по ней
+# обратная миграция возвращает их статус
+CANCELLED_NOTE = 'Отменено при миграции: пересекается с более ранним бронированием стола.'
+
+
+def cancel_overlapping_reservations(apps, schema_editor):
+    """
+    Отменить активные бронирования, пересекающиеся с созданными раньше.
+    
+    Прежняя проверка (чтение, затем вставка) и непроверенные повторения серий
+    могли пропустить пересечения, и ограничение на таких данных не создается.
+    Бронирования стола просматриваются в порядке создания: остается первое,
+    а пересекающиеся с уже оставленными отменяются с пометкой в примечаниях.
+    Id отмененных бронирований выводятся в журнал, чтобы оператор мог
+    связаться с их владельцами; обратная миграция возвращает их статус.
+    """
+    Reservation = apps.get_model('reservations', 'Reservation')
+    with schema_editor.connection.cursor() as cursor:
+        # Только бронирования, у которых есть хотя бы одно пересечение
+        cursor.execute("""
+            SELECT DISTINCT r.id
+            FROM reservations_reservation r
+            JOIN reservations_reservation other
+              ON other.desk_id = r.desk_id
+             AND other.id <> r.id
+             AND other.status = 'active'
+             AND other.start_time < r.end_time
+             AND r.start_time < other.end_time
+            WHERE r.status = 'active'
+        """)
+        overlapping_ids = [row[0] for row in cursor.fetchall()]
+    if not overlapping_ids:
+        return
+    
+    kept = {}
+    cancelled = []
+    reservations = Reservation.objects.filter(id__in=overlapping_ids).order_by('created_at', 'id')
+    for reservation in reservations.only('id', 'desk_id', 'start_time', 'end_time', 'notes'):
+        intervals = kept.setdefault(reservation.desk_id, [])
+        if any(start < reservation.end_time and reservation.start_time < end for start, end in intervals):
+            reservation.status = 'cancelled'
+            reservation.notes = (reservation.notes + '\n' if reservation.notes else '') + CANCELLED_NOTE
+            cancelled.append(reservation)
+        else:
+            intervals.append((reservation.start_time, reservation.end_time))
+    Reservation.objects.bulk_update(cancelled, ['status', 'notes'], batch_size=500)
+    if cancelled:
+        logger.warning(
+            'Отменены пересекающиеся бронирования (%s): %s',
+            len(cancelled), ', '.join(str(reservation.id) for reservation in cancelled)
+        )
+
+
+def restore_overlapping_reservations(apps, schema_editor):
+    """Вернуть активный статус бронированиям, отмененным этой миграцией."""
+    Reservation = apps.get_model('reservations', 'Reservation')
+    restored = []
+    reservations = Reservation.objects.filter(status='cancelled', notes__contains=CANCELLED_NOTE)
+    for reservation in reservations.only('id', 'notes'):
+        reservation.status = 'active'
+        reservation.notes = reservation.notes.replace('\n' + CANCELLED_NOTE, '').replace(CANCELLED_NOTE, '')
+        restored.append(reservation)
+    Reservation.objects.bulk_update(restored, ['status', 'notes'], batch_size=500)
+    if restored:
+        logger.warning(
+            'Восстановлены бронирования, отмененные миграцией (%s): %s',
+            len(restored), ', '.join(str(reservation.id) for reservation in restored)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('desks', '0001_initial'),
+        ('reservations', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        # btree_gist нужен для сравнения desk_id на равенство в GiST-индексе
+        django.contrib.postgres.operations.BtreeGistExtension(),
+        migrations.AddField(
+            model_name='reservation',
+            name='time_range',
+            field=models.GeneratedField(db_persist=True, expression=reservations.models.TsTzRange(models.F('start_time'), models.F('end_time')), output_field=django.contrib.postgres.fields.ranges.DateTimeRangeField(), verbose_name='Интервал бронирования'),
+        ),
+        migrations.RunPython(cancel_overlapping_reservations, restore_overlapping_reservations),
+        # Проверить отложенные внешние ключи сейчас: иначе ALTER TABLE в той же
+        # транзакции падает с "pending trigger events"
+        migrations.RunSQL('SET CONSTRAINTS ALL IMMEDIATE', migrations.RunSQL.noop),
+        migrations.AddConstraint(
+            model_name='reservation',
+            constraint=django.contrib.postgres.constraints.ExclusionConstraint(condition=models.Q(('status', 'active')), expressions=[('desk', '='), ('time_range', '&&')], name='reservation_desk_no_overlap', violation_error_message='Это рабочее место уже забронировано на указанное время.'),
+        ),
+    ]
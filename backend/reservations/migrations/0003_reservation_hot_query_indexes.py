@@ -0,0 +1,40 @@
+# Generated by Django 5.0.14 on 2026-10-18 03:21
+
+from django.conf import settings
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY нельзя выполнять внутри транзакции
+    atomic = False
+
+    dependencies = [
+        ('desks', '0001_initial'),
+        ('reservations', '0002_desk_overlap_exclusion'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='reservation',
+            index=models.Index(condition=models.Q(('status', 'active')), fields=['start_time', 'end_time'], name='res_active_start_end_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='reservation',
+            index=models.Index(condition=models.Q(('status', 'active')), fields=['end_time'], name='res_active_end_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='reservation',
+            index=models.Index(condition=models.Q(('status', 'active')), fields=['desk', 'start_time', 'end_time'], name='res_active_desk_time_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='reservation',
+            index=models.Index(fields=['user', 'status', 'start_time'], name='res_user_status_start_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='reservation',
+            index=models.Index(condition=models.Q(('check_in_time__isnull', True), ('status', 'active')), fields=['start_time'], name='res_active_no_checkin_idx'),
+        ),
+    ]
@@ -1,7 +1,11 @@
-from django.db import models
+from django.contrib.postgres.constraints import ExclusionConstraint
+from django.contrib.postgres.fields import DateTimeRangeField, RangeOperators
+from django.db import models, transaction
+from django.db.models import F, Func, Q
 from django.utils.translation import gettext_lazy as _
 from django.conf import settings
 from django.utils import timezone
+from core import presence
 from desks.models import Desk
 
 
@@ -31,6 +35,29 @@ class RecurrencePattern(models.TextChoices):
     MONTHLY = 'monthly', _('Ежемесячно')
 
 
+# Имя ограничения, запрещающего пересечение активных бронирований одного стола
+DESK_OVERLAP_CONSTRAINT = 'reservation_desk_no_overlap'
+
+# Код ошибки PostgreSQL exclusion_violation
+EXCLUSION_VIOLATION_CODE = '23P01'
+
+
+class TsTzRange(Func):
+    """Диапазон tstzrange из времени начала и окончания."""
+    
+    function = 'TSTZRANGE'
+    output_field = DateTimeRangeField()
+
+
+def is_desk_overlap_error(exc):
+    """Проверить, вызвана ли ошибка БД пересечением бронирований стола."""
+    cause = exc.__cause__
+    if getattr(cause, 'pgcode', None) != EXCLUSION_VIOLATION_CODE:
+        return False
+    diag = getattr(cause, 'diag', None)
+    return getattr(diag, 'constraint_name', DESK_OVERLAP_CONSTRAINT) == DESK_OVERLAP_CONSTRAINT
+
+
 class Reservation(models.Model):
     """Модель бронирования рабочего места."""
     
@@ -88,11 +115,60 @@ class Reservation(models.Model):
         null=True,
         verbose_name=_('Время прибытия')
     )
+    time_range = models.GeneratedField(
+        expression=TsTzRange(F('start_time'), F('end_time')),
+        output_field=DateTimeRangeField(),
+        db_persist=True,
+        verbose_name=_('Интервал бронирования')
+    )
     
     class Meta:
         verbose_name = _('Бронирование')
         verbose_name_plural = _('Бронирования')
         ordering = ['-start_time']
+        constraints = [
+            ExclusionConstraint(
+                name=DESK_OVERLAP_CONSTRAINT,
+                expressions=[
+                    ('desk', RangeOperators.EQUAL),
+                    ('time_range', RangeOperators.OVERLAPS),
+                ],
+                condition=Q(status=ReservationStatus.ACTIVE),
+                violation_error_message=_('Это рабочее место уже забронировано на указанное время.'),
+            ),
+        ]
+        indexes = [
+            # Пересечение интервалов по активным бронированиям: доступные столы,
+            # календарь администратора, напоминания
+            models.Index(
+                fields=['start_time', 'end_time'],
+                condition=Q(status=ReservationStatus.ACTIVE),
+                name='res_active_start_end_idx'
+            ),
+            # Поиск истекших активных бронирований
+            models.Index(
+                fields=['end_time'],
+                condition=Q(status=ReservationStatus.ACTIVE),
+                name='res_active_end_idx'
+            ),
+            # Текущее и ближайшее бронирование конкретного стола
+            models.Index(
+                fields=['desk', 'start_time', 'end_time'],
+                condition=Q(status=ReservationStatus.ACTIVE),
+                name='res_active_desk_time_idx'
+            ),
+            # Бронирования пользователя: текущее, предстоящие, календарь
+            models.Index(
+                fields=['user', 'status', 'start_time'],
+                name='res_user_status_start_idx'
+            ),
+            # Поиск неявок: активные бронирования без отметки о прибытии
+            models.Index(
+                fields=['start_time'],
+                condition=Q(status=ReservationStatus.ACTIVE, check_in_time__isnull=True),
+                name='res_active_no_checkin_idx'
+            ),
+        ]
         
     def __str__(self):
         return f"{self.user} - {self.desk} ({self.start_time.strftime('%d.%m.%Y %H:%M')})"
@@ -102,6 +178,11 @@ class Reservation(models.Model):
         if self.status == ReservationStatus.ACTIVE:
             self.check_in_time = timezone.now()
             self.save()
+            # Сотрудник присутствует на этаже, стол занят до конца бронирования
+            floor = self._desk_floor()
+            transaction.on_commit(
+                lambda: presence.check_in(self.user_id, self.desk_id, floor, self.end_time)
+            )
             return True
         return False
     
@@ -110,6 +191,7 @@ class Reservation(models.Model):
         if self.status == ReservationStatus.ACTIVE:
             self.status = ReservationStatus.CANCELLED
             self.save()
+            self._release_presence()
             return True
         return False
     
@@ -118,9 +200,22 @@ class Reservation(models.Model):
         if self.status == ReservationStatus.ACTIVE:
             self.status = ReservationStatus.COMPLETED
             self.save()
+            self._release_presence()
             return True
         return False
     
+    def _desk_floor(self):
+        """Этаж стола: из уже загруженных стола и зоны, иначе одним запросом."""
+        if Reservation.desk.is_cached(self) and Desk.area.is_cached(self.desk):
+            return self.desk.area.floor
+        return Desk.objects.filter(pk=self.desk_id).values_list('area__floor', flat=True).first()
+    
+    def _release_presence(self):
+        """Снять занятость стола, если по бронированию была отметка о прибытии."""
+        if self.check_in_time:
+            floor = self._desk_floor()
+            transaction.on_commit(lambda: presence.release_desk(self.desk_id, floor))
+    
     def mark_no_show(self):
         """Отметить неявку."""
         if self.status == ReservationStatus.ACTIVE and not self.check_in_time:
@@ -0,0 +1,102 @@
+from datetime import timedelta
+from dateutil.relativedelta import relativedelta
+from django.db import connection
+from django.utils import timezone
+from .models import Reservation, ReservationStatus, RecurrencePattern
+
+
+# Шаг между повторениями для шаблонов с фиксированным интервалом
+PATTERN_STEPS = {
+    RecurrencePattern.DAILY: timedelta(days=1),
+    RecurrencePattern.WEEKDAYS: timedelta(days=1),
+    RecurrencePattern.WEEKLY: timedelta(weeks=1),
+    RecurrencePattern.BIWEEKLY: timedelta(weeks=2),
+}
+
+
+def _occurrence_dates(first_date, recurrence_pattern, end_date):
+    """Даты повторений после первой (включая дату окончания)."""
+    if recurrence_pattern == RecurrencePattern.MONTHLY:
+        # Считаем каждый месяц от исходной даты, чтобы 31 число не "сползало"
+        # на 28 после февраля; relativedelta сам обрезает дату до конца месяца
+        months = 1
+        current_date = first_date + relativedelta(months=months)
+        while current_date <= end_date:
+            yield current_date
+            months += 1
+            current_date = first_date + relativedelta(months=months)
+        return
+
+    step = PATTERN_STEPS.get(recurrence_pattern)
+    if step is None:
+        return
+
+    current_date = first_date + step
+    while current_date <= end_date:
+        # Для будних дней пропускаем субботу и воскресенье (5, 6)
+        if recurrence_pattern != RecurrencePattern.WEEKDAYS or current_date.weekday() < 5:
+            yield current_date
+        current_date += step
+
+
+def generate_occurrences(start_time, end_time, recurrence_pattern, recurrence_end_date):
+    """
+    Сгенерировать интервалы повторений бронирования в памяти.
+
+    Возвращает список пар (start_time, end_time) для всех повторений
+    после первого. Первое бронирование серии соответствует исходным
+    start_time/end_time и в список не входит.
+    """
+    if not recurrence_pattern or not recurrence_end_date:
+        return []
+
+    local_start = timezone.localtime(start_time)
+    start_clock = local_start.time()
+    duration = end_time - start_time
+    current_timezone = timezone.get_current_timezone()
+
+    occurrences = []
+    for current_date in _occurrence_dates(local_start.date(), recurrence_pattern, recurrence_end_date):
+        current_start = timezone.make_aware(
+            timezone.datetime.combine(current_date, start_clock), current_timezone
+        )
+        occurrences.append((current_start, current_start + duration))
+
+    return occurrences
+
+
+def find_conflicting_occurrences(desk, occurrences, exclude_id=None):
+    """
+    Найти повторения серии, пересекающиеся с активными бронированиями стола.
+
+    Все интервалы передаются одним запросом в виде двух массивов, которые
+    разворачиваются через unnest и соединяются с бронированиями стола,
+    поэтому проверка серии любой длины выполняется одним запросом.
+    Возвращает отсортированный список времен начала конфликтующих повторений.
+    """
+    if not occurrences:
+        return []
+
+    starts = [occurrence_start for occurrence_start, _ in occurrences]
+    ends = [occurrence_end for _, occurrence_end in occurrences]
+    desk_id = getattr(desk, 'pk', desk)
+
+    query = f"""
+        SELECT occurrence.start_time
+        FROM unnest(%s::timestamptz[], %s::timestamptz[])
+            AS occurrence(start_time, end_time)
+        WHERE EXISTS (
+            SELECT 1
+            FROM {Reservation._meta.db_table} AS reservation
+            WHERE reservation.desk_id = %s
+              AND reservation.status = %s
+              AND reservation.start_time < occurrence.end_time
+              AND reservation.end_time > occurrence.start_time
+              AND reservation.id IS DISTINCT FROM %s
+        )
+        ORDER BY occurrence.start_time
+    """
+
+    with connection.cursor() as cursor:
+        cursor.execute(query, [starts, ends, desk_id, ReservationStatus.ACTIVE, exclude_id])
+        return [row[0] for row in cursor.fetchall()]
@@ -1,26 +1,22 @@
 from rest_framework import serializers
+from django.db import IntegrityError, transaction
 from django.utils import timezone
-from .models import Reservation, ReservationStatus, ReservationType, RecurrencePattern
+from .models import Reservation, ReservationStatus, ReservationType, is_desk_overlap_error
+from .recurrence import generate_occurrences, find_conflicting_occurrences
 from desks.models import Desk
+from desks import availability
 from users.serializers import UserSerializer
+from core.signals import broadcast_reservation_series
 
 
-class ReservationSerializer(serializers.ModelSerializer):
-    """Сериализатор для бронирований."""
-    
-    user_details = UserSerializer(source='user', read_only=True)
-    desk_number = serializers.ReadOnlyField(source='desk.desk_number')
-    desk_name = serializers.ReadOnlyField(source='desk.name')
-    
-    class Meta:
-        model = Reservation
-        fields = [
-            'id', 'user', 'user_details', 'desk', 'desk_number', 'desk_name',
-            'start_time', 'end_time', 'status', 'reservation_type',
-            'recurrence_pattern', 'recurrence_end_date', 'notes',
-            'created_at', 'updated_at', 'check_in_time'
-        ]
-        read_only_fields = ['created_at', 'updated_at', 'check_in_time']
+# Размер пачки INSERT при создании повторений серии
+RECURRENCE_BATCH_SIZE = 500
+
+DESK_ALREADY_BOOKED_MESSAGE = "Это рабочее место уже забронировано на указанное время."
+
+
+class ReservationValidationMixin:
+    """Общая валидация времени, повторений и доступности стола."""
     
     def validate(self, data):
         """Валидация данных бронирования."""
@@ -61,31 +57,63 @@ class ReservationSerializer(serializers.ModelSerializer):
                     "recurrence_end_date": "Дата окончания повторений должна быть не раньше даты начала."
                 })
         
-        # Проверка доступности стола в указанное время
+        # Одиночное бронирование отдельно не проверяется: пересечения отсекает
+        # ограничение исключения в БД при вставке. Для серии проверяем все даты
+        # одним запросом, чтобы вернуть пользователю список конфликтующих дат.
         desk = data.get('desk')
         if desk and start_time and end_time:
-            # Исключаем текущее бронирование при обновлении
-            reservation_id = self.instance.id if self.instance else None
-            
-            conflicting_reservations = Reservation.objects.filter(
-                desk=desk,
-                status=ReservationStatus.ACTIVE,
-                start_time__lt=end_time,
-                end_time__gt=start_time
-            )
-            
-            if reservation_id:
-                conflicting_reservations = conflicting_reservations.exclude(id=reservation_id)
+            occurrences = []
+            if reservation_type == ReservationType.RECURRING:
+                occurrences = generate_occurrences(
+                    start_time, end_time, recurrence_pattern, recurrence_end_date
+                )
+                
+                # Исключаем текущее бронирование при обновлении
+                reservation_id = self.instance.id if self.instance else None
+                
+                conflicting_starts = find_conflicting_occurrences(
+                    desk, [(start_time, end_time)] + occurrences, exclude_id=reservation_id
+                )
+                
+                if conflicting_starts:
+                    raise serializers.ValidationError({
+                        "desk": DESK_ALREADY_BOOKED_MESSAGE,
+                        "conflicting_dates": sorted({
+                            timezone.localtime(conflict_start).date().isoformat()
+                            for conflict_start in conflicting_starts
+                        })
+                    })
             
-            if conflicting_reservations.exists():
-                raise serializers.ValidationError({
-                    "desk": "Это рабочее место уже забронировано на указанное время."
-                })
+            # Сохраняем повторения, чтобы не генерировать их повторно в create()
+            self._occurrences = occurrences
         
         return data
 
 
-class ReservationCreateSerializer(serializers.ModelSerializer):
+class ReservationSerializer(ReservationValidationMixin, serializers.ModelSerializer):
+    """Сериализатор для бронирований."""
+    
+    user_details = UserSerializer(source='user', read_only=True)
+    desk_number = serializers.ReadOnlyField(source='desk.desk_number')
+    desk_name = serializers.ReadOnlyField(source='desk.name')
+    
+    class Meta:
+        model = Reservation
+        fields = [
+            'id', 'user', 'user_details', 'desk', 'desk_number', 'desk_name',
+            'start_time', 'end_time', 'status', 'reservation_type',
+            'recurrence_pattern', 'recurrence_end_date', 'notes',
+            'created_at', 'updated_at', 'check_in_time'
+        ]
+        read_only_fields = ['created_at', 'updated_at', 'check_in_time']
+    
+    @staticmethod
+    def setup_eager_loading(queryset):
+        """Загрузка пользователя, его предпочтений, стола и его зоны одним JOIN вместо запроса на строку."""
+        return queryset.select_related('user__preference', 'desk__area')
+
+
+class ReservationCreateSerializer(ReservationValidationMixin, serializers.ModelSerializer):
     """Сериализатор для создания бронирований."""
     
     class Meta:
@@ -100,160 +128,63 @@ class ReservationCreateSerializer(serializers.ModelSerializer):
         user = self.context['request'].user
         validated_data['user'] = user
         
-        # Для обычного бронирования просто создаем одну запись
-        if validated_data.get('reservation_type') == ReservationType.SINGLE:
-            reservation = Reservation.objects.create(**validated_data)
-            return reservation
-        
-        # Для повторяющегося бронирования создаем несколько записей
-        start_time = validated_data.get('start_time')
-        end_time = validated_data.get('end_time')
-        recurrence_pattern = validated_data.get('recurrence_pattern')
-        recurrence_end_date = validated_data.get('recurrence_end_date')
-        
-        # Создаем родительское бронирование
-        parent_reservation = Reservation.objects.create(**validated_data)
-        
-        # Определяем интервал для повторений
-        delta = end_time - start_time  # продолжительность бронирования
-        current_date = start_time.date()
-        end_date = recurrence_end_date
-        
-        # Создаем повторяющиеся бронирования в зависимости от шаблона
-        if recurrence_pattern == RecurrencePattern.DAILY:
-            from datetime import timedelta
-            step = timedelta(days=1)
-            current_date += step  # начинаем со следующего дня
-            
-            while current_date <= end_date:
-                current_start = timezone.datetime.combine(
-                    current_date, start_time.time(), tzinfo=timezone.get_current_timezone()
-                )
-                current_end = current_start + delta
-                
-                Reservation.objects.create(
-                    user=user,
-                    desk=validated_data.get('desk'),
-                    start_time=current_start,
-                    end_time=current_end,
-                    status=ReservationStatus.ACTIVE,
-                    reservation_type=ReservationType.RECURRING,
-                    recurrence_pattern=recurrence_pattern,
-                    recurrence_end_date=recurrence_end_date,
-                    notes=validated_data.get('notes', ''),
-                    parent_reservation=parent_reservation
-                )
-                
-                current_date += step
-        
-        elif recurrence_pattern == RecurrencePattern.WEEKDAYS:
-            from datetime import timedelta
-            current_date += timedelta(days=1)  # начинаем со следующего дня
+        try:
+            # Для обычного бронирования просто создаем одну запись
+            if validated_data.get('reservation_type') != ReservationType.RECURRING:
+                with transaction.atomic():
+                    return Reservation.objects.create(**validated_data)
             
-            while current_date <= end_date:
-                # Проверяем, что текущий день - будний (0 = понедельник, 6 = воскресенье)
-                if current_date.weekday() < 5:  # Будние дни: 0-4
-                    current_start = timezone.datetime.combine(
-                        current_date, start_time.time(), tzinfo=timezone.get_current_timezone()
-                    )
-                    current_end = current_start + delta
-                    
-                    Reservation.objects.create(
-                        user=user,
-                        desk=validated_data.get('desk'),
-                        start_time=current_start,
-                        end_time=current_end,
-                        status=ReservationStatus.ACTIVE,
-                        reservation_type=ReservationType.RECURRING,
-                        recurrence_pattern=recurrence_pattern,
-                        recurrence_end_date=recurrence_end_date,
-                        notes=validated_data.get('notes', ''),
-                        parent_reservation=parent_reservation
-                    )
-                
-                current_date += timedelta(days=1)
-        
-        elif recurrence_pattern == RecurrencePattern.WEEKLY:
-            from datetime import timedelta
-            step = timedelta(days=7)
-            current_date += step  # начинаем со следующей недели
-            
-            while current_date <= end_date:
-                current_start = timezone.datetime.combine(
-                    current_date, start_time.time(), tzinfo=timezone.get_current_timezone()
-                )
-                current_end = current_start + delta
-                
-                Reservation.objects.create(
-                    user=user,
-                    desk=validated_data.get('desk'),
-                    start_time=current_start,
-                    end_time=current_end,
-                    status=ReservationStatus.ACTIVE,
-                    reservation_type=ReservationType.RECURRING,
-                    recurrence_pattern=recurrence_pattern,
-                    recurrence_end_date=recurrence_end_date,
-                    notes=validated_data.get('notes', ''),
-                    parent_reservation=parent_reservation
-                )
-                
-                current_date += step
+            return self._create_series(user, validated_data)
+        except IntegrityError as exc:
+            # Пересечение с другим активным бронированием отсекает ограничение в БД
+            if is_desk_overlap_error(exc):
+                raise serializers.ValidationError({"desk": [DESK_ALREADY_BOOKED_MESSAGE]})
+            raise
+    
+    def _create_series(self, user, validated_data):
+        """Создание серии повторяющихся бронирований одной вставкой."""
+        # Все повторения серии генерируются в памяти заранее (обычно уже в validate)
+        occurrences = getattr(self, '_occurrences', None)
+        if occurrences is None:
+            occurrences = generate_occurrences(
+                validated_data.get('start_time'),
+                validated_data.get('end_time'),
+                validated_data.get('recurrence_pattern'),
+                validated_data.get('recurrence_end_date')
+            )
         
-        elif recurrence_pattern == RecurrencePattern.BIWEEKLY:
-            from datetime import timedelta
-            step = timedelta(days=14)
-            current_date += step  # начинаем через две недели
+        with transaction.atomic():
+            # bulk_create не вызывает post_save, поэтому серия не рассылает
+            # отдельное WebSocket-событие на каждое повторение
+            parent_reservation = Reservation(**validated_data)
+            Reservation.objects.bulk_create([parent_reservation])
             
-            while current_date <= end_date:
-                current_start = timezone.datetime.combine(
-                    current_date, start_time.time(), tzinfo=timezone.get_current_timezone()
-                )
-                current_end = current_start + delta
-                
-                Reservation.objects.create(
+            child_reservations = [
+                Reservation(
                     user=user,
                     desk=validated_data.get('desk'),
                     start_time=current_start,
                     end_time=current_end,
                     status=ReservationStatus.ACTIVE,
                     reservation_type=ReservationType.RECURRING,
-                    recurrence_pattern=recurrence_pattern,
-                    recurrence_end_date=recurrence_end_date,
+                    recurrence_pattern=validated_data.get('recurrence_pattern'),
+                    recurrence_end_date=validated_data.get('recurrence_end_date'),
                     notes=validated_data.get('notes', ''),
                     parent_reservation=parent_reservation
                 )
-                
-                current_date += step
-        
-        elif recurrence_pattern == RecurrencePattern.MONTHLY:
-            from dateutil.relativedelta import relativedelta
-            current_date += relativedelta(months=1)  # начинаем со следующего месяца
+                for current_start, current_end in occurrences
+            ]
+            Reservation.objects.bulk_create(child_reservations, batch_size=RECURRENCE_BATCH_SIZE)
             
-            while current_date <= end_date:
-                # Учитываем возможное отсутствие такой же даты в месяце (например, 31 число)
-                try:
-                    current_start = timezone.datetime.combine(
-                        current_date, start_time.time(), tzinfo=timezone.get_current_timezone()
-                    )
-                    current_end = current_start + delta
-                    
-                    Reservation.objects.create(
-                        user=user,
-                        desk=validated_data.get('desk'),
-                        start_time=current_start,
-                        end_time=current_end,
-                        status=ReservationStatus.ACTIVE,
-                        reservation_type=ReservationType.RECURRING,
-                        recurrence_pattern=recurrence_pattern,
-                        recurrence_end_date=recurrence_end_date,
-                        notes=validated_data.get('notes', ''),
-                        parent_reservation=parent_reservation
-                    )
-                except ValueError:
-                    # Пропускаем несуществующую дату
-                    pass
-                
-                current_date += relativedelta(months=1)
+            # Одно событие на всю серию и обновление индекса доступности
+            # после фиксации транзакции
+            transaction.on_commit(
+                lambda: broadcast_reservation_series(parent_reservation, len(child_reservations) + 1)
+            )
+            transaction.on_commit(lambda: availability.refresh_intervals([
+                (reservation.desk_id, reservation.start_time, reservation.end_time)
+                for reservation in [parent_reservation] + child_reservations
+            ]))
         
         return parent_reservation
 
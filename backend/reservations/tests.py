@@ -1,3 +1,454 @@
-from django.test import TestCase
+import json
+from datetime import date, time, timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from core.testing import TestCase, TransactionTestCase
+from desks.models import Area, Desk
+from users.models import User, UserPreference
+from .management.commands.explain_hot_queries import Command as ExplainHotQueriesCommand
+from .models import RecurrencePattern, Reservation, ReservationStatus, ReservationType, is_desk_overlap_error
+from .recurrence import find_conflicting_occurrences, generate_occurrences
+from .serializers import DESK_ALREADY_BOOKED_MESSAGE
+
+
+class QueryCountMixin:
+    """Проверка, что число запросов эндпоинта не зависит от числа строк."""
+
+    def assertFixedQueryCount(self, url, expected, grow):
+        """
+        Выполнить запрос до и после добавления данных функцией grow и
+        убедиться, что оба раза выполнено ровно expected запросов.
+        """
+        for attempt in range(2):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+                # Потоковый ответ выполняет запросы при чтении содержимого
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(
+                len(queries), expected,
+                f'{url}: {len(queries)} запросов вместо {expected}\n'
+                + '\n'.join(query['sql'] for query in queries.captured_queries)
+            )
+            if attempt == 0:
+                grow()
+
+
+class ReservationQueryCountTests(QueryCountMixin, TestCase):
+    """Число запросов списков бронирований не растет с количеством строк."""
+
+    def setUp(self):
+        super().setUp()
+        self.area = Area.objects.create(name='Open space')
+        self.user = User.objects.create(username='staff', is_staff=True)
+        UserPreference.objects.create(user=self.user)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.start = timezone.now().replace(hour=9, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        self.desk_count = 0
+        self.add_reservations(3)
+
+    def add_reservations(self, count):
+        """Создать бронирования на разных столах и у разных пользователей."""
+        reservations = []
+        for i in range(count):
+            self.desk_count += 1
+            desk = Desk.objects.create(
+                name=f'Desk {self.desk_count}',
+                desk_number=f'D{self.desk_count}',
+                area=self.area,
+                x_coordinate=0,
+                y_coordinate=0
+            )
+            owner = self.user if i % 2 else User.objects.create(username=f'user{self.desk_count}')
+            reservations.append(Reservation(
+                user=owner,
+                desk=desk,
+                start_time=self.start,
+                end_time=self.start + timedelta(hours=8)
+            ))
+        Reservation.objects.bulk_create(reservations)
+
+    def grow(self):
+        self.add_reservations(10)
+
+    def test_list(self):
+        # Курсорная пагинация: только выборка страницы, без COUNT
+        self.assertFixedQueryCount('/api/reservations/', 1, self.grow)
+
+    def test_list_page_number(self):
+        # COUNT для пагинации и выборка страницы
+        self.assertFixedQueryCount('/api/reservations/?page=1', 2, self.grow)
+
+    def test_upcoming(self):
+        self.assertFixedQueryCount('/api/reservations/upcoming/', 1, self.grow)
+
+    def test_cursor_walks_all_rows(self):
+        # Все бронирования начинаются одновременно, порядок определяет id
+        self.grow()
+        seen = []
+        url = '/api/reservations/'
+        while url:
+            data = self.client.get(url).json()
+            self.assertNotIn('count', data)
+            seen += [row['id'] for row in data['results']]
+            url = data['next']
+        self.assertEqual(seen, sorted(seen, reverse=True))
+        self.assertEqual(len(seen), Reservation.objects.count())
+
+    def test_calendar(self):
+        self.assertFixedQueryCount('/api/reservations/calendar/', 1, self.grow)
+
+
+class ReservationCalendarTests(TestCase):
+    """Потоковая выдача календаря и ограничение окна дат."""
+
+    def setUp(self):
+        super().setUp()
+        area = Area.objects.create(name='Open space')
+        self.desk = Desk.objects.create(
+            name='Desk', desk_number='D1', area=area, x_coordinate=0, y_coordinate=0
+        )
+        self.user = User.objects.create(username='staff', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.start = timezone.now().replace(hour=9, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        Reservation.objects.bulk_create([
+            Reservation(
+                user=self.user,
+                desk=self.desk,
+                start_time=self.start + timedelta(days=day),
+                end_time=self.start + timedelta(days=day, hours=8)
+            )
+            for day in (0, 1, 200)
+        ])
+
+    def read(self, response):
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_json_array_stream_is_clamped(self):
+        response = self.client.get('/api/reservations/calendar/')
+        self.assertTrue(response.streaming)
+        data = json.loads(self.read(response))
+        # Бронирование через 200 дней не попадает в окно по умолчанию
+        self.assertEqual(len(data), 2)
+        self.assertLess(data[0]['start_time'], data[1]['start_time'])
+        self.assertIn('X-Calendar-End', response)
+
+    def test_ndjson_stream(self):
+        end = (self.start + timedelta(days=400)).isoformat()
+        response = self.client.get('/api/reservations/calendar/', {
+            'format': 'ndjson', 'start': self.start.isoformat(), 'end': end
+        })
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = self.read(response).splitlines()
+        # Окно урезано до CALENDAR_MAX_DAYS
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(json.loads(lines[0])['desk'], self.desk.id)
+
+    def test_compact_format(self):
+        response = self.client.get('/api/reservations/calendar/', {'format': 'compact'})
+        data = response.json()
+        self.assertEqual(len(data['ids']), 2)
+        self.assertEqual(data['desk_ids'], [self.desk.id, self.desk.id])
+        self.assertEqual(data['starts'][0], int(self.start.timestamp()))
+        # Пользователь один раз в справочнике, а не на каждой строке
+        self.assertEqual(list(data['users']), [str(self.user.id)])
+        self.assertEqual(data['desks'][str(self.desk.id)]['desk_number'], 'D1')
+
+    def test_invalid_date(self):
+        response = self.client.get('/api/reservations/calendar/', {'start': 'tomorrow'})
+        self.assertEqual(response.status_code, 400)
+
+
+class DeskOverlapMigrationTests(TransactionTestCase):
+    """Миграция ограничения на данных с уже пересекающимися бронированиями."""
+
+    migrate_from = [('reservations', '0001_initial')]
+    migrate_to = [('reservations', '0002_desk_overlap_exclusion')]
+
+    def tearDown(self):
+        # Вернуть схему к последней миграции для следующих тестов
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+        super().tearDown()
+
+    def test_overlaps_cancelled_before_constraint(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(self.migrate_from)
+        apps = executor.loader.project_state(self.migrate_from).apps
+        user = apps.get_model('users', 'User').objects.create(username='user')
+        area = apps.get_model('desks', 'Area').objects.create(name='Open space')
+        desk = apps.get_model('desks', 'Desk').objects.create(
+            name='D1', desk_number='D1', area=area, x_coordinate=0, y_coordinate=0
+        )
+        HistoricalReservation = apps.get_model('reservations', 'Reservation')
+        start = timezone.now().replace(microsecond=0) + timedelta(days=1)
+        hour = timedelta(hours=1)
+        first, overlapping, after_overlapping, cancelled = [
+            HistoricalReservation.objects.create(user=user, desk=desk, start_time=start_time, end_time=end_time, status=status)
+            for start_time, end_time, status in [
+                (start, start + 2 * hour, 'active'),
+                (start + hour, start + 3 * hour, 'active'),
+                # Пересекается только с отмененным при миграции
+                (start + 2 * hour, start + 4 * hour, 'active'),
+                (start, start + 4 * hour, 'cancelled'),
+            ]
+        ]
+
+        overlapping.notes = 'У окна'
+        overlapping.save()
+
+        executor = MigrationExecutor(connection)
+        with self.assertLogs('reservations.migrations.0002_desk_overlap_exclusion', 'WARNING') as logs:
+            executor.migrate(self.migrate_to)
+        # Оператор видит, какие бронирования отменены
+        self.assertIn(f': {overlapping.id}', logs.output[0])
+
+        statuses = dict(Reservation.objects.values_list('id', 'status'))
+        self.assertEqual(
+            [statuses[reservation.id] for reservation in (first, overlapping, after_overlapping, cancelled)],
+            ['active', 'cancelled', 'active', 'cancelled']
+        )
+        self.assertIn('Отменено при миграции', Reservation.objects.get(id=overlapping.id).notes)
+
+        # Обратная миграция возвращает статус и примечания только отмененным ею
+        executor = MigrationExecutor(connection)
+        with self.assertLogs('reservations.migrations.0002_desk_overlap_exclusion', 'WARNING'):
+            executor.migrate(self.migrate_from)
+        restored = HistoricalReservation.objects.in_bulk()
+        self.assertEqual(
+            [restored[reservation.id].status for reservation in (first, overlapping, after_overlapping, cancelled)],
+            ['active', 'active', 'active', 'cancelled']
+        )
+        self.assertEqual(restored[overlapping.id].notes, 'У окна')
+
+
+class RecurrenceTests(TestCase):
+    """Генерация повторений серии в памяти."""
+
+    def occurrence_dates(self, first_date, pattern, end_date):
+        start = timezone.make_aware(timezone.datetime.combine(date.fromisoformat(first_date), time(9, 30)))
+        occurrences = generate_occurrences(start, start + timedelta(hours=8), pattern, date.fromisoformat(end_date))
+        for occurrence_start, occurrence_end in occurrences:
+            # Время на часах и длительность сохраняются
+            self.assertEqual(timezone.localtime(occurrence_start).time(), time(9, 30))
+            self.assertEqual(occurrence_end - occurrence_start, timedelta(hours=8))
+        return [timezone.localtime(occurrence_start).date().isoformat() for occurrence_start, _ in occurrences]
+
+    def test_patterns(self):
+        # 2030-01-07 — понедельник, 2030-01-11 — пятница
+        self.assertEqual(
+            self.occurrence_dates('2030-01-07', RecurrencePattern.DAILY, '2030-01-10'),
+            ['2030-01-08', '2030-01-09', '2030-01-10']
+        )
+        self.assertEqual(
+            self.occurrence_dates('2030-01-11', RecurrencePattern.WEEKDAYS, '2030-01-16'),
+            ['2030-01-14', '2030-01-15', '2030-01-16']
+        )
+        self.assertEqual(
+            self.occurrence_dates('2030-01-07', RecurrencePattern.WEEKLY, '2030-01-28'),
+            ['2030-01-14', '2030-01-21', '2030-01-28']
+        )
+        self.assertEqual(
+            self.occurrence_dates('2030-01-07', RecurrencePattern.BIWEEKLY, '2030-02-03'),
+            ['2030-01-21']
+        )
+        self.assertEqual(self.occurrence_dates('2030-01-07', RecurrencePattern.DAILY, '2030-01-07'), [])
+        self.assertEqual(self.occurrence_dates('2030-01-07', '', '2030-02-07'), [])
+
+    def test_monthly_does_not_drift(self):
+        # После февраля серия возвращается к 31 числу, а не остается на 28
+        self.assertEqual(
+            self.occurrence_dates('2030-01-31', RecurrencePattern.MONTHLY, '2030-05-31'),
+            ['2030-02-28', '2030-03-31', '2030-04-30', '2030-05-31']
+        )
+
+
+class RecurringReservationCreateTests(TestCase):
+    """Создание серии повторяющихся бронирований пачкой."""
+
+    def setUp(self):
+        super().setUp()
+        self.area = Area.objects.create(name='Open space')
+        self.user = User.objects.create(username='user')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.start = timezone.make_aware(timezone.datetime(2030, 1, 7, 9, 0))
+
+    def add_desk(self, number):
+        return Desk.objects.create(
+            name=f'Desk {number}', desk_number=f'D{number}', area=self.area, x_coordinate=0, y_coordinate=0
+        )
+
+    def create_series(self, desk, days):
+        with mock.patch('core.broadcast.send') as send, self.captureOnCommitCallbacks(execute=True):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post('/api/reservations/', {
+                    'desk': desk.id,
+                    'start_time': self.start.isoformat(),
+                    'end_time': (self.start + timedelta(hours=8)).isoformat(),
+                    'reservation_type': ReservationType.RECURRING,
+                    'recurrence_pattern': RecurrencePattern.DAILY,
+                    'recurrence_end_date': (self.start + timedelta(days=days)).date().isoformat(),
+                }, format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        return len(queries), send
+
+    def test_series_is_bulk_inserted(self):
+        short_queries, _ = self.create_series(self.add_desk(1), 5)
+        long_queries, send = self.create_series(self.add_desk(2), 400)
+
+        # Число запросов не зависит от длины серии (в пределах RECURRENCE_BATCH_SIZE)
+        self.assertEqual(short_queries, long_queries)
+        desk_reservations = Reservation.objects.filter(desk__desk_number='D2')
+        self.assertEqual(desk_reservations.count(), 401)
+        parent = desk_reservations.get(parent_reservation__isnull=True)
+        self.assertEqual(parent.child_reservations.count(), 400)
+        # Одно уведомление на всю серию
+        send.assert_called_once()
+
+
+class SeriesConflictTests(TestCase):
+    """Проверка всех повторений серии на пересечения одним запросом."""
+
+    def setUp(self):
+        super().setUp()
+        self.desk = Desk.objects.create(
+            name='Desk', desk_number='D1', area=Area.objects.create(name='Open space'),
+            x_coordinate=0, y_coordinate=0
+        )
+        self.user = User.objects.create(username='user')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.start = timezone.make_aware(timezone.datetime(2030, 1, 7, 9, 0))
+        other = User.objects.create(username='other')
+        self.existing = Reservation.objects.bulk_create([
+            Reservation(
+                user=other, desk=self.desk, status=status,
+                start_time=self.start + timedelta(days=day, hours=hours),
+                end_time=self.start + timedelta(days=day, hours=hours + 1)
+            )
+            for day, hours, status in [
+                (2, 3, ReservationStatus.ACTIVE),
+                (5, 7, ReservationStatus.ACTIVE),
+                # Отмененное и примыкающее к окну бронирования не мешают
+                (3, 0, ReservationStatus.CANCELLED),
+                (4, 8, ReservationStatus.ACTIVE),
+            ]
+        ])
+
+    def occurrences(self):
+        return [(self.start, self.start + timedelta(hours=8))] + generate_occurrences(
+            self.start, self.start + timedelta(hours=8), RecurrencePattern.DAILY, date(2030, 1, 14)
+        )
+
+    def test_one_query_for_whole_series(self):
+        with CaptureQueriesContext(connection) as queries:
+            conflicts = find_conflicting_occurrences(self.desk, self.occurrences())
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(conflicts, [self.start + timedelta(days=2), self.start + timedelta(days=5)])
+
+        # Обновляемое бронирование не конфликтует само с собой
+        conflicts = find_conflicting_occurrences(self.desk.id, self.occurrences(), exclude_id=self.existing[0].id)
+        self.assertEqual(conflicts, [self.start + timedelta(days=5)])
+        self.assertEqual(find_conflicting_occurrences(self.desk, []), [])
+
+    def test_conflicting_dates_in_response(self):
+        response = self.client.post('/api/reservations/', {
+            'desk': self.desk.id,
+            'start_time': self.start.isoformat(),
+            'end_time': (self.start + timedelta(hours=8)).isoformat(),
+            'reservation_type': ReservationType.RECURRING,
+            'recurrence_pattern': RecurrencePattern.DAILY,
+            'recurrence_end_date': '2030-01-14',
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['conflicting_dates'], ['2030-01-09', '2030-01-12'])
+        self.assertIn('desk', response.data)
+        self.assertFalse(Reservation.objects.filter(user=self.user).exists())
+
+
+class DeskOverlapConstraintTests(TestCase):
+    """Ограничение исключения против двойного бронирования стола."""
+
+    def setUp(self):
+        super().setUp()
+        self.desk = Desk.objects.create(
+            name='Desk', desk_number='D1', area=Area.objects.create(name='Open space'),
+            x_coordinate=0, y_coordinate=0
+        )
+        self.user = User.objects.create(username='user')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.start = timezone.now().replace(hour=9, minute=0, second=0, microsecond=0) + timedelta(days=1)
+        self.booked = Reservation.objects.create(
+            user=User.objects.create(username='other'), desk=self.desk,
+            start_time=self.start, end_time=self.start + timedelta(hours=4)
+        )
+
+    def book(self, start_hours, end_hours):
+        return self.client.post('/api/reservations/', {
+            'desk': self.desk.id,
+            'start_time': (self.start + timedelta(hours=start_hours)).isoformat(),
+            'end_time': (self.start + timedelta(hours=end_hours)).isoformat(),
+        }, format='json')
+
+    def test_overlap_rejected_by_database(self):
+        with self.assertRaises(IntegrityError) as caught, transaction.atomic():
+            Reservation.objects.create(
+                user=self.user, desk=self.desk,
+                start_time=self.start + timedelta(hours=3), end_time=self.start + timedelta(hours=5)
+            )
+        self.assertTrue(is_desk_overlap_error(caught.exception))
+
+    def test_overlap_maps_to_desk_already_booked(self):
+        response = self.book(2, 6)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['desk'], [DESK_ALREADY_BOOKED_MESSAGE])
+
+        # Примыкающее бронирование допустимо
+        self.assertEqual(self.book(4, 6).status_code, 201)
+
+        # Отмененное бронирование стол не держит
+        self.booked.status = ReservationStatus.CANCELLED
+        self.booked.save()
+        self.assertEqual(self.book(0, 2).status_code, 201)
+
+
+class ExplainHotQueriesCommandTests(TestCase):
+    """Команда explain_hot_queries на тестовой базе."""
+
+    def setUp(self):
+        super().setUp()
+        # С пользователем и столом в базе проверяются и их горячие запросы
+        self.user = User.objects.create(username='user')
+        self.desk = Desk.objects.create(
+            name='D1', desk_number='D1', area=Area.objects.create(name='Open space'),
+            x_coordinate=0, y_coordinate=0
+        )
+
+    def test_seed_and_analyze(self):
+        out = StringIO()
+        call_command('explain_hot_queries', '--seed', '500', '--analyze', stdout=out)
+        output = out.getvalue()
+
+        self.assertIn('Создано тестовых бронирований: 500', output)
+        names = [name for name, _, _ in ExplainHotQueriesCommand().get_hot_queries()]
+        self.assertEqual(len(names), 9)
+        for name in names:
+            self.assertIn(f'{name}:', output)
+
+        # Тестовые данные не остаются в базе
+        self.assertFalse(Reservation.objects.exists())
+        self.assertEqual(list(Desk.objects.all()), [self.desk])
+        self.assertEqual(list(User.objects.all()), [self.user])
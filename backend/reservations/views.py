@@ -1,9 +1,15 @@
+import json
 from django.utils import timezone
 from django.db.models import Q
 from rest_framework import viewsets, status, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils import encoders
 from django_filters.rest_framework import DjangoFilterBackend
+from core.pagination import KeysetPagination
+from core.renderers import CompactJSONRenderer, NDJSONRenderer, columns, epoch, ndjson_line
+from core.streaming import iter_chunks, streaming_response
 from .models import Reservation, ReservationStatus
 from .serializers import (
     ReservationSerializer,
@@ -12,10 +18,19 @@ from .serializers import (
 )
 
 
+# Окно календаря по умолчанию и максимальное окно (в днях)
+CALENDAR_DEFAULT_DAYS = 31
+CALENDAR_MAX_DAYS = 92
+
+# Размер пачки при потоковой выдаче календаря
+CALENDAR_CHUNK_SIZE = 500
+
+
 class ReservationViewSet(viewsets.ModelViewSet):
     """ViewSet для работы с бронированиями."""
     
     serializer_class = ReservationSerializer
+    pagination_class = KeysetPagination
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
     filterset_fields = ['desk', 'status', 'reservation_type', 'recurrence_pattern']
     search_fields = ['notes']
@@ -25,11 +40,12 @@ class ReservationViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         """Получение списка бронирований в зависимости от пользователя."""
         user = self.request.user
+        queryset = ReservationSerializer.setup_eager_loading(Reservation.objects.all())
         if user.is_staff:
             # Администраторы видят все бронирования
-            return Reservation.objects.all()
+            return queryset
         # Обычные пользователи видят только свои бронирования
-        return Reservation.objects.filter(user=user)
+        return queryset.filter(user=user)
     
     def get_serializer_class(self):
         """Выбор сериализатора в зависимости от действия."""
@@ -78,7 +94,7 @@ class ReservationViewSet(viewsets.ModelViewSet):
         """Получить текущее активное бронирование пользователя."""
         now = timezone.now()
         
-        current_reservation = Reservation.objects.filter(
+        current_reservation = ReservationSerializer.setup_eager_loading(Reservation.objects).filter(
             user=request.user,
             status=ReservationStatus.ACTIVE,
             start_time__lte=now,
@@ -98,7 +114,7 @@ class ReservationViewSet(viewsets.ModelViewSet):
         """Получить предстоящие бронирования пользователя."""
         now = timezone.now()
         
-        upcoming_reservations = Reservation.objects.filter(
+        upcoming_reservations = ReservationSerializer.setup_eager_loading(Reservation.objects).filter(
             user=request.user,
             status=ReservationStatus.ACTIVE,
             start_time__gt=now
@@ -112,40 +128,160 @@ class ReservationViewSet(viewsets.ModelViewSet):
         serializer = self.get_serializer(upcoming_reservations, many=True)
         return Response(serializer.data)
     
-    @action(detail=False, methods=['get'])
+    @action(
+        detail=False,
+        methods=['get'],
+        renderer_classes=api_settings.DEFAULT_RENDERER_CLASSES + [NDJSONRenderer, CompactJSONRenderer]
+    )
     def calendar(self, request):
-        """Получить бронирования для календаря."""
+        """
+        Получить бронирования для календаря.
+        
+        Окно дат ограничено CALENDAR_MAX_DAYS: без start берется начало текущего
+        дня, без end — CALENDAR_DEFAULT_DAYS от начала окна. Фактическое окно
+        возвращается в заголовках X-Calendar-Start и X-Calendar-End. JSON и
+        NDJSON (?format=ndjson или Accept: application/x-ndjson) отдаются потоком
+        из серверного курсора пачками по CALENDAR_CHUNK_SIZE. ?format=compact
+        возвращает колонки значений и справочники пользователей и столов.
+        """
         # Получаем параметры фильтрации
-        start_date = request.query_params.get('start')
-        end_date = request.query_params.get('end')
+        try:
+            start_date = self._parse_calendar_datetime(request.query_params.get('start'))
+            end_date = self._parse_calendar_datetime(request.query_params.get('end'))
+        except ValueError:
+            return Response(
+                {"error": "Неверный формат даты. Используйте ISO 8601."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         desk_id = request.query_params.get('desk')
         
+        # Ограничиваем окно, чтобы запрос не выгружал всю таблицу бронирований
+        if not start_date:
+            start_date = timezone.make_aware(
+                timezone.datetime.combine(timezone.localdate(), timezone.datetime.min.time())
+            )
+        if not end_date:
+            end_date = start_date + timezone.timedelta(days=CALENDAR_DEFAULT_DAYS)
+        if end_date < start_date:
+            return Response(
+                {"error": "Дата окончания должна быть не раньше даты начала."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        end_date = min(end_date, start_date + timezone.timedelta(days=CALENDAR_MAX_DAYS))
+        
         # Фильтр по умолчанию - активные бронирования текущего пользователя
-        queryset = Reservation.objects.filter(status=ReservationStatus.ACTIVE)
+        queryset = Reservation.objects.filter(
+            status=ReservationStatus.ACTIVE,
+            end_time__gte=start_date,
+            start_time__lte=end_date
+        )
         
         # Если пользователь администратор, может видеть все бронирования
         if not request.user.is_staff:
             queryset = queryset.filter(user=request.user)
         
-        # Применяем фильтры дат, если они указаны
-        if start_date:
-            try:
-                start_date = timezone.datetime.fromisoformat(start_date)
-                queryset = queryset.filter(end_time__gte=start_date)
-            except ValueError:
-                pass
-        
-        if end_date:
-            try:
-                end_date = timezone.datetime.fromisoformat(end_date)
-                queryset = queryset.filter(start_time__lte=end_date)
-            except ValueError:
-                pass
-        
         # Фильтр по столу
         if desk_id:
             queryset = queryset.filter(desk_id=desk_id)
         
-        # Сериализуем данные
-        serializer = self.get_serializer(queryset, many=True)
-        return Response(serializer.data)
\ No newline at end of file
+        queryset = queryset.order_by('start_time', 'id')
+        
+        renderer_format = request.accepted_renderer.format
+        if renderer_format == 'compact':
+            response = Response(self._compact_calendar(queryset))
+        elif renderer_format == 'ndjson':
+            response = streaming_response(
+                request,
+                self._iter_ndjson(ReservationSerializer.setup_eager_loading(queryset)),
+                NDJSONRenderer.media_type
+            )
+        elif renderer_format == 'json':
+            response = streaming_response(
+                request,
+                self._iter_json_array(ReservationSerializer.setup_eager_loading(queryset)),
+                'application/json'
+            )
+        else:
+            # Browsable API и прочие форматы рендерятся как обычно
+            serializer = self.get_serializer(
+                ReservationSerializer.setup_eager_loading(queryset), many=True
+            )
+            response = Response(serializer.data)
+        
+        response['X-Calendar-Start'] = start_date.isoformat()
+        response['X-Calendar-End'] = end_date.isoformat()
+        return response
+    
+    @staticmethod
+    def _parse_calendar_datetime(value):
+        """Разбор даты или даты со временем в формате ISO 8601."""
+        if not value:
+            return None
+        parsed = timezone.datetime.fromisoformat(value)
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
+    
+    @staticmethod
+    def _compact_calendar(queryset):
+        """
+        Календарь в колоночном виде.
+        
+        Бронирования отдаются колонками (время — секунды Unix), а пользователи
+        и столы — справочниками по id, без повторения на каждой строке.
+        """
+        rows = []
+        users = {}
+        desks = {}
+        for row in queryset.values_list(
+            'id', 'desk_id', 'user_id', 'start_time', 'end_time', 'status',
+            'reservation_type', 'check_in_time',
+            'user__username', 'user__first_name', 'user__last_name', 'user__telegram_photo_url',
+            'desk__desk_number', 'desk__name'
+        ).iterator(chunk_size=CALENDAR_CHUNK_SIZE):
+            (reservation_id, desk_id, user_id, start_time, end_time, reservation_status,
+             reservation_type, check_in_time, username, first_name, last_name, photo_url,
+             desk_number, desk_name) = row
+            rows.append((
+                reservation_id, desk_id, user_id, epoch(start_time), epoch(end_time),
+                reservation_status, reservation_type, epoch(check_in_time)
+            ))
+            if user_id not in users:
+                users[user_id] = {
+                    'username': username,
+                    'first_name': first_name,
+                    'last_name': last_name,
+                    'telegram_photo_url': photo_url,
+                }
+            if desk_id not in desks:
+                desks[desk_id] = {'desk_number': desk_number, 'name': desk_name}
+        
+        data = columns(rows, [
+            'ids', 'desk_ids', 'user_ids', 'starts', 'ends',
+            'statuses', 'reservation_types', 'check_ins'
+        ])
+        data['users'] = users
+        data['desks'] = desks
+        return data
+    
+    def _iter_serialized_chunks(self, queryset):
+        """Сериализованные пачки бронирований из серверного курсора."""
+        context = self.get_serializer_context()
+        for chunk in iter_chunks(queryset, CALENDAR_CHUNK_SIZE):
+            yield ReservationSerializer(chunk, many=True, context=context).data
+    
+    def _iter_ndjson(self, queryset):
+        """Поток NDJSON: одна строка на бронирование."""
+        for rows in self._iter_serialized_chunks(queryset):
+            yield ''.join(ndjson_line(row) for row in rows).encode('utf-8')
+    
+    def _iter_json_array(self, queryset):
+        """Поток JSON-массива, собираемого из пачек."""
+        yield b'['
+        separator = b''
+        for rows in self._iter_serialized_chunks(queryset):
+            body = json.dumps(rows, cls=encoders.JSONEncoder, ensure_ascii=False)
+            # Убираем скобки массива пачки и склеиваем пачки через запятую
+            yield separator + body[1:-1].encode('utf-8')
+            separator = b','
+        yield b']'
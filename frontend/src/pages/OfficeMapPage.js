@@ -22,6 +22,7 @@ import DatePicker from '../components/common/DatePicker';
 import TimeRangePicker from '../components/common/TimeRangePicker';
 import DeskDetail from '../components/map/DeskDetail';
 import LoadingSpinner from '../components/common/LoadingSpinner';
+import websocketService from '../services/websocketService';
 
 const OfficeMapPage = () => {
   const dispatch = useDispatch();
@@ -42,6 +43,13 @@ const OfficeMapPage = () => {
     }
   }, [layouts, selectedFloor]);
 
+  // Получаем обновления столов только для выбранного этажа
+  useEffect(() => {
+    if (selectedFloor) {
+      websocketService.subscribeFloors([selectedFloor]);
+    }
+  }, [selectedFloor]);
+
   // Загружаем детали схемы для выбранного этажа
   useEffect(() => {
     if (selectedFloor) {
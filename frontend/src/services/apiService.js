@@ -93,6 +93,20 @@ const apiService = {
       return api.get(url);
     },
 
+    // Получение количества свободных столов по дням за диапазон дат
+    getHeatmap(startDate, endDate, timeFrom, timeTo, groupBy) {
+      const params = { start: startDate, end: endDate };
+      if (timeFrom) params.time_from = timeFrom;
+      if (timeTo) params.time_to = timeTo;
+      if (groupBy) params.group_by = groupBy;
+      return api.get('/api/desks/heatmap/', { params });
+    },
+
+    // Присутствующие сотрудники и фактически занятые столы этажа
+    getPresence(floor) {
+      return api.get('/api/desks/presence/', { params: { floor } });
+    },
+
     // Получение зон офиса
     getAreas() {
       return api.get('/api/desks/areas/');
@@ -169,6 +183,18 @@ const apiService = {
       return api.get(`/api/office/layouts/${id}/`);
     },
 
+    // Элементы и столы схемы в видимой области [x1, y1, x2, y2]
+    getViewport(layoutId, bbox) {
+      return api.get(`/api/office/layouts/${layoutId}/viewport/`, {
+        params: { bbox: bbox.join(',') },
+      });
+    },
+
+    // Элементы и столы схемы под точкой
+    hitTest(layoutId, x, y) {
+      return api.get(`/api/office/layouts/${layoutId}/hit/`, { params: { x, y } });
+    },
+
     // Получение элементов схемы офиса
     getElements(layoutId) {
       return api.get(`/api/office/elements/?layout=${layoutId}`);
@@ -1,8 +1,11 @@
 import { WS_URL } from '../config';
-import { updateDeskStatus } from '../store/desksSlice';
+import { updateDeskStatus, updateDesksStatus, updateDesksPositions } from '../store/desksSlice';
 import { updateReservationStatus } from '../store/reservationsSlice';
 import { addNotification } from '../store/uiSlice';
 
+// Сколько ждать пропущенный номер события, прежде чем запросить досылку
+const GAP_RESUME_DELAY = 1000;
+
 class WebSocketService {
   constructor() {
     this.socket = null;
@@ -11,6 +14,12 @@ class WebSocketService {
     this.maxReconnectAttempts = 5;
     this.reconnectTimeout = null;
     this.store = null;
+    this.floors = [];
+    // Последний полученный номер события по каждой группе для возобновления
+    this.positions = {};
+    // События, пришедшие раньше предыдущих номеров: {группа: {seq: событие}}
+    this.pending = {};
+    this.gapTimeout = null;
   }
 
   // Инициализация службы WebSocket с хранилищем Redux
@@ -31,7 +40,9 @@ class WebSocketService {
     }
 
     try {
-      this.socket = new WebSocket(`${WS_URL}/ws/office/${token}/`);
+      // С ?resume=1 сервер придерживает живые события до досылки пропущенных
+      const resume = Object.keys(this.positions).length > 0 ? '?resume=1' : '';
+      this.socket = new WebSocket(`${WS_URL}/ws/office/${token}/${resume}`);
 
       // Обработчик открытия соединения
       this.socket.onopen = () => {
@@ -39,6 +50,16 @@ class WebSocketService {
         this.connected = true;
         this.reconnectAttempts = 0;
 
+        // Восстанавливаем подписку на этажи после (пере)подключения
+        if (this.floors.length > 0) {
+          this.send({ type: 'subscribe', floors: this.floors });
+        }
+
+        // Запрашиваем события, пропущенные за время разрыва
+        if (resume) {
+          this.resume();
+        }
+
         // Отправляем пинг для проверки соединения каждые 30 секунд
         this.pingInterval = setInterval(() => {
           this.ping();
@@ -56,6 +77,8 @@ class WebSocketService {
         console.log('WebSocket disconnected');
         
         clearInterval(this.pingInterval);
+        clearTimeout(this.gapTimeout);
+        this.gapTimeout = null;
         
         // Попытка переподключения
         if (this.reconnectAttempts < this.maxReconnectAttempts) {
@@ -87,6 +110,8 @@ class WebSocketService {
     
     clearInterval(this.pingInterval);
     clearTimeout(this.reconnectTimeout);
+    clearTimeout(this.gapTimeout);
+    this.gapTimeout = null;
   }
 
   // Отправка сообщения на сервер
@@ -98,6 +123,25 @@ class WebSocketService {
     }
   }
 
+  // Подписка на обновления столов указанных этажей вместо текущих
+  subscribeFloors(floors) {
+    const previous = this.floors;
+    this.floors = floors;
+
+    if (!this.socket || !this.connected) return;
+
+    const removed = previous.filter(floor => !floors.includes(floor));
+    if (removed.length > 0) {
+      this.send({ type: 'unsubscribe', floors: removed });
+    }
+    this.send({ type: 'subscribe', floors });
+  }
+
+  // Запрос событий после последних полученных номеров
+  resume() {
+    this.send({ type: 'resume', positions: this.positions });
+  }
+
   // Отправка пинга для проверки соединения
   ping() {
     this.send({
@@ -109,33 +153,132 @@ class WebSocketService {
   // Обработка входящих сообщений
   handleMessage(event) {
     try {
-      const data = JSON.parse(event.data);
-      
-      switch (data.type) {
-        case 'connection_established':
-          console.log('WebSocket connection established:', data.message);
-          break;
-          
-        case 'pong':
-          console.log('Pong received:', Date.now() - data.timestamp, 'ms');
-          break;
-          
-        case 'desk_status_update':
-          this.handleDeskStatusUpdate(data);
-          break;
-          
-        case 'reservation_update':
-          this.handleReservationUpdate(data);
-          break;
-          
-        default:
-          console.log('Unknown message type:', data.type);
-      }
+      this.processMessage(JSON.parse(event.data));
     } catch (error) {
       console.error('Error parsing WebSocket message:', error, event.data);
     }
   }
 
+  // Обработка одного сообщения с учетом порядка номеров событий
+  processMessage(data) {
+    if (data.type === 'snapshot') {
+      // Снимок заменяет состояние группы целиком
+      this.positions[data.stream] = data.seq;
+      this.handleSnapshot(data);
+      this.drainPending(data.stream);
+      return;
+    }
+
+    if (!data.stream || !data.seq) {
+      this.applyMessage(data);
+      return;
+    }
+
+    const last = this.positions[data.stream] || 0;
+    // Событие, уже полученное до переподключения, пропускаем
+    if (data.seq <= last) return;
+
+    if (last && data.seq > last + 1) {
+      // Предыдущие события еще не пришли: применяем только подряд идущие номера
+      (this.pending[data.stream] = this.pending[data.stream] || {})[data.seq] = data;
+      this.scheduleGapResume();
+      return;
+    }
+
+    this.positions[data.stream] = data.seq;
+    this.applyMessage(data);
+    this.drainPending(data.stream);
+  }
+
+  // Применить отложенные события группы, ставшие следующими по порядку
+  drainPending(stream) {
+    const pending = this.pending[stream];
+    if (!pending) return;
+
+    Object.keys(pending).forEach((seq) => {
+      if (Number(seq) <= this.positions[stream]) delete pending[seq];
+    });
+    while (pending[this.positions[stream] + 1]) {
+      const next = pending[this.positions[stream] + 1];
+      delete pending[next.seq];
+      this.positions[stream] = next.seq;
+      this.applyMessage(next);
+    }
+    if (Object.keys(pending).length === 0) {
+      delete this.pending[stream];
+    }
+  }
+
+  // Запросить досылку, если пропуск в номерах не закрылся сам
+  scheduleGapResume() {
+    if (this.gapTimeout) return;
+
+    this.gapTimeout = setTimeout(() => {
+      this.gapTimeout = null;
+      if (Object.keys(this.pending).length > 0) {
+        this.resume();
+      }
+    }, GAP_RESUME_DELAY);
+  }
+
+  // Применение сообщения к состоянию приложения
+  applyMessage(data) {
+    switch (data.type) {
+      case 'batch':
+        // Несколько изменений, отправленных сервером одним кадром
+        data.messages.forEach((message) => this.processMessage(message));
+        break;
+        
+      case 'connection_established':
+        console.log('WebSocket connection established:', data.message);
+        break;
+        
+      case 'subscribed':
+        console.log('WebSocket floors subscribed:', data.floors);
+        break;
+        
+      case 'resumed':
+        Object.entries(data.positions).forEach(([stream, seq]) => {
+          this.positions[stream] = Math.max(this.positions[stream] || 0, seq);
+          this.drainPending(stream);
+        });
+        break;
+        
+      case 'error':
+        console.warn('WebSocket message rejected:', data.error);
+        break;
+        
+      case 'pong':
+        console.log('Pong received:', Date.now() - data.timestamp, 'ms');
+        break;
+        
+      case 'desk_status_update':
+        this.handleDeskStatusUpdate(data);
+        break;
+        
+      case 'reservation_update':
+        this.handleReservationUpdate(data);
+        break;
+        
+      case 'desks_reset':
+        this.handleDesksReset(data);
+        break;
+        
+      case 'desks_positions_update':
+        if (this.store) {
+          this.store.dispatch(updateDesksPositions(data.desks));
+        }
+        break;
+        
+      case 'reservations_batch_update':
+        this.handleReservationsBatchUpdate(data);
+        break;
+        
+      default:
+        console.log('Unknown message type:', data.type);
+    }
+  }
+
   // Обработка обновления статуса стола
   handleDeskStatusUpdate(data) {
     if (!this.store) return;
@@ -191,6 +334,58 @@ class WebSocketService {
       }
     }
   }
+
+  // Обработка полного снимка группы: столы этажа или свои бронирования
+  handleSnapshot(data) {
+    if (!this.store) return;
+    
+    if (data.desks) {
+      const byStatus = {};
+      data.desks.forEach((desk) => {
+        (byStatus[desk.status] = byStatus[desk.status] || []).push(desk.id);
+      });
+      Object.entries(byStatus).forEach(([status, deskIds]) => {
+        this.store.dispatch(updateDesksStatus({ deskIds, status }));
+      });
+    }
+    
+    if (data.reservations) {
+      data.reservations.forEach((reservation) => {
+        this.store.dispatch(
+          updateReservationStatus({
+            reservationId: reservation.id,
+            status: reservation.status
+          })
+        );
+      });
+    }
+  }
+
+  // Обработка сброса статусов столов в конце дня
+  handleDesksReset(data) {
+    if (!this.store) return;
+    
+    this.store.dispatch(
+      updateDesksStatus({
+        deskIds: data.desk_ids,
+        status: data.status
+      })
+    );
+  }
+
+  // Обработка массовой смены статуса бронирований (завершение, неявка)
+  handleReservationsBatchUpdate(data) {
+    if (!this.store) return;
+    
+    data.reservation_ids.forEach((reservationId) => {
+      this.store.dispatch(
+        updateReservationStatus({
+          reservationId,
+          status: data.status
+        })
+      );
+    });
+  }
 }
 
 // Создаем и экспортируем экземпляр сервиса
@@ -132,6 +132,41 @@ const desksSlice = createSlice({
         state.selectedDesk.status = status;
       }
     },
+    updateDesksStatus: (state, action) => {
+      // Массовое обновление одним действием, чтобы карта перерисовалась один раз
+      const { deskIds, status } = action.payload;
+      const ids = new Set(deskIds);
+      
+      state.desks.forEach((desk) => {
+        if (ids.has(desk.id)) {
+          desk.status = status;
+        }
+      });
+      
+      state.availableDesks.forEach((desk) => {
+        if (ids.has(desk.id)) {
+          desk.status = status;
+        }
+      });
+      
+      if (state.selectedDesk && ids.has(state.selectedDesk.id)) {
+        state.selectedDesk.status = status;
+      }
+    },
+    updateDesksPositions: (state, action) => {
+      // Перемещение столов в редакторе схемы одним действием
+      const positions = new Map(action.payload.map((desk) => [desk.id, desk]));
+      
+      [state.desks, state.availableDesks].forEach((desks) => {
+        desks.forEach((desk) => {
+          const position = positions.get(desk.id);
+          if (position) {
+            desk.x_coordinate = position.x_coordinate;
+            desk.y_coordinate = position.y_coordinate;
+          }
+        });
+      });
+    },
   },
   extraReducers: (builder) => {
     builder
@@ -199,6 +234,6 @@ const desksSlice = createSlice({
   },
 });
 
-export const { selectDesk, clearSelectedDesk, updateDeskStatus } = desksSlice.actions;
+export const { selectDesk, clearSelectedDesk, updateDeskStatus, updateDesksStatus, updateDesksPositions } = desksSlice.actions;
 
 export default desksSlice.reducer;
\ No newline at end of file